@@ -0,0 +1,261 @@
+"""
+PDF Structure Master - 解析インデックス（SQLite）
+- 本の内容ハッシュをキーに、ページごとのフォント統計・目次ページの位置・自動検出した見出し候補・
+  ユーザーが最後に編集した章構成を保存する
+- 一度開いた本は、開き直したときに解析をやり直さずに章構成を表示できる
+- ライブラリ全体（解析済みの全冊）の一覧・見出し検索にも使う
+Streamlit に依存しないため、UI 以外（バッチ処理など）からも使える。
+"""
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List
+
+from disk_cache import DEFAULT_CACHE_ROOT
+from pdf_processor import ChapterInfo, PageFontStats, PDFProcessor
+
+# インデックスの保存先（環境変数 PDF_MASTER_INDEX_PATH で変更可能）
+ANALYSIS_INDEX_PATH = os.environ.get("PDF_MASTER_INDEX_PATH", str(DEFAULT_CACHE_ROOT / "analysis.sqlite3"))
+# 見出し検出の手順を変えたら上げる（古い自動検出結果を使わないようにする）
+DETECTOR_VERSION = 1
+# ユーザーが編集した章構成の detector 名
+EDITED_TABLE = "edited"
+# 複数プロセス（バッチ処理）から同時に書き込むときの待ち時間（秒）
+SQLITE_TIMEOUT_SECONDS = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    doc_hash TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    page_count INTEGER NOT NULL,
+    body_size REAL,
+    toc_pages TEXT NOT NULL DEFAULT '[]',
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS page_stats (
+    doc_hash TEXT NOT NULL,
+    page_index INTEGER NOT NULL,
+    body_size REAL,
+    max_size REAL,
+    char_count INTEGER NOT NULL,
+    PRIMARY KEY (doc_hash, page_index)
+);
+CREATE TABLE IF NOT EXISTS chapter_tables (
+    doc_hash TEXT NOT NULL,
+    detector TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    PRIMARY KEY (doc_hash, detector)
+);
+CREATE TABLE IF NOT EXISTS headings (
+    doc_hash TEXT NOT NULL,
+    detector TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    page_num INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    selected INTEGER NOT NULL,
+    PRIMARY KEY (doc_hash, detector, position)
+);
+CREATE INDEX IF NOT EXISTS headings_title ON headings (title);
+"""
+
+
+def detector_key(header_scale: float, min_page_gap: int) -> str:
+    """読み込み直後の自動検出（detect_chapters）の結果を保存するときの detector 名。"""
+    return f"auto:v{DETECTOR_VERSION}:{header_scale}:{min_page_gap}"
+
+
+@dataclass
+class BookRecord:
+    """ライブラリ一覧の1冊分。"""
+    doc_hash: str
+    title: str
+    page_count: int
+    body_size: float | None
+    toc_pages: List[int]
+    chapter_count: int
+    edited: bool
+    updated_at: float
+
+
+@dataclass
+class HeadingHit:
+    """見出し検索の1件分。"""
+    doc_hash: str
+    book_title: str
+    title: str
+    page_num: int
+    edited: bool
+
+
+class AnalysisIndex:
+    """
+    解析結果の SQLite インデックス。
+    操作ごとに接続を開き直すので、スレッド・プロセスをまたいで共有してよい。
+    """
+
+    def __init__(self, path=ANALYSIS_INDEX_PATH):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            # 書き込み中でも他の接続から読めるようにする
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT_SECONDS)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record_book(
+        self,
+        doc_hash: str,
+        title: str,
+        page_count: int,
+        body_size: float | None,
+        toc_pages: List[int],
+        page_stats: List[PageFontStats] = (),
+    ) -> None:
+        """本の情報を登録する。page_stats が空なら、登録済みのページ統計はそのまま残す。"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO books (doc_hash, title, page_count, body_size, toc_pages, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (doc_hash, title, page_count, body_size, json.dumps(toc_pages), time.time()),
+            )
+            if page_stats:
+                conn.execute("DELETE FROM page_stats WHERE doc_hash = ?", (doc_hash,))
+                conn.executemany(
+                    "INSERT INTO page_stats (doc_hash, page_index, body_size, max_size, char_count)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [(doc_hash, s.page_index, s.body_size, s.max_size, s.char_count) for s in page_stats],
+                )
+
+    def save_chapters(self, doc_hash: str, detector: str, chapters: List[ChapterInfo]) -> None:
+        """detector（自動検出の設定、または EDITED_TABLE）ごとの章リストを置き換える。"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chapter_tables (doc_hash, detector, saved_at) VALUES (?, ?, ?)",
+                (doc_hash, detector, now),
+            )
+            conn.execute("DELETE FROM headings WHERE doc_hash = ? AND detector = ?", (doc_hash, detector))
+            conn.executemany(
+                "INSERT INTO headings (doc_hash, detector, position, title, page_num, level, source, selected)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (doc_hash, detector, i, c.title, c.page_num, c.level, c.source, int(c.selected))
+                    for i, c in enumerate(chapters)
+                ],
+            )
+            conn.execute("UPDATE books SET updated_at = ? WHERE doc_hash = ?", (now, doc_hash))
+
+    def load_chapters(self, doc_hash: str, detector: str) -> List[ChapterInfo] | None:
+        """保存済みの章リスト（未登録なら None。空の検出結果は空リスト）。"""
+        with self._connect() as conn:
+            saved = conn.execute(
+                "SELECT 1 FROM chapter_tables WHERE doc_hash = ? AND detector = ?", (doc_hash, detector)
+            ).fetchone()
+            rows = conn.execute(
+                "SELECT title, page_num, level, source, selected FROM headings"
+                " WHERE doc_hash = ? AND detector = ? ORDER BY position",
+                (doc_hash, detector),
+            ).fetchall()
+        if saved is None:
+            return None
+        return [
+            ChapterInfo(title=title, page_num=page_num, level=level, source=source, selected=bool(selected))
+            for title, page_num, level, source, selected in rows
+        ]
+
+    def load_page_stats(self, doc_hash: str) -> List[PageFontStats]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT page_index, body_size, max_size, char_count FROM page_stats"
+                " WHERE doc_hash = ? ORDER BY page_index",
+                (doc_hash,),
+            ).fetchall()
+        return [PageFontStats(*row) for row in rows]
+
+    def books(self) -> List[BookRecord]:
+        """解析済みの全冊（最近使った順）。章数は編集済みの章構成があればそちら、なければ最後の自動検出の件数。"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT b.doc_hash, b.title, b.page_count, b.body_size, b.toc_pages, b.updated_at,
+                       t.detector = ?,
+                       (SELECT COUNT(*) FROM headings h WHERE h.doc_hash = t.doc_hash AND h.detector = t.detector)
+                FROM books b
+                LEFT JOIN chapter_tables t ON t.doc_hash = b.doc_hash AND t.detector = (
+                    -- 編集済みの章構成があればそれ、なければ最後に保存した自動検出結果
+                    SELECT detector FROM chapter_tables WHERE doc_hash = b.doc_hash
+                    ORDER BY detector = ? DESC, saved_at DESC LIMIT 1
+                )
+                ORDER BY b.updated_at DESC
+                """,
+                (EDITED_TABLE, EDITED_TABLE),
+            ).fetchall()
+        return [
+            BookRecord(
+                doc_hash=doc_hash,
+                title=title,
+                page_count=page_count,
+                body_size=body_size,
+                toc_pages=json.loads(toc_pages),
+                chapter_count=chapter_count,
+                edited=bool(edited),
+                updated_at=updated_at,
+            )
+            for doc_hash, title, page_count, body_size, toc_pages, updated_at, edited, chapter_count in rows
+        ]
+
+    def search_headings(self, text: str, limit: int = 100) -> List[HeadingHit]:
+        """ライブラリ全体から、タイトルに text を含む見出しを探す（同じ本・同じページの重複はまとめる）。"""
+        pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT h.doc_hash, b.title, h.title, h.page_num, MAX(h.detector = ?)
+                FROM headings h JOIN books b ON b.doc_hash = h.doc_hash
+                WHERE h.title LIKE ? ESCAPE '\\'
+                GROUP BY h.doc_hash, h.title, h.page_num
+                ORDER BY b.title, h.page_num
+                LIMIT ?
+                """,
+                (EDITED_TABLE, pattern, limit),
+            ).fetchall()
+        return [
+            HeadingHit(doc_hash=doc_hash, book_title=book_title, title=title, page_num=page_num, edited=bool(edited))
+            for doc_hash, book_title, title, page_num, edited in rows
+        ]
+
+
+def record_analysis(
+    index: AnalysisIndex,
+    doc_hash: str,
+    processor: PDFProcessor,
+    detector: str | None = None,
+    chapters: List[ChapterInfo] | None = None,
+) -> None:
+    """
+    processor の解析結果（目次ページ・本文サイズ・抽出済みならページ統計）を doc_hash の本として登録し、
+    detector を指定すれば chapters をその検出結果として保存する。
+    """
+    index.record_book(
+        doc_hash,
+        processor.book_title,
+        len(processor.doc),
+        processor.layout.body_size(),
+        processor.find_toc_pages(),
+        processor.page_font_stats(),
+    )
+    if detector is not None:
+        index.save_chapters(doc_hash, detector, chapters or [])
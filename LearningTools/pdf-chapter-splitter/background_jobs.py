@@ -0,0 +1,142 @@
+"""
+PDF Structure Master - バックグラウンドジョブ
+- OCR・書き出しなどの長い処理をスレッドで実行し、画面の再実行をまたいで結果を保持する
+- 処理側は job.report(完了数, 総数) で進捗を伝え、取り消されていればそこで JobCancelled が送出される
+- 受付票（admission.AdmissionTicket）を渡すと、実行の許可が出るまで順番待ちしてから始める
+Streamlit に依存しないため、UI 以外からも使える。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+JOB_CANCELLED = "cancelled"
+# 順番待ちの間に取り消しを確認する間隔（秒）
+ADMISSION_POLL_SECONDS = 0.5
+
+
+class JobCancelled(Exception):
+    """ジョブが取り消された（report の呼び出し時に送出される）。"""
+
+
+class BackgroundJob:
+    """
+    1つの長い処理の状態（進捗・経過時間・結果）。
+    fn(job) の戻り値が result に、例外が error に入る。
+    ticket があれば、実行の許可が出るまで JOB_QUEUED のまま待ち、終わったら実行枠を返す。
+    """
+
+    def __init__(self, label: str, fn: Callable, ticket=None):
+        self.label = label
+        self.fn = fn
+        self.ticket = ticket
+        self.status = JOB_QUEUED
+        self.done = 0
+        self.total = None
+        self.phase = None
+        self.result = None
+        self.error: str | None = None
+        self.started_at = None
+        self.finished_at = None
+        self._phase_started_at = None
+        self._cancel = threading.Event()
+        self.future = None
+
+    def run(self):
+        try:
+            if self.ticket is not None:
+                while not self.ticket.wait(ADMISSION_POLL_SECONDS):
+                    if self._cancel.is_set():
+                        break
+            if self._cancel.is_set():
+                self.status = JOB_CANCELLED
+                return
+            self.status = JOB_RUNNING
+            self.started_at = self._phase_started_at = time.monotonic()
+            try:
+                self.result = self.fn(self)
+                self.status = JOB_DONE
+            except JobCancelled:
+                self.status = JOB_CANCELLED
+            except Exception as e:
+                self.error = str(e)
+                self.status = JOB_ERROR
+            finally:
+                self.finished_at = time.monotonic()
+        finally:
+            if self.ticket is not None:
+                self.ticket.release()
+
+    def report(self, done: int, total: int | None = None, phase: str | None = None) -> None:
+        """進捗を更新する。取り消し済みなら JobCancelled を送出して処理を中断させる。"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        if phase != self.phase:
+            # 段階が変わったら、残り時間の見積もりをやり直す
+            self.phase = phase
+            self._phase_started_at = time.monotonic()
+        self.done = done
+        self.total = total
+
+    def cancel(self) -> None:
+        """取り消しを要求する（実行中なら次の report で止まる）。"""
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            # 一度も実行されないので、ここで受付票を取り下げる
+            self.status = JOB_CANCELLED
+            if self.ticket is not None:
+                self.ticket.release()
+
+    @property
+    def queue_position(self) -> int:
+        """順番待ちの順番（1 = 次に実行。待っていなければ 0）。"""
+        if self.status != JOB_QUEUED or self.ticket is None:
+            return 0
+        return self.ticket.position
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_ERROR, JOB_CANCELLED)
+
+    @property
+    def fraction(self) -> float:
+        if not self.total:
+            return 0.0
+        return min(1.0, self.done / self.total)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def eta_seconds(self) -> float | None:
+        """現在の段階の進み具合から見積もった残り秒数（見積もれなければ None）。"""
+        if not self.total or not self.done or self._phase_started_at is None:
+            return None
+        spent = time.monotonic() - self._phase_started_at
+        return spent / self.done * (self.total - self.done)
+
+
+class JobRunner:
+    """
+    BackgroundJob をスレッドプールで実行する。
+    順番待ちのジョブもスレッドを1つ使うため、同時実行数の制限は受付票の側で行い、スレッド数は多めにしておく。
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf_master_job")
+
+    def submit(self, label: str, fn: Callable, ticket=None) -> BackgroundJob:
+        job = BackgroundJob(label, fn, ticket)
+        job.future = self._executor.submit(job.run)
+        return job
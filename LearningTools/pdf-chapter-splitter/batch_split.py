@@ -0,0 +1,291 @@
+"""
+PDF Structure Master - フォルダ内のPDFをまとめて章分割するコマンドライン版
+GUI と同じ手順（埋め込み目次 → 目次ページ → フォントサイズ解析 → 章タイトルパターン
+→ 『章』だけに整理）で章を決め、出力フォルダへそのまま書き出す。
+複数の本をプロセスプールで同時に処理し、本ごとの所要時間と章数を表示する。
+起動: python batch_split.py 入力フォルダ 出力フォルダ [--mode pdf|image] [--jobs N]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+# pdf-chapter-splitter と pdf-to-image で共有するモジュール（LearningTools/pdf-common）
+_COMMON_DIR = str(Path(__file__).resolve().parent.parent / "pdf-common")
+if _COMMON_DIR not in sys.path:
+    sys.path.append(_COMMON_DIR)
+
+from analysis_index import EDITED_TABLE, AnalysisIndex, detector_key, record_analysis
+from disk_cache import DEFAULT_CACHE_ROOT, DiskLRUCache
+from export_workers import (
+    COLOR_MODE_COLOR,
+    COLOR_MODE_LABELS,
+    PAGE_FILTER_KEEP,
+    PAGE_FILTER_LABELS,
+    SplitOptions,
+)
+from page_layout import DEFAULT_WORKERS
+from pdf_processor import (
+    OCR_AVAILABLE,
+    OCR_CACHE_MAX_BYTES,
+    OCR_MODE_LABELS,
+    PDFProcessor,
+    suggest_chapter_pattern_ids,
+)
+
+# GUI の「自動検出の粒度」と同じ組み合わせ（header_scale, min_page_gap）
+SENSITIVITY_PRESETS = {
+    "fine": (1.1, 1),
+    "normal": (1.3, 3),
+    "coarse": (1.5, 5),
+}
+
+
+@dataclass
+class BatchJob:
+    """1冊分の処理設定（ワーカープロセスへ渡す）。"""
+    pdf_path: str
+    output_dir: str
+    export_mode: str = "pdf"
+    img_zoom: float = 2.0
+    color_mode: str = COLOR_MODE_COLOR
+    page_filter: str = PAGE_FILTER_KEEP
+    sensitivity: str = "normal"
+    filter_chapters: bool = True
+    # GUI で編集・保存した章構成があればそれを使う
+    use_saved_chapters: bool = True
+    ocr_mode: str | None = None
+    split_options: SplitOptions | None = None
+
+
+@dataclass
+class BookResult:
+    """1冊分の処理結果。"""
+    pdf_path: str
+    pages: int = 0
+    chapters: int = 0
+    source: str = ""
+    analysis_seconds: float = 0.0
+    export_seconds: float = 0.0
+    # 空白・重複ページとして画像化を省いたページ数と、減った出力サイズ
+    skipped_pages: int = 0
+    bytes_saved: int = 0
+    error: str | None = None
+
+    @property
+    def total_seconds(self) -> float:
+        return self.analysis_seconds + self.export_seconds
+
+
+def process_book(job: BatchJob) -> BookResult:
+    """1冊を解析して書き出す。並列度は本の単位で取るため、本の中の処理は1プロセスで行う。"""
+    result = BookResult(pdf_path=job.pdf_path)
+    started = time.perf_counter()
+    try:
+        with open(job.pdf_path, "rb") as f:
+            processor = PDFProcessor(f, os.path.basename(job.pdf_path))
+    except Exception as e:
+        result.error = f"読み込みエラー: {e}"
+        return result
+    try:
+        result.pages = len(processor.doc)
+        # 解析インデックスのキーは OCR 前（入力ファイルそのもの）の内容ハッシュ
+        index = AnalysisIndex()
+        book_hash = processor.doc_hash
+        if job.ocr_mode is not None:
+            cache = DiskLRUCache(DEFAULT_CACHE_ROOT / "ocr", OCR_CACHE_MAX_BYTES, suffix=".pdf")
+            if not processor.run_ocr(mode=job.ocr_mode, jobs=1, cache=cache):
+                result.error = f"OCR処理エラー: {processor.last_ocr_error}"
+                return result
+        header_scale, min_page_gap = SENSITIVITY_PRESETS[job.sensitivity]
+        saved = index.load_chapters(book_hash, EDITED_TABLE) if job.use_saved_chapters else None
+        if saved is not None:
+            # GUI で出力対象にした章だけをそのまま使う（整理はユーザーが済ませている）
+            chapters = [c for c in saved if c.selected]
+        else:
+            chapters = processor.detect_chapters(header_scale, min_page_gap)
+            record_analysis(index, book_hash, processor, detector_key(header_scale, min_page_gap), chapters)
+        if saved is None and chapters and job.filter_chapters:
+            filtered = processor.filter_major_chapters(
+                chapters,
+                selected_pattern_ids=suggest_chapter_pattern_ids(chapters, processor.layout),
+                min_distance=5,
+            )
+            # GUI と同じく、章レベルの見出しを判定できなければ検出結果をそのまま使う
+            if filtered:
+                chapters = filtered
+        result.chapters = len(chapters)
+        result.source = "保存済みの章構成" if saved is not None else (chapters[0].source if chapters else "")
+        result.analysis_seconds = time.perf_counter() - started
+        if not chapters:
+            result.error = "章の区切りが見つかりませんでした"
+            return result
+
+        started = time.perf_counter()
+        processor.process_export(
+            chapters,
+            job.export_mode,
+            job.img_zoom,
+            output_dir=job.output_dir,
+            workers=1,
+            split_options=job.split_options,
+            color_mode=job.color_mode,
+            page_filter=job.page_filter,
+        )
+        result.export_seconds = time.perf_counter() - started
+        if processor.last_page_filter_report is not None:
+            result.skipped_pages = processor.last_page_filter_report.skipped_renders
+            result.bytes_saved = processor.last_page_filter_report.bytes_saved
+    except Exception as e:
+        result.error = f"処理エラー: {e}"
+    finally:
+        processor.close()
+    return result
+
+
+def find_pdfs(input_dir: Path, recursive: bool) -> List[Path]:
+    pattern = "**/*.pdf" if recursive else "*.pdf"
+    return sorted(p for p in input_dir.glob(pattern) if p.is_file())
+
+
+def plan_jobs(pdfs: List[Path], input_dir: Path, output_dir: Path, **options) -> List[BatchJob]:
+    """
+    入力フォルダの階層を出力側にも再現する（同名の本が別フォルダにあっても衝突しない）。
+    大きい本から先に投入し、最後に大物が1冊だけ残って待つ時間を減らす。
+    """
+    jobs = [
+        BatchJob(pdf_path=str(p), output_dir=str(output_dir / p.parent.relative_to(input_dir)), **options)
+        for p in pdfs
+    ]
+    return sorted(jobs, key=lambda j: os.path.getsize(j.pdf_path), reverse=True)
+
+
+def format_result(result: BookResult) -> str:
+    name = os.path.basename(result.pdf_path)
+    if result.error:
+        return f"NG  {name}: {result.error}（{result.total_seconds:.1f}秒）"
+    line = (
+        f"OK  {name}: {result.chapters}章 / {result.pages}ページ [{result.source}]"
+        f" 解析 {result.analysis_seconds:.1f}秒 + 書き出し {result.export_seconds:.1f}秒"
+    )
+    if result.skipped_pages:
+        line += f"（空白・重複 {result.skipped_pages}ページ省略, {result.bytes_saved / 1024 / 1024:.1f} MB 削減）"
+    return line
+
+
+def print_summary(results: List[BookResult], wall_seconds: float) -> None:
+    print()
+    print(f"{'ファイル':<40} {'ページ':>6} {'章':>4} {'解析(秒)':>9} {'書出(秒)':>9}  状態")
+    for r in results:
+        status = r.error or r.source
+        print(
+            f"{os.path.basename(r.pdf_path)[:40]:<40} {r.pages:>6} {r.chapters:>4}"
+            f" {r.analysis_seconds:>9.1f} {r.export_seconds:>9.1f}  {status}"
+        )
+    ok = [r for r in results if not r.error]
+    pages = sum(r.pages for r in ok)
+    print()
+    print(
+        f"成功 {len(ok)} / {len(results)} 冊、{pages} ページを {wall_seconds:.1f} 秒で処理"
+        f"（{pages / wall_seconds if wall_seconds else 0:.1f} ページ/秒）"
+    )
+    skipped = sum(r.skipped_pages for r in ok)
+    if skipped:
+        print(
+            f"空白・重複ページ {skipped} ページの画像化を省略"
+            f"（出力サイズ 約 {sum(r.bytes_saved for r in ok) / 1024 / 1024:.1f} MB 削減）"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="フォルダ内のPDFを章ごとに一括分割します。")
+    parser.add_argument("input_dir", type=Path, help="PDFのあるフォルダ")
+    parser.add_argument("output_dir", type=Path, help="書き出し先フォルダ（本のタイトルごとにフォルダを作成）")
+    parser.add_argument("--mode", choices=["pdf", "image"], default="pdf", help="分割PDF または 連番JPEG")
+    parser.add_argument("--zoom", type=float, default=2.0, help="画像モードの倍率（1.0=標準, 2.0=高画質, 3.0=超高画質）")
+    parser.add_argument(
+        "--color",
+        choices=list(COLOR_MODE_LABELS),
+        default=COLOR_MODE_COLOR,
+        help="画像モードの色の扱い（gray/bilevel は白黒ページだけをグレースケール/2値で保存）",
+    )
+    parser.add_argument(
+        "--pages",
+        choices=list(PAGE_FILTER_LABELS),
+        default=PAGE_FILTER_KEEP,
+        help="画像モードの空白・重複ページの扱い（skip=出力しない, placeholder=低解像度の代替画像, dedupe=使い回す）",
+    )
+    parser.add_argument("--jobs", type=int, default=DEFAULT_WORKERS, help="同時に処理する本の数")
+    parser.add_argument(
+        "--sensitivity", choices=list(SENSITIVITY_PRESETS), default="normal", help="自動検出の粒度（目次なし用）"
+    )
+    parser.add_argument("--no-filter", action="store_true", help="『章』だけに整理（重複除去）を行わない")
+    parser.add_argument(
+        "--ignore-saved", action="store_true", help="GUI で編集した章構成（解析インデックス）を使わず自動検出する"
+    )
+    parser.add_argument(
+        "--ocr",
+        choices=list(OCR_MODE_LABELS),
+        default=None,
+        help="解析前にOCRを実行する（結果はGUIと共有のOCRキャッシュに保存）",
+    )
+    parser.add_argument("--recursive", action="store_true", help="サブフォルダのPDFも対象にする")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.ocr is not None and not OCR_AVAILABLE:
+        print("Tesseract が見つからないため OCR を実行できません。", file=sys.stderr)
+        return 2
+    pdfs = find_pdfs(args.input_dir, args.recursive)
+    if not pdfs:
+        print(f"PDFが見つかりません: {args.input_dir}", file=sys.stderr)
+        return 1
+    jobs = plan_jobs(
+        pdfs,
+        args.input_dir,
+        args.output_dir,
+        export_mode=args.mode,
+        img_zoom=args.zoom,
+        color_mode=args.color,
+        page_filter=args.pages,
+        sensitivity=args.sensitivity,
+        filter_chapters=not args.no_filter,
+        use_saved_chapters=not args.ignore_saved,
+        ocr_mode=args.ocr,
+    )
+    workers = max(1, min(args.jobs, len(jobs)))
+    print(f"{len(jobs)} 冊を {workers} プロセスで処理します → {args.output_dir}")
+
+    started = time.perf_counter()
+    results = {}
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(process_book, job): job for job in jobs}
+            for done, future in enumerate(as_completed(futures), 1):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # ワーカープロセス自体が落ちた場合
+                    result = BookResult(pdf_path=job.pdf_path, error=f"ワーカーエラー: {e}")
+                results[job.pdf_path] = result
+                print(f"[{done}/{len(jobs)}] {format_result(result)}", flush=True)
+    else:
+        for done, job in enumerate(jobs, 1):
+            result = process_book(job)
+            results[job.pdf_path] = result
+            print(f"[{done}/{len(jobs)}] {format_result(result)}", flush=True)
+    wall_seconds = time.perf_counter() - started
+
+    print_summary([results[str(p)] for p in pdfs], wall_seconds)
+    return 0 if all(not r.error for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+PDF Structure Master - 章タイトルのパターン定義と一括マッチャー
+- CHAPTER_PATTERN_GROUPS: 書籍で使われやすい章タイトルのパターン（グループ化）
+- ChapterTitleMatcher: 有効なグループを1つの正規表現（グループ id ごとの名前付きグループの選択）にまとめ、
+  1回の走査でどのグループにマッチしたかを返す
+"""
+import re
+from functools import lru_cache
+from typing import List
+
+# さまざまな書籍で使われやすい「章タイトル」のパターン（グループ化）
+CHAPTER_PATTERN_GROUPS = [
+    {
+        "id": "ja_chapter",
+        "label": "日本語: 第1章 / 1章 / 第一章",
+        "patterns": [
+            re.compile(r"第?\s*[0-9０-９一二三四五六七八九十百千ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩ]+\s*章"),
+            re.compile(r"[0-9０-９一二三四五六七八九十]+\s*章"),
+        ],
+    },
+    {
+        "id": "ja_part",
+        "label": "日本語: 第1部 / 編 / 講 / 回",
+        "patterns": [
+            re.compile(r"第?\s*[0-9０-９一二三四五六七八九十]+\s*(部|編|講|回)"),
+        ],
+    },
+    {
+        "id": "en_chapter",
+        "label": "英語: Chapter / CHAPTER / Chap.",
+        "patterns": [
+            re.compile(r"\bchapter\s+[0-9ivxlcdm]+\b", re.IGNORECASE),
+            re.compile(r"\bchap\.\s*[0-9ivxlcdm]+\b", re.IGNORECASE),
+        ],
+    },
+    {
+        "id": "en_part_lesson",
+        "label": "英語: Part / Lesson",
+        "patterns": [
+            re.compile(r"\bpart\s+[0-9ivxlcdm]+\b", re.IGNORECASE),
+            re.compile(r"\blesson\s+[0-9ivxlcdm]+\b", re.IGNORECASE),
+        ],
+    },
+    {
+        "id": "eu_chapter",
+        "label": "その他: Kapitel / Chapitre / Capítulo / Capitolo / Глава など",
+        "patterns": [
+            re.compile(
+                r"\b(kapitel|chapitre|cap[ií]tulo|capitolo|capitulo|glava|глава)\s+[0-9ivxlcdm一二三四五六七八九十]+\b",
+                re.IGNORECASE,
+            ),
+        ],
+    },
+]
+
+# すべてのパターンを平坦化したリスト（デフォルト用）
+CHAPTER_TITLE_REGEXES = [p for g in CHAPTER_PATTERN_GROUPS for p in g["patterns"]]
+
+# 目次行のパターン（章パターンに加え、「1. はじめに」「1) はじめに」などにも対応）
+TOC_NUMBERED_GROUP = {
+    "id": "toc_numbered",
+    "label": "目次: 1. はじめに / 1) はじめに / 1 はじめに",
+    "patterns": [
+        re.compile(r"^\d+[\.\)]\s"),  # "1. " or "1) "
+        re.compile(r"^\d+\s+[^\d]"),  # "1 はじめに" (数字+スペース+非数字)
+    ],
+}
+TOC_ENTRY_PATTERNS = TOC_NUMBERED_GROUP["patterns"] + CHAPTER_TITLE_REGEXES
+
+
+def _scoped_pattern(pat: re.Pattern) -> str:
+    """パターン固有のフラグ（IGNORECASE）を、結合後も効くようにインラインのスコープ付きフラグにする。"""
+    if pat.flags & re.IGNORECASE:
+        return f"(?i:{pat.pattern})"
+    return f"(?:{pat.pattern})"
+
+
+class ChapterTitleMatcher:
+    """
+    複数のパターングループを1つの正規表現にまとめたマッチャー。
+    グループ id ごとに名前付きグループを作るため、パターンの数が増えても1回の走査で判定できる。
+    """
+
+    def __init__(self, groups: list):
+        self.group_ids = [g["id"] for g in groups]
+        self._bits = {gid: 1 << i for i, gid in enumerate(self.group_ids)}
+        alternatives = [
+            f"(?P<{g['id']}>{'|'.join(_scoped_pattern(p) for p in g['patterns'])})"
+            for g in groups
+            if g["patterns"]
+        ]
+        self.regex = re.compile("|".join(alternatives)) if alternatives else None
+
+    def search(self, text: str) -> str | None:
+        """最初にマッチしたグループの id（どれにもマッチしなければ None）。"""
+        if self.regex is None:
+            return None
+        m = self.regex.search(text)
+        return m.lastgroup if m else None
+
+    def matched_ids(self, text: str) -> set:
+        """テキストを左から1回走査して見つかったグループ id の集合。"""
+        if self.regex is None:
+            return set()
+        return {m.lastgroup for m in self.regex.finditer(text)}
+
+    def match_bits(self, text: str) -> int:
+        """matched_ids をビットマスク（group_ids の i 番目 = bit i）にしたもの。"""
+        bits = 0
+        for gid in self.matched_ids(text):
+            bits |= self._bits[gid]
+        return bits
+
+
+@lru_cache(maxsize=64)
+def _cached_matcher(group_ids: tuple) -> ChapterTitleMatcher:
+    return ChapterTitleMatcher([g for g in CHAPTER_PATTERN_GROUPS if g["id"] in group_ids])
+
+
+def get_chapter_matcher(selected_pattern_ids: List[str] | None = None) -> ChapterTitleMatcher:
+    """
+    選択されたパターン id の組ごとにキャッシュしたマッチャーを返す。
+    未選択（None・空）のときは全パターン。
+    """
+    if not selected_pattern_ids:
+        return CHAPTER_MATCHER
+    return _cached_matcher(tuple(sorted(set(selected_pattern_ids))))
+
+
+CHAPTER_MATCHER = ChapterTitleMatcher(CHAPTER_PATTERN_GROUPS)
+TOC_ENTRY_MATCHER = ChapterTitleMatcher([TOC_NUMBERED_GROUP] + CHAPTER_PATTERN_GROUPS)
@@ -0,0 +1,133 @@
+"""
+PDF Structure Master - ディスク上の LRU キャッシュ
+- キーごとに1ファイルを保存し、合計サイズが上限を超えたら最終利用が古い順に削除する
+- 最終利用時刻はファイルの mtime で管理する（ヒット時に更新）
+Streamlit に依存しないため、UI 以外（バッチ処理など）からも使える。
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+# キャッシュの保存先（環境変数 PDF_MASTER_CACHE_DIR で変更可能）
+DEFAULT_CACHE_ROOT = Path(os.environ.get("PDF_MASTER_CACHE_DIR", Path.home() / ".cache" / "pdf_master"))
+
+
+def file_content_hash(path, chunk_bytes: int = 1024 * 1024) -> str:
+    """ファイル内容の SHA-256（16進）。全体をメモリに読み込まずに計算する。"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_key(*parts) -> str:
+    """複数の要素（内容ハッシュ・設定値など）から1つのキャッシュキーを作る。"""
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class DiskLRUCache:
+    """
+    サイズ上限付きのディスクキャッシュ。値はファイル（bytes またはファイルパスで登録）。
+    hits / misses は get の結果の累計。
+    """
+
+    def __init__(self, root, max_bytes: int, suffix: str = ""):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # このインスタンスから見た合計サイズの見積もり（None なら未計測）。
+        # 登録のたびに全ファイルを走査しないよう、上限を超えたと見込まれるときだけ evict で数え直す
+        self._approx_bytes = None
+
+    def _path(self, key: str) -> Path:
+        # 1ディレクトリのファイル数が増えすぎないよう、キー先頭2文字で振り分ける
+        return self.root / key[:2] / f"{key}{self.suffix}"
+
+    def get_path(self, key: str) -> Path | None:
+        """キャッシュ済みならそのファイルのパス（最終利用時刻を更新）、なければ None。"""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def get(self, key: str) -> bytes | None:
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        self._store(key, lambda tmp: tmp.write(data))
+
+    def put_file(self, key: str, src_path) -> None:
+        """src_path の内容をコピーして登録する。"""
+        def copy(tmp):
+            with open(src_path, "rb") as src:
+                shutil.copyfileobj(src, tmp)
+        self._store(key, copy)
+
+    def _store(self, key: str, write) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 途中まで書いたファイルを他のセッションが読まないよう、一時ファイルに書いてから置き換える
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False, suffix=".tmp") as tmp:
+            write(tmp)
+        size = os.path.getsize(tmp.name)
+        with self._lock:
+            # 同じキーを上書きするときは、置き換える前のファイルの分を差し引く
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp.name, path)
+            if self._approx_bytes is not None:
+                self._approx_bytes += size - replaced
+            over = self._approx_bytes is None or self._approx_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def entries(self) -> list:
+        """[(最終利用時刻, サイズ, パス), ...]（一時ファイルを除く）"""
+        result = []
+        for path in self.root.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            result.append((st.st_mtime, st.st_size, path))
+        return result
+
+    def total_bytes(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self) -> None:
+        """合計サイズが max_bytes 以下になるまで、最終利用が古いものから削除する。"""
+        with self._lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._approx_bytes = total
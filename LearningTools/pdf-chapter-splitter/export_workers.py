@@ -0,0 +1,214 @@
+"""
+PDF Structure Master - 書き出し用ワーカー
+- ページのレンダリング・JPEGエンコードをプロセスプールで並列に行う
+- 分割PDFモードでは章ごとのPDF保存（garbage/deflate/clean 付き）を並列に行う
+- 結果は投入順（章・ページ順）に返すため、ZIP への書き込み順は逐次実行と同じ
+- ワーカーは spawn_pool.py で spawn 起動する（書き出しジョブのスレッドから fork せず、Streamlit のスクリプトも再実行しない）
+Streamlit に依存しないため、ProcessPoolExecutor のワーカーから import できる。
+"""
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterator, List
+
+import fitz  # PyMuPDF
+
+from page_layout import DEFAULT_WORKERS, open_source
+from page_probe import is_monochrome_page, probe_page, to_bilevel
+from spawn_pool import spawn_process_pool
+
+# 1タスクあたりのページ数（小さすぎるとプロセス間通信の比率が増える）
+RENDER_CHUNK_PAGES = 4
+# レンダリング結果のキャッシュキーに含めるエンコーダ設定（MuPDF が変わると画素が変わりうる）
+JPEG_ENCODER_SIGNATURE = f"jpeg/default-quality/mupdf {fitz.version[1]}"
+
+# ページ画像の色の扱い
+COLOR_MODE_COLOR = "color"
+COLOR_MODE_GRAY = "gray"
+COLOR_MODE_BILEVEL = "bilevel"
+COLOR_MODE_LABELS = {
+    COLOR_MODE_COLOR: "カラー（従来）",
+    COLOR_MODE_GRAY: "白黒ページをグレースケールで保存（自動判定）",
+    COLOR_MODE_BILEVEL: "白黒ページを2値化して保存（自動判定）",
+}
+
+# 空白・重複ページの扱い（画像モード）
+PAGE_FILTER_KEEP = "keep"
+PAGE_FILTER_SKIP = "skip"
+PAGE_FILTER_PLACEHOLDER = "placeholder"
+PAGE_FILTER_DEDUPE = "dedupe"
+PAGE_FILTER_LABELS = {
+    PAGE_FILTER_KEEP: "すべて画像化（従来）",
+    PAGE_FILTER_SKIP: "空白・重複ページを出力しない",
+    PAGE_FILTER_PLACEHOLDER: "空白・重複ページは低解像度の代替画像にする",
+    PAGE_FILTER_DEDUPE: "重複ページは最初のページの画像を使い回す",
+}
+# 代替画像の倍率
+PLACEHOLDER_ZOOM = 0.25
+# 白黒ページの判定・2値化・空白/重複ページの判定は pdf-common/page_probe.py（pdf-to-image と共有）
+
+
+@dataclass
+class SplitOptions:
+    """
+    分割PDFの保存オプション（fitz.Document.save に渡す）。
+    - garbage: 0〜4。1以上で未使用オブジェクトを削除、3で番号を詰め、4で重複したフォント・画像ストリームを統合
+    - deflate: ストリーム（画像・フォントを含む）を圧縮する
+    - clean: コンテンツストリームを整理・正規化する（遅くなるが小さくなることがある）
+    """
+    garbage: int = 3
+    deflate: bool = True
+    clean: bool = False
+
+    def save_kwargs(self) -> dict:
+        return {
+            "garbage": self.garbage,
+            "deflate": self.deflate,
+            "deflate_images": self.deflate,
+            "deflate_fonts": self.deflate,
+            "clean": self.clean,
+        }
+
+
+@dataclass
+class PageFilterReport:
+    """空白・重複ページの検出結果と、それによって省いた処理量。"""
+    blank_pages: int = 0
+    duplicate_pages: int = 0
+    # 本来の解像度でのレンダリング・エンコードを省いたページ数
+    skipped_renders: int = 0
+    # 出力から減ったバイト数（空白ページは白紙画像のエンコード結果から見積もる）
+    bytes_saved: int = 0
+
+
+@dataclass
+class ChapterSplitResult:
+    """1章分の分割結果（ZIP内/出力先のパス・ページ数・ファイルサイズ・所要時間）。"""
+    path: str
+    pages: int
+    size_bytes: int
+    seconds: float
+
+
+def write_chapter_pdf(src_doc, start_page: int, end_page: int, out_path: str, options: SplitOptions) -> tuple:
+    """src_doc の [start_page, end_page) を out_path に保存し、(サイズ, 所要秒) を返す。"""
+    started = time.perf_counter()
+    new_doc = fitz.open()
+    try:
+        new_doc.insert_pdf(src_doc, from_page=start_page, to_page=end_page - 1)
+        new_doc.save(out_path, **options.save_kwargs())
+    finally:
+        new_doc.close()
+    return os.path.getsize(out_path), time.perf_counter() - started
+
+
+def render_page_pixmap(page, zoom: float, color_mode: str = COLOR_MODE_COLOR):
+    """
+    1ページを zoom 倍でレンダリングする。
+    color_mode が COLOR_MODE_COLOR 以外なら、白黒ページだけを csGRAY（画素あたり1バイト）で
+    レンダリングし、COLOR_MODE_BILEVEL ではさらに2値化する。カラーページは RGB のまま。
+    """
+    matrix = fitz.Matrix(zoom, zoom)
+    if color_mode == COLOR_MODE_COLOR or not is_monochrome_page(page):
+        return page.get_pixmap(matrix=matrix)
+    pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY)
+    if color_mode == COLOR_MODE_BILEVEL:
+        pix = to_bilevel(pix)
+    return pix
+
+
+def render_page_jpeg(page, zoom: float, color_mode: str = COLOR_MODE_COLOR) -> bytes:
+    """1ページを zoom 倍でレンダリングして JPEG にエンコードする。"""
+    return render_page_pixmap(page, zoom, color_mode).tobytes("jpg")
+
+
+def blank_jpeg_size(page, zoom: float, color_mode: str = COLOR_MODE_COLOR) -> int:
+    """page を zoom 倍で白紙としてエンコードした JPEG のバイト数（空白ページを省いた分の見積もり用）。"""
+    irect = (page.rect * fitz.Matrix(zoom, zoom)).irect
+    colorspace = fitz.csRGB if color_mode == COLOR_MODE_COLOR else fitz.csGRAY
+    pix = fitz.Pixmap(colorspace, irect, False)
+    pix.clear_with(255)
+    return len(pix.tobytes("jpg"))
+
+
+# --- プロセスプール用ワーカー（各ワーカーが自分のドキュメントを1回だけ開く） ---
+_worker_doc = None
+
+
+def _init_export_worker(source):
+    global _worker_doc
+    _worker_doc = open_source(source)
+
+
+def _render_chunk(page_indices: List[int], zoom: float, color_mode: str) -> List[bytes]:
+    return [render_page_jpeg(_worker_doc[pi], zoom, color_mode) for pi in page_indices]
+
+
+def _probe_chunk(page_indices: List[int]) -> List[tuple]:
+    return [probe_page(_worker_doc[pi]) for pi in page_indices]
+
+
+def _write_chapter(start_page: int, end_page: int, out_path: str, options: SplitOptions) -> tuple:
+    return write_chapter_pdf(_worker_doc, start_page, end_page, out_path, options)
+
+
+def render_pages_parallel(
+    source,
+    page_indices: List[int],
+    zoom: float,
+    workers: int = DEFAULT_WORKERS,
+    max_in_flight: int | None = None,
+    color_mode: str = COLOR_MODE_COLOR,
+) -> Iterator[tuple]:
+    """
+    page_indices の各ページを並列にレンダリングし、(ページ番号, JPEGバイト列) を入力順に返すジェネレータ。
+    同時に処理中のチャンクは max_in_flight（既定: ワーカー数の2倍）までに制限し、
+    書き込み側が遅くてもメモリ上のエンコード済み画像が増え続けないようにする。
+    """
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+    chunks = [page_indices[i:i + RENDER_CHUNK_PAGES] for i in range(0, len(page_indices), RENDER_CHUNK_PAGES)]
+    with spawn_process_pool(workers, _init_export_worker, (source,)) as pool:
+        pending = deque()
+        next_chunk = 0
+        try:
+            while next_chunk < len(chunks) or pending:
+                while next_chunk < len(chunks) and len(pending) < max_in_flight:
+                    chunk = chunks[next_chunk]
+                    pending.append((chunk, pool.submit(_render_chunk, chunk, zoom, color_mode)))
+                    next_chunk += 1
+                chunk, fut = pending.popleft()
+                yield from zip(chunk, fut.result())
+        finally:
+            # 途中で打ち切られた（取り消し・エラー）ときは、まだ始まっていないチャンクを捨てる
+            for _, fut in pending:
+                fut.cancel()
+
+
+def probe_pages_parallel(source, page_indices: List[int], workers: int = DEFAULT_WORKERS) -> List[tuple]:
+    """page_indices の各ページの probe_page の結果を並列に求め、入力順のリストで返す。"""
+    chunks = [page_indices[i:i + RENDER_CHUNK_PAGES] for i in range(0, len(page_indices), RENDER_CHUNK_PAGES)]
+    with spawn_process_pool(workers, _init_export_worker, (source,)) as pool:
+        return [probe for chunk_probes in pool.map(_probe_chunk, chunks) for probe in chunk_probes]
+
+
+def split_chapters_parallel(
+    source,
+    jobs: List[tuple],
+    options: SplitOptions,
+    workers: int = DEFAULT_WORKERS,
+) -> Iterator[tuple]:
+    """
+    jobs: [(start_page, end_page, out_path), ...] の各章を並列に保存し、
+    (job, サイズ, 所要秒) を jobs の順に返すジェネレータ。
+    """
+    with spawn_process_pool(workers, _init_export_worker, (source,)) as pool:
+        futures = [(job, pool.submit(_write_chapter, job[0], job[1], job[2], options)) for job in jobs]
+        try:
+            for job, fut in futures:
+                size, seconds = fut.result()
+                yield job, size, seconds
+        finally:
+            for _, fut in futures:
+                fut.cancel()
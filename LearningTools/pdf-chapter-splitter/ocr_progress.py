@@ -0,0 +1,51 @@
+"""
+ocrmypdf プラグイン: 端末の進捗バーの代わりに、OCR を呼び出したスレッドに登録したコールバックへ進捗を渡す。
+run_ocr(progress=...) が plugins=["ocr_progress"] として読み込ませる。
+コールバックが例外（JobCancelled など）を送出すると、ocrmypdf は残りのページを取り消して終了する。
+"""
+import threading
+from contextlib import contextmanager
+
+from ocrmypdf import hookimpl
+
+_local = threading.local()
+
+
+@contextmanager
+def report_to(callback):
+    """このスレッドで作られる進捗バーの更新を callback(完了数, 総数, 段階名) に渡す（None なら何もしない）。"""
+    _local.callback = callback
+    try:
+        yield
+    finally:
+        _local.callback = None
+
+
+class CallbackProgressBar:
+    """ocrmypdf の ProgressBar プロトコルの実装。"""
+
+    def __init__(self, *, total=None, desc=None, unit=None, disable=False, **kwargs):
+        self.total = total
+        self.desc = desc
+        self.completed = 0
+        self.callback = getattr(_local, "callback", None)
+
+    def __enter__(self):
+        self._report()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def update(self, n=1, *, completed=None):
+        self.completed = completed if completed is not None else self.completed + n
+        self._report()
+
+    def _report(self):
+        if self.callback is not None:
+            self.callback(int(self.completed), int(self.total) if self.total else None, self.desc)
+
+
+@hookimpl
+def get_progressbar_class():
+    return CallbackProgressBar
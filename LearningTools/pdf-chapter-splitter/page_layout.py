@@ -0,0 +1,293 @@
+"""
+PDF Structure Master - ページレイアウト索引
+- 各ページの get_text("dict") を1回だけ実行し、検出器が使う情報だけをコンパクトに保持する
+- 並列解析モード: ページ範囲をプロセスプールに分配し、各ワーカーが自分の fitz ドキュメントを開いて抽出する
+  （ワーカーは spawn_pool.py で spawn 起動する。Streamlit のスクリプトを子プロセスで再実行しない）
+Streamlit に依存しないため、ProcessPoolExecutor のワーカーから import できる。
+"""
+import os
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import List
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from spawn_pool import spawn_process_pool
+
+# 並列解析を使う最小ページ数（これ未満はプロセス起動コストの方が大きい）
+PARALLEL_MIN_PAGES = 64
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+
+# get_text("dict") の既定フラグは画像ブロック（埋め込み画像データ）まで取り込むため除外する
+LAYOUT_TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+# ヘッダー帯のクリップ抽出で帯の下に足す余裕（ページ高さに対する比率）
+HEADER_CLIP_SLACK = 0.1
+
+
+@dataclass
+class PageLayout:
+    """
+    1ページ分のテキストレイアウト（画像データを含まないコンパクト形式）。
+    lines: [(行bbox, ((spanテキスト, フォントサイズ, span bbox), ...)), ...]
+    """
+    width: float
+    height: float
+    lines: list = field(default_factory=list)
+
+    @cached_property
+    def text(self) -> str:
+        """行ごとに改行で連結したページのプレーンテキスト。"""
+        return "\n".join("".join(s[0] for s in spans) for _, spans in self.lines)
+
+
+def open_source(source):
+    """パス（str）またはPDFバイト列から fitz ドキュメントを開く。"""
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def extract_page_layout(page, clip=None) -> PageLayout:
+    """
+    page.get_text("dict") を1回だけ呼び、必要な情報（テキスト・サイズ・bbox・行）だけを残す。
+    clip を指定すると、その矩形内のテキストだけを PyMuPDF に抽出させる。
+    """
+    lines = []
+    for b in page.get_text("dict", flags=LAYOUT_TEXT_FLAGS, clip=clip).get("blocks", []):
+        for line in b.get("lines", []):
+            spans = tuple(
+                (s.get("text") or "", s.get("size", 0), tuple(s.get("bbox", (0, 0, 0, 0))))
+                for s in line.get("spans", [])
+            )
+            lines.append((tuple(line.get("bbox", (0, 0, 0, 0))), spans))
+    return PageLayout(width=page.rect.width, height=page.rect.height, lines=lines)
+
+
+def header_band_clip(page, top_ratio: float) -> fitz.Rect:
+    """
+    ページ上部（高さの top_ratio まで）の抽出範囲。
+    上端が帯の中にある行を途中で切らないよう、下側にページ高さの HEADER_CLIP_SLACK 分の余裕を持たせる。
+    """
+    rect = page.rect
+    bottom = min(rect.y1, rect.y0 + rect.height * (top_ratio + HEADER_CLIP_SLACK))
+    return fitz.Rect(rect.x0, rect.y0, rect.x1, bottom)
+
+
+def _safe_extract(page, clip=None) -> PageLayout:
+    try:
+        return extract_page_layout(page, clip=clip)
+    except Exception:
+        return PageLayout(width=page.rect.width, height=page.rect.height)
+
+
+# --- プロセスプール用ワーカー（各ワーカーが自分のドキュメントを1回だけ開く） ---
+_worker_doc = None
+
+
+def _init_layout_worker(source):
+    global _worker_doc
+    _worker_doc = open_source(source)
+
+
+def _extract_layout_range(start: int, end: int) -> List[PageLayout]:
+    return [_safe_extract(_worker_doc[pi]) for pi in range(start, end)]
+
+
+def _shard_ranges(page_indices: List[int], n_shards: int) -> List[tuple]:
+    """連続したページ番号を [start, end) の範囲に分割する（範囲の順序は入力順）。"""
+    ranges = []
+    run_start = prev = None
+    for pi in page_indices:
+        if run_start is None:
+            run_start = prev = pi
+        elif pi == prev + 1:
+            prev = pi
+        else:
+            ranges.append((run_start, prev + 1))
+            run_start = prev = pi
+    if run_start is not None:
+        ranges.append((run_start, prev + 1))
+    chunk = max(1, -(-len(page_indices) // n_shards))
+    shards = []
+    for start, end in ranges:
+        for s in range(start, end, chunk):
+            shards.append((s, min(s + chunk, end)))
+    return shards
+
+
+class PageLayoutIndex:
+    """
+    ドキュメント1冊分のページレイアウト索引。
+    各ページは初めて参照されたときに1回だけ抽出され、以降はすべての検出器で共有される。
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self._pages: List[PageLayout | None] = [None] * len(doc)
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def page(self, page_index: int) -> PageLayout:
+        layout = self._pages[page_index]
+        if layout is None:
+            layout = _safe_extract(self.doc[page_index])
+            self._pages[page_index] = layout
+        return layout
+
+    def prefetch(self, source, workers: int = DEFAULT_WORKERS) -> None:
+        """
+        未抽出のページをプロセスプールで並列に抽出して索引を埋める。
+        source は self.doc と同じ内容のパスまたはバイト列。結果はページ番号の位置に格納されるため、
+        その後の検出結果（候補の順序・min_page_gap の適用）は逐次実行と完全に一致する。
+        """
+        missing = [pi for pi, p in enumerate(self._pages) if p is None]
+        if workers <= 1 or len(missing) < PARALLEL_MIN_PAGES:
+            for pi in missing:
+                self.page(pi)
+            return
+        # ワーカーあたり約4シャードに分けて負荷を均す
+        shards = _shard_ranges(missing, workers * 4)
+        with spawn_process_pool(workers, _init_layout_worker, (source,)) as pool:
+            futures = [(start, pool.submit(_extract_layout_range, start, end)) for start, end in shards]
+            for start, fut in futures:
+                for offset, layout in enumerate(fut.result()):
+                    self._pages[start + offset] = layout
+
+    def header_band(self, page_index: int, top_ratio: float) -> PageLayout:
+        """
+        ページ上部の帯だけをクリップ抽出したレイアウト（索引には保存しない）。
+        全ページ抽出済みなら索引から返す。
+        """
+        layout = self._pages[page_index]
+        if layout is not None:
+            return layout
+        page = self.doc[page_index]
+        return _safe_extract(page, clip=header_band_clip(page, top_ratio))
+
+    def body_size(self, max_pages: int = 20) -> float | None:
+        """先頭 max_pages ページの全スパンを合算した本文フォントサイズ（最頻出）。"""
+        font_counts = {}
+        for pi in range(min(max_pages, len(self))):
+            for _, spans in self.page(pi).lines:
+                for text, size, _ in spans:
+                    sz = round(size, 1)
+                    if sz > 0:
+                        font_counts[sz] = font_counts.get(sz, 0) + len(text.strip())
+        return max(font_counts, key=font_counts.get) if font_counts else None
+
+    def extracted_pages(self) -> List[PageLayout]:
+        """抽出済みのページだけを返す（新たな抽出は行わない）。"""
+        return [p for p in self._pages if p is not None]
+
+
+def _weighted_mode(groups: np.ndarray, keys: np.ndarray, weights: np.ndarray) -> tuple:
+    """
+    groups ごとに keys の重み付き最頻値を返す（ベクトル化版の「max(font_counts, key=font_counts.get)」）。
+    同数の場合は先に出現した key を採用し、dict の挿入順による従来の結果と一致させる。
+    戻り値: (グループ値の配列, 最頻 key の配列)
+    """
+    if len(keys) == 0:
+        return np.empty(0, dtype=groups.dtype), np.empty(0, dtype=keys.dtype)
+    pairs = np.column_stack([groups.astype(np.float64), keys.astype(np.float64)])
+    uniq, first_idx, inverse = np.unique(pairs, axis=0, return_index=True, return_inverse=True)
+    totals = np.bincount(inverse.ravel(), weights=weights, minlength=len(uniq))
+    order = np.lexsort((first_idx, -totals, uniq[:, 0]))
+    ordered = uniq[order]
+    _, head = np.unique(ordered[:, 0], return_index=True)
+    return ordered[head, 0].astype(groups.dtype), ordered[head, 1]
+
+
+class SpanColumns:
+    """
+    全スパンを列指向の NumPy 配列にしたもの（閾値に依存しない部分だけを1回計算しておく）。
+    行はページ順・読み順に並ぶ。各列:
+    - page: 0始まりのページ番号 / size: フォントサイズ / rsize: 小数1桁に丸めたサイズ
+    - line_top: 行の上端 y / line_cx: 行の中心 x / text_len: 前後空白を除いた文字数
+    - group_mask: matcher（ChapterTitleMatcher）の i 番目のグループにマッチすれば bit i が立つ
+    header_scale・top_ratio などを変えた再検出は、これらの列へのベクトル化フィルタだけで済む。
+    """
+
+    def __init__(self, index: PageLayoutIndex, matcher):
+        self.group_ids = matcher.group_ids
+        pages, sizes, rsizes, tops, cxs, lens, masks, texts = [], [], [], [], [], [], [], []
+        widths, heights = [], []
+        for pi in range(len(index)):
+            layout = index.page(pi)
+            widths.append(layout.width)
+            heights.append(layout.height)
+            for line_bbox, spans in layout.lines:
+                top = line_bbox[1]
+                cx = (line_bbox[0] + line_bbox[2]) / 2
+                for text, size, _ in spans:
+                    text = text.strip()
+                    pages.append(pi)
+                    sizes.append(size)
+                    rsizes.append(round(size, 1))
+                    tops.append(top)
+                    cxs.append(cx)
+                    lens.append(len(text))
+                    masks.append(matcher.match_bits(text) if text else 0)
+                    texts.append(text)
+        self.page = np.asarray(pages, dtype=np.int64)
+        self.size = np.asarray(sizes, dtype=np.float64)
+        self.rsize = np.asarray(rsizes, dtype=np.float64)
+        self.line_top = np.asarray(tops, dtype=np.float64)
+        self.line_cx = np.asarray(cxs, dtype=np.float64)
+        self.text_len = np.asarray(lens, dtype=np.int64)
+        self.group_mask = np.asarray(masks, dtype=np.uint32)
+        self.texts = texts
+        self.page_width = np.asarray(widths, dtype=np.float64)
+        self.page_height = np.asarray(heights, dtype=np.float64)
+        self.page_body = self._page_body_sizes()
+
+    def __len__(self) -> int:
+        return len(self.page)
+
+    @property
+    def n_pages(self) -> int:
+        return len(self.page_height)
+
+    def _page_body_sizes(self) -> np.ndarray:
+        """ページごとの本文フォントサイズ（文字数で重み付けした最頻サイズ）。スパンが無いページは NaN。"""
+        body = np.full(self.n_pages, np.nan)
+        valid = self.rsize > 0
+        pages, modes = _weighted_mode(self.page[valid], self.rsize[valid], self.text_len[valid])
+        body[pages] = modes
+        return body
+
+    def doc_body_size(self, max_pages: int = 20) -> float | None:
+        """先頭 max_pages ページの全スパンを合算した本文フォントサイズ（最頻出）。"""
+        valid = (self.rsize > 0) & (self.page < max_pages)
+        _, modes = _weighted_mode(
+            np.zeros(int(valid.sum()), dtype=np.int64), self.rsize[valid], self.text_len[valid]
+        )
+        return float(modes[0]) if len(modes) else None
+
+    def group_bits(self, group_ids: List[str] | None = None) -> int:
+        """group_ids に対応するビットマスク（None なら全グループ）。"""
+        if group_ids is None:
+            group_ids = self.group_ids
+        bits = 0
+        for bit, gid in enumerate(self.group_ids):
+            if gid in group_ids:
+                bits |= 1 << bit
+        return bits
+
+    def first_rows_per_page(self, mask: np.ndarray, min_page_gap: int) -> List[int]:
+        """
+        mask を満たす行のうち、各ページで最初の行を選び、min_page_gap を順に適用して
+        採用された行番号を返す（逐次版の「直前の候補から min_page_gap 未満のページは飛ばす」と同じ結果）。
+        """
+        rows = np.flatnonzero(mask)
+        _, head = np.unique(self.page[rows], return_index=True)
+        picked = []
+        last_page = None
+        for row in rows[head]:
+            page_no = int(self.page[row])
+            if last_page is not None and (page_no - last_page) < min_page_gap:
+                continue
+            picked.append(int(row))
+            last_page = page_no
+        return picked
@@ -6,17 +6,45 @@ PDF Structure Master - PDFを章ごとに分割し、画像化してフォルダ
 起動: streamlit run pdf_master.py
 """
 import streamlit as st
-import fitz  # PyMuPDF
-import io
-import zipfile
-import tempfile
+import base64
+import functools
 import os
-import shutil
-import re
 import platform
 import subprocess
+import sys
+import tempfile
+import uuid
 from dataclasses import dataclass
-from typing import List
+from pathlib import Path
+
+# pdf-chapter-splitter と pdf-to-image で共有するモジュール（LearningTools/pdf-common）
+_COMMON_DIR = str(Path(__file__).resolve().parent.parent / "pdf-common")
+if _COMMON_DIR not in sys.path:
+    sys.path.append(_COMMON_DIR)
+
+from admission import AdmissionController, estimate_render_bytes
+from analysis_index import EDITED_TABLE, AnalysisIndex, detector_key, record_analysis
+from background_jobs import JOB_CANCELLED, JOB_ERROR, BackgroundJob, JobRunner
+from disk_cache import DEFAULT_CACHE_ROOT, DiskLRUCache
+from chapter_patterns import CHAPTER_PATTERN_GROUPS
+from export_workers import (
+    COLOR_MODE_COLOR,
+    COLOR_MODE_LABELS,
+    PAGE_FILTER_KEEP,
+    PAGE_FILTER_LABELS,
+    SplitOptions,
+)
+from page_layout import DEFAULT_WORKERS
+from pdf_processor import (
+    OCR_AVAILABLE,
+    OCR_CACHE_MAX_BYTES,
+    OCR_MODE_LABELS,
+    OCR_RASTER_DPI,
+    RENDER_CACHE_MAX_BYTES,
+    ChapterInfo,
+    PDFProcessor,
+    suggest_chapter_pattern_ids,
+)
 
 
 def notify_ocr_complete():
@@ -42,462 +70,149 @@ def notify_ocr_complete():
     except Exception:
         pass
 
-try:
-    import ocrmypdf
-    OCR_AVAILABLE = shutil.which("tesseract") is not None
-except (ImportError, AttributeError):
-    OCR_AVAILABLE = False
 
+# --- Streamlit UI ---
+# サムネイルのキャッシュ件数の上限（超えると最終利用が古いものから捨てる）
+THUMBNAIL_CACHE_ENTRIES = 512
+# バックグラウンドジョブの進捗表示を更新する間隔（秒）
+JOB_POLL_SECONDS = 1.0
+# バックグラウンドジョブ（OCR・書き出し）用のスレッド数。順番待ちのジョブもスレッドを使うため多めにする
+# （同時に実行する重いジョブの数は pdf-common/admission.py の MAX_HEAVY_JOBS で制限する）
+JOB_RUNNER_THREADS = 32
 
-# --- データ構造 ---
-@dataclass
-class ChapterInfo:
-    title: str
-    page_num: int
-    level: int
-    source: str
-    selected: bool = True
-
-
-# さまざまな書籍で使われやすい「章タイトル」のパターン（グループ化）
-CHAPTER_PATTERN_GROUPS = [
-    {
-        "id": "ja_chapter",
-        "label": "日本語: 第1章 / 1章 / 第一章",
-        "patterns": [
-            re.compile(r"第?\s*[0-9０-９一二三四五六七八九十百千ⅠⅡⅢⅣⅤⅥⅦⅧⅨⅩ]+\s*章"),
-            re.compile(r"[0-9０-９一二三四五六七八九十]+\s*章"),
-        ],
-    },
-    {
-        "id": "ja_part",
-        "label": "日本語: 第1部 / 編 / 講 / 回",
-        "patterns": [
-            re.compile(r"第?\s*[0-9０-９一二三四五六七八九十]+\s*(部|編|講|回)"),
-        ],
-    },
-    {
-        "id": "en_chapter",
-        "label": "英語: Chapter / CHAPTER / Chap.",
-        "patterns": [
-            re.compile(r"\bchapter\s+[0-9ivxlcdm]+\b", re.IGNORECASE),
-            re.compile(r"\bchap\.\s*[0-9ivxlcdm]+\b", re.IGNORECASE),
-        ],
-    },
-    {
-        "id": "en_part_lesson",
-        "label": "英語: Part / Lesson",
-        "patterns": [
-            re.compile(r"\bpart\s+[0-9ivxlcdm]+\b", re.IGNORECASE),
-            re.compile(r"\blesson\s+[0-9ivxlcdm]+\b", re.IGNORECASE),
-        ],
-    },
-    {
-        "id": "eu_chapter",
-        "label": "その他: Kapitel / Chapitre / Capítulo / Capitolo / Глава など",
-        "patterns": [
-            re.compile(
-                r"\b(kapitel|chapitre|cap[ií]tulo|capitolo|capitulo|glava|глава)\s+[0-9ivxlcdm一二三四五六七八九十]+\b",
-                re.IGNORECASE,
-            ),
-        ],
-    },
-]
 
-# すべてのパターンを平坦化したリスト（デフォルト用）
-CHAPTER_TITLE_REGEXES = [p for g in CHAPTER_PATTERN_GROUPS for p in g["patterns"]]
+@st.cache_resource
+def get_ocr_cache() -> DiskLRUCache:
+    """サーバー内の全セッションで共有する OCR 結果キャッシュ。"""
+    return DiskLRUCache(DEFAULT_CACHE_ROOT / "ocr", OCR_CACHE_MAX_BYTES, suffix=".pdf")
+
+
+@st.cache_resource
+def get_render_cache() -> DiskLRUCache:
+    """サーバー内の全セッションで共有するページ画像（JPEG）キャッシュ。"""
+    return DiskLRUCache(DEFAULT_CACHE_ROOT / "render", RENDER_CACHE_MAX_BYTES, suffix=".jpg")
+
 
-# 目次行のパターン（章パターンに加え、「1. はじめに」「1) はじめに」などにも対応）
-TOC_ENTRY_PATTERNS = [
-    re.compile(r"^\d+[\.\)]\s"),  # "1. " or "1) "
-    re.compile(r"^\d+\s+[^\d]"),  # "1 はじめに" (数字+スペース+非数字)
-] + CHAPTER_TITLE_REGEXES
+@st.cache_resource
+def get_analysis_index() -> AnalysisIndex:
+    """サーバー内の全セッションで共有する解析インデックス（開いたことのある本の解析結果と章構成）。"""
+    return AnalysisIndex()
 
 
-def suggest_chapter_pattern_ids(chapters: List[ChapterInfo]) -> List[str]:
+@st.cache_data(max_entries=THUMBNAIL_CACHE_ENTRIES, show_spinner=False)
+def get_page_thumbnail(doc_hash: str, page_num: int, _processor: PDFProcessor) -> str | None:
     """
-    OCR などで検出した見出しタイトルから、
-    どの章タイトルパターンが実際に使われていそうかを推定する。
+    page_num（1始まり）のサムネイルを data URI で返す。
+    キーは内容ハッシュとページ番号なので、再実行や他のセッションでも同じページは再レンダリングしない。
     """
-    if not chapters:
-        return [g["id"] for g in CHAPTER_PATTERN_GROUPS]
+    if not 1 <= page_num <= len(_processor.doc):
+        return None
+    data = _processor.render_thumbnail(page_num - 1)
+    return "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii")
 
-    used_ids = set()
-    for ch in chapters:
-        title = (ch.title or "").strip()
-        if not title:
+
+@st.cache_resource
+def get_job_runner() -> JobRunner:
+    """サーバー内の全セッションで共有する、OCR・書き出し用のバックグラウンド実行スレッド。"""
+    return JobRunner(JOB_RUNNER_THREADS)
+
+
+@st.cache_resource
+def get_admission() -> AdmissionController:
+    """サーバー内の全セッションで共有する、重いジョブ（OCR・書き出し）の受付。"""
+    return AdmissionController()
+
+
+def chapters_from_rows(rows) -> list:
+    """章編集テーブルの行を ChapterInfo にする（追加したばかりで開始ページ・名前が空の行は除く）。"""
+    chapters = []
+    for row in rows:
+        if row.get("Page") is None or row.get("Title") is None:
             continue
-        for g in CHAPTER_PATTERN_GROUPS:
-            if any(pat.search(title) for pat in g["patterns"]):
-                used_ids.add(g["id"])
-    if not used_ids:
-        return [g["id"] for g in CHAPTER_PATTERN_GROUPS]
-    return sorted(used_ids)
-
-
-# --- コアロジック ---
-class PDFProcessor:
-    def __init__(self, file_stream, filename):
-        self.file_bytes = file_stream.read()
-        self.filename = filename
-        self.book_title = os.path.splitext(filename)[0]
-        self.doc = fitz.open(stream=self.file_bytes, filetype="pdf")
-
-    def run_ocr(self, language='jpn+eng') -> bool:
-        if not OCR_AVAILABLE:
-            return False
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, "input.pdf")
-            output_path = os.path.join(temp_dir, "output.pdf")
-            with open(input_path, "wb") as f:
-                f.write(self.file_bytes)
-            try:
-                ocrmypdf.ocr(
-                    input_path, output_path, language=language,
-                    force_ocr=True, deskew=True, progress_bar=False
-                )
-                with open(output_path, "rb") as f:
-                    self.file_bytes = f.read()
-                self.doc.close()
-                self.doc = fitz.open(stream=self.file_bytes, filetype="pdf")
-                return True
-            except Exception as e:
-                st.error(f"OCR処理エラー: {e}")
-                return False
-
-    def get_existing_toc(self) -> List[ChapterInfo]:
-        toc = self.doc.get_toc()
-        chapters = []
-        if toc:
-            for item in toc:
-                lvl, title, page = item
-                if page > 0:
-                    chapters.append(ChapterInfo(title=title, page_num=page, level=lvl, source="既存目次"))
-        return chapters
-
-    def _get_page_body_size(self, page) -> float | None:
-        """ページ内の本文フォントサイズ（最頻出）を返す。"""
-        font_counts = {}
-        try:
-            for b in page.get_text("dict").get("blocks", []):
-                for line in b.get("lines", []):
-                    for s in line.get("spans", []):
-                        sz = round(s.get("size", 0), 1)
-                        if sz > 0:
-                            text_len = len((s.get("text") or "").strip())
-                            font_counts[sz] = font_counts.get(sz, 0) + text_len
-        except Exception:
-            return None
-        if not font_counts:
-            return None
-        return max(font_counts, key=font_counts.get)
-
-    def _get_doc_body_size(self, max_pages: int = 20) -> float | None:
-        """ドキュメント全体の本文フォントサイズ（最頻出）を返す。"""
-        font_counts = {}
-        for pi in range(min(max_pages, len(self.doc))):
-            try:
-                bs = self._get_page_body_size(self.doc[pi])
-                if bs is not None:
-                    font_counts[bs] = font_counts.get(bs, 0) + 1
-            except Exception:
-                continue
-        return max(font_counts, key=font_counts.get) if font_counts else None
-
-    def detect_chapters_by_style(
-        self,
-        header_scale: float = 1.3,
-        min_page_gap: int = 2,
-        top_ratio: float = 0.5,
-        per_page_font: bool = True,
-    ) -> List[ChapterInfo]:
-        """
-        フォントサイズ解析で見出しを検出。
-        per_page_font=True のとき、各ページごとに本文サイズを推定し、
-        そのページ内で「本文より大きい」テキストだけを見出し候補にする（ロバスト性向上）。
-        """
-        fallback_body = self._get_doc_body_size()
-        if not per_page_font and fallback_body is None:
-            return []
-
-        candidates = []
-        for page_index in range(len(self.doc)):
-            page = self.doc[page_index]
-            page_no = page_index + 1
-            page_height = page.rect.height
-
-            if candidates and (page_no - candidates[-1].page_num) < min_page_gap:
-                continue
-
-            body_size = self._get_page_body_size(page) if per_page_font else fallback_body
-            if body_size is None:
-                body_size = fallback_body
-            if body_size is None:
-                continue
-
-            min_header_size = body_size * header_scale
-            blocks = page.get_text("dict").get("blocks", [])
-            page_candidates = []
-            for b in blocks:
-                if "lines" not in b:
-                    continue
-                for line in b["lines"]:
-                    line_top = line.get("bbox", [0, 0, 0, 0])[1]
-                    if line_top > page_height * top_ratio:
-                        continue
-                    for s in line.get("spans", []):
-                        text = (s.get("text") or "").strip()
-                        if 1 < len(text) < 60 and s.get("size", 0) >= min_header_size:
-                            page_candidates.append(text)
-            if page_candidates:
-                title = " ".join(page_candidates[:1])
-                candidates.append(ChapterInfo(title=title, page_num=page_no, level=1, source="自動検出"))
-        return candidates
-
-    def detect_chapters_by_pattern(
-        self,
-        min_page_gap: int = 2,
-        top_ratio: float = 0.45,
-        margin_ratio: float = 0.12,
-        min_size_ratio: float = 0.0,
-    ) -> List[ChapterInfo]:
-        """
-        OCR後のPDF向け: パターンにマッチする行を章として検出。
-        - top_ratio: ページ上部（高さの top_ratio 以内）のテキストのみ対象（フッター除外）
-        - margin_ratio: 左右マージン（幅の margin_ratio ずつ）を除外。サイドバー「第○章」の誤検出を防ぐ。
-        - min_size_ratio: 本文フォントに対する最小倍率（0=無効）。0.85以上でフッターの小文字を除外可能。
-        """
-        body_size = None
-        if min_size_ratio > 0:
-            font_counts = {}
-            for pi in range(min(20, len(self.doc))):
-                try:
-                    for b in self.doc[pi].get_text("dict").get("blocks", []):
-                        for line in b.get("lines", []):
-                            for s in line.get("spans", []):
-                                sz = round(s.get("size", 0), 1)
-                                if sz > 0:
-                                    font_counts[sz] = font_counts.get(sz, 0) + len((s.get("text") or "").strip())
-                except Exception:
-                    continue
-            if font_counts:
-                body_size = max(font_counts, key=font_counts.get)
-
-        candidates = []
-        for page_index in range(len(self.doc)):
-            page = self.doc[page_index]
-            page_no = page_index + 1
-            page_height = page.rect.height
-            page_width = page.rect.width
-
-            if candidates and (page_no - candidates[-1].page_num) < min_page_gap:
-                continue
-
-            blocks = page.get_text("dict").get("blocks", [])
-            page_matched = False
-            for b in blocks:
-                if "lines" not in b or page_matched:
-                    continue
-                for line in b["lines"]:
-                    if page_matched:
-                        break
-                    line_bbox = line.get("bbox", [0, 0, 0, 0])
-                    # ページ上部のみ対象（フッターの「第○章」を除外）
-                    if line_bbox[1] > page_height * top_ratio:
-                        continue
-                    # 左右マージン（サイドバー「第○章」など）を除外
-                    center_x = (line_bbox[0] + line_bbox[2]) / 2
-                    if center_x < page_width * margin_ratio or center_x > page_width * (1 - margin_ratio):
-                        continue
-                    for span in line.get("spans", []):
-                        text = (span.get("text") or "").strip()
-                        if not text or len(text) > 80:
-                            continue
-                        # フォントサイズでフィルタ（本文より小さい=フッターの可能性）
-                        if body_size and min_size_ratio > 0:
-                            sz = span.get("size", 0)
-                            if sz < body_size * min_size_ratio:
-                                continue
-                        for pat in CHAPTER_TITLE_REGEXES:
-                            if pat.search(text):
-                                candidates.append(
-                                    ChapterInfo(
-                                        title=text[:60],
-                                        page_num=page_no,
-                                        level=1,
-                                        source="パターン検出(OCR)",
-                                    )
-                                )
-                                page_matched = True
-                                break
-        return candidates
-
-    def detect_chapters_from_toc_pages(
-        self,
-        toc_max_pages: int = 25,
-    ) -> List[ChapterInfo]:
-        """
-        目次ページを特定し、章タイトルと開始ページを抽出する。
-        目次フォーマットは書籍により異なるが、「第1章 ... 15」のように
-        行末にページ番号がある形式を想定する。
-        """
-        toc_page_indices = []
-        for pi in range(min(toc_max_pages, len(self.doc))):
-            try:
-                text = self.doc[pi].get_text()
-                if not text:
-                    continue
-                # 「目次」「Contents」などが含まれるページを候補に
-                if any(kw in text for kw in ("目次", "Contents", "CONTENTS", "Table of Contents")):
-                    toc_page_indices.append(pi)
-            except Exception:
-                continue
-
-        if not toc_page_indices:
-            return []
-
-        chapters = []
-        seen_pages = set()
-        for pi in toc_page_indices:
-            try:
-                blocks = self.doc[pi].get_text("dict").get("blocks", [])
-            except Exception:
-                continue
-            for b in blocks:
-                for line in b.get("lines", []):
-                    line_text = " ".join(s.get("text", "") for s in line.get("spans", []))
-                    line_text = line_text.strip()
-                    if not line_text or len(line_text) > 120:
-                        continue
-                    # 目次行として有効か（章パターン or 「1. はじめに」形式）
-                    if not any(pat.search(line_text) for pat in TOC_ENTRY_PATTERNS):
-                        continue
-                    # 行末のページ番号を抽出（.... 15, ……… 15, 15 など複数フォーマット）
-                    page_match = re.search(r"[\s.\・…－\-ー]*(\d{1,4})\s*$", line_text)
-                    if not page_match:
-                        continue
-                    page_num = int(page_match.group(1))
-                    if page_num < 1 or page_num > len(self.doc):
-                        continue
-                    if page_num in seen_pages:
-                        continue
-                    seen_pages.add(page_num)
-                    title = re.sub(r"[\s.\・…－\-ー]*\d{1,4}\s*$", "", line_text).strip()
-                    if not title:
-                        title = line_text[:50]
-                    chapters.append(
-                        ChapterInfo(
-                            title=title[:60],
-                            page_num=page_num,
-                            level=1,
-                            source="目次",
-                        )
-                    )
-        return sorted(chapters, key=lambda c: c.page_num)
-
-    def filter_major_chapters(
-        self,
-        chapters: List[ChapterInfo],
-        selected_pattern_ids: List[str] | None = None,
-        keyword: str | None = None,
-        min_distance: int = 5,
-    ) -> List[ChapterInfo]:
-        """
-        章だけを残すためのフィルタ:
-        - タイトルが章タイトルらしいものだけを残す
-          （キーワード、または CHAPTER_TITLE_REGEXES にマッチ）
-        - 同じタイトルが近いページに繰り返し出る場合は、最初の1つだけ残す
-        """
-        if not chapters:
-            return []
-
-        filtered: List[ChapterInfo] = []
-        seen_pages_by_title = {}
-
-        # どのパターンを使うか決定（チェックボックスで未選択なら全パターン）
-        if selected_pattern_ids:
-            active_patterns = []
-            for g in CHAPTER_PATTERN_GROUPS:
-                if g["id"] in selected_pattern_ids:
-                    active_patterns.extend(g["patterns"])
-        else:
-            active_patterns = CHAPTER_TITLE_REGEXES
+        chapters.append(ChapterInfo(
+            title=str(row["Title"]),
+            page_num=int(row["Page"]),
+            level=int(row.get("Level") or 1),
+            source=row.get("Source") or "User",
+            selected=bool(row.get("Selected")),
+        ))
+    return chapters
 
-        for ch in sorted(chapters, key=lambda c: c.page_num):
-            title = (ch.title or "").strip()
-            if not title:
-                continue
 
-            looks_like_chapter = False
-            if keyword and keyword in title:
-                looks_like_chapter = True
-            else:
-                for pat in active_patterns:
-                    if pat.search(title):
-                        looks_like_chapter = True
-                        break
-
-            if not looks_like_chapter:
-                continue
-
-            norm_title = re.sub(r"\s+", "", title)
-            last_page = seen_pages_by_title.get(norm_title)
-            if last_page is not None and (ch.page_num - last_page) < min_distance:
-                continue
-
-            seen_pages_by_title[norm_title] = ch.page_num
-            filtered.append(ch)
-
-        return filtered
-
-    def process_export(self, chapters: List[ChapterInfo], export_mode: str, img_zoom: float = 2.0) -> bytes:
-        zip_buffer = io.BytesIO()
-        sorted_chapters = sorted(chapters, key=lambda x: x.page_num)
-        path_stack = []
-
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-            for i, chapter in enumerate(sorted_chapters):
-                start_page = chapter.page_num - 1
-                if i == len(sorted_chapters) - 1:
-                    end_page = len(self.doc)
-                else:
-                    end_page = sorted_chapters[i + 1].page_num - 1
-                if start_page >= end_page:
-                    continue
-
-                while path_stack and path_stack[-1][0] >= chapter.level:
-                    path_stack.pop()
-                safe_title = "".join(c for c in chapter.title if c.isalnum() or c in (' ', '-', '_', '.', '(', ')')).strip()
-                if not safe_title:
-                    safe_title = f"Chapter_{i+1}"
-                path_stack.append((chapter.level, safe_title))
-                folder_parts = [self.book_title] + [p[1] for p in path_stack]
-
-                if export_mode == "pdf":
-                    filename = f"{path_stack[-1][1]}.pdf"
-                    parent_folder_parts = [self.book_title] + [p[1] for p in path_stack[:-1]]
-                    full_path = f"{'/'.join(parent_folder_parts)}/{filename}"
-                    new_doc = fitz.open()
-                    new_doc.insert_pdf(self.doc, from_page=start_page, to_page=end_page - 1)
-                    zf.writestr(full_path, new_doc.tobytes())
-                    new_doc.close()
-
-                elif export_mode == "image":
-                    current_folder = "/".join(folder_parts)
-                    for p_idx in range(start_page, end_page):
-                        page = self.doc[p_idx]
-                        mat = fitz.Matrix(img_zoom, img_zoom)
-                        pix = page.get_pixmap(matrix=mat)
-                        img_data = pix.tobytes("jpg")
-                        local_num = p_idx - start_page + 1
-                        img_name = f"{local_num:03d}.jpg"
-                        zf.writestr(f"{current_folder}/{img_name}", img_data)
-
-        zip_buffer.seek(0)
-        return zip_buffer.getvalue()
+def format_seconds(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds + 0.5), 60)
+    return f"{minutes}分{secs:02d}秒" if minutes else f"{secs}秒"
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(job_key: str):
+    """
+    実行中のジョブの進捗・経過時間・残り時間と取り消しボタン。
+    この部分だけを定期的に再実行し、ジョブが終わったら画面全体を再実行して結果を表示する。
+    """
+    job = st.session_state.get(job_key)
+    if job is None:
+        return
+    if job.finished:
+        st.rerun()
+    position = job.queue_position
+    if job.cancel_requested:
+        text = f"{job.label}: 取り消しています..."
+    elif position:
+        load = get_admission().snapshot()
+        text = f"{job.label}: 順番待ち {position} 番目（サーバー全体で {load['running']} 件を実行中）"
+    elif job.total:
+        text = f"{job.label}{f'（{job.phase}）' if job.phase else ''}: {job.done} / {job.total}"
+        text += f" ・ 経過 {format_seconds(job.elapsed)}"
+        if job.eta_seconds is not None:
+            text += f" ・ 残り 約{format_seconds(job.eta_seconds)}"
+    else:
+        text = f"{job.label}: 準備中... ・ 経過 {format_seconds(job.elapsed)}"
+    st.progress(job.fraction, text=text)
+    if st.button("⏹ 取り消す", key=f"cancel_{job_key}", disabled=job.cancel_requested):
+        # 表示は次の更新で「取り消しています...」に変わる
+        job.cancel()
+
+
+@dataclass
+class ExportOutcome:
+    """バックグラウンド書き出しの結果（書き出しに使った PDFProcessor のコピーが各種レポートを持つ）。"""
+    zip_path: str
+    mode: str
+    view: PDFProcessor
+    announced: bool = False
+
+
+def discard_job(job: BackgroundJob | None) -> None:
+    """ジョブを取り消し、書き出し済みのZIPがあれば削除する。"""
+    if job is None:
+        return
+    job.cancel()
+    # スクリプトは再実行のたびにクラスを定義し直すので、isinstance ではなく属性で判定する
+    zip_path = getattr(job.result, "zip_path", None)
+    if zip_path and os.path.exists(zip_path):
+        os.unlink(zip_path)
+
+
+def run_ocr_job(processor: PDFProcessor, mode: str, jobs: int, cache: DiskLRUCache, job: BackgroundJob) -> bool:
+    return processor.run_ocr(mode=mode, jobs=jobs, cache=cache, progress=job.report)
+
+
+def run_export_job(processor: PDFProcessor, chapters, mode: str, options: dict, job: BackgroundJob) -> ExportOutcome:
+    """
+    画面側の操作（章の編集・サムネイル）と同時に進められるよう、別の fitz.Document で書き出す。
+    """
+    # ZIP は作業フォルダに置き、ファイルを閉じたとき（セッション終了時も）一緒に削除されるようにする
+    fd, zip_path = tempfile.mkstemp(prefix="export_", suffix=".zip", dir=processor.work_dir)
+    os.close(fd)
+    view = processor.open_view()
+    try:
+        view.process_export(chapters, mode, zip_path=zip_path, progress=job.report, **options)
+    finally:
+        view.close()
+    return ExportOutcome(zip_path=zip_path, mode=mode, view=view)
 
 
-# --- Streamlit UI ---
 st.set_page_config(page_title="PDF Structure Master", layout="wide", page_icon="📚")
 st.title("📚 PDF Structure Master")
 st.markdown("PDFを解析し、**章ごとのフォルダ構造**に再構築します。「分割PDF」または「連番画像（自炊用）」として出力可能です。")
@@ -506,7 +221,19 @@ with st.sidebar:
     st.header("⚙️ 設定・操作")
     st.subheader("1. OCR (文字認識)")
     if OCR_AVAILABLE:
+        ocr_mode = st.radio(
+            "OCR方式",
+            list(OCR_MODE_LABELS),
+            format_func=OCR_MODE_LABELS.get,
+            help="『必要なページだけ』はテキスト層のないページ（と画像が大半の混在ページ）だけをOCRします。",
+        )
+        ocr_jobs = st.number_input("OCRプロセス数", min_value=1, max_value=os.cpu_count() or 1, value=os.cpu_count() or 1)
         ocr_btn = st.button("🔍 OCRを実行 (スキャン画像用)")
+        ocr_cache = get_ocr_cache()
+        st.caption(
+            f"OCRキャッシュ: ヒット {ocr_cache.hits} / ミス {ocr_cache.misses}"
+            f"（使用量 {ocr_cache.total_bytes() / 1024 / 1024:.0f} MB / 上限 {OCR_CACHE_MAX_BYTES // 1024 // 1024} MB）"
+        )
     else:
         st.warning("⚠️ Tesseractが見つかりません。OCR機能は無効です。")
         ocr_btn = False
@@ -514,6 +241,8 @@ with st.sidebar:
     st.subheader("2. 出力モード")
     export_mode_radio = st.radio("形式を選択:", ["PDFとして分割", "画像(JPEG)フォルダ化"], index=1)
     img_zoom = 2.0
+    color_mode = COLOR_MODE_COLOR
+    page_filter = PAGE_FILTER_KEEP
     if export_mode_radio == "画像(JPEG)フォルダ化":
         quality = st.select_slider("画質 (解像度)", options=["標準", "高画質", "超高画質"], value="高画質")
         if quality == "標準":
@@ -522,6 +251,42 @@ with st.sidebar:
             img_zoom = 2.0
         else:
             img_zoom = 3.0
+        color_mode = st.radio(
+            "色の扱い",
+            list(COLOR_MODE_LABELS),
+            format_func=COLOR_MODE_LABELS.get,
+            help=(
+                "白黒（文字だけ）のページを自動で判定し、グレースケールや2値で保存します。カラーのページはそのままです。"
+                "グレースケールは変換が速く、ファイルも小さくなります。2値化は文字がくっきりしますが、"
+                "JPEGでは文字の多いページでかえって大きくなることがあります。"
+            ),
+        )
+        page_filter = st.selectbox(
+            "空白・重複ページ",
+            list(PAGE_FILTER_LABELS),
+            format_func=PAGE_FILTER_LABELS.get,
+            help="低解像度で全ページを事前に確認し、白紙のページや、前のページとまったく同じページを見つけます。",
+        )
+    export_workers = st.number_input(
+        "書き出しプロセス数",
+        min_value=1,
+        max_value=os.cpu_count() or 1,
+        value=DEFAULT_WORKERS,
+        help="2以上にすると章ごとのPDF保存やページの画像化（レンダリング・JPEG変換）を複数プロセスで並列実行します。",
+    )
+    split_options = SplitOptions()
+    if export_mode_radio == "PDFとして分割":
+        with st.expander("分割PDFの最適化"):
+            split_options = SplitOptions(
+                garbage=st.select_slider(
+                    "不要オブジェクトの削除 (garbage)",
+                    options=[0, 1, 2, 3, 4],
+                    value=3,
+                    help="4 は重複したフォント・画像も統合します（最小サイズ・やや遅い）。",
+                ),
+                deflate=st.checkbox("ストリームを圧縮 (deflate)", value=True),
+                clean=st.checkbox("コンテンツを整理 (clean)", value=False),
+            )
 
     st.subheader("3. 章検出のきめ細かさ (目次なし用)")
     sensitivity = st.select_slider(
@@ -543,6 +308,13 @@ with st.sidebar:
         min_page_gap = 5
     st.session_state.header_scale = header_scale
     st.session_state.min_page_gap = min_page_gap
+    analysis_workers = st.number_input(
+        "解析プロセス数",
+        min_value=1,
+        max_value=os.cpu_count() or 1,
+        value=DEFAULT_WORKERS,
+        help="2以上にするとページ解析を複数プロセスで並列実行します（大きなPDF向け）。",
+    )
 
     st.subheader("4. 章タイトル判定ルール")
     chapter_pattern_ids = [g["id"] for g in CHAPTER_PATTERN_GROUPS]
@@ -563,6 +335,32 @@ with st.sidebar:
         st.session_state.chapter_pattern_selected = selected_ids
         st.session_state.chapter_pattern_manual = True
 
+    st.subheader("5. ライブラリ")
+    with st.expander("解析済みの本"):
+        analysis_index = get_analysis_index()
+        library = analysis_index.books()
+        st.caption(f"{len(library)} 冊を記録しています。同じPDFを開き直すと、保存した章構成をすぐに表示します。")
+        heading_query = st.text_input("見出しを検索", placeholder="例: 第3章, Introduction")
+        if heading_query:
+            hits = analysis_index.search_headings(heading_query)
+            st.dataframe(
+                [{"本": h.book_title, "見出し": h.title, "開始P": h.page_num} for h in hits],
+                width="stretch",
+                hide_index=True,
+            )
+        elif library:
+            st.dataframe(
+                [
+                    {"本": b.title, "ページ": b.page_count, "章": b.chapter_count, "編集済み": b.edited}
+                    for b in library
+                ],
+                width="stretch",
+                hide_index=True,
+            )
+
+if 'session_id' not in st.session_state:
+    # 重いジョブの順番をセッションごとに公平に回すための識別子
+    st.session_state.session_id = uuid.uuid4().hex
 if 'processor' not in st.session_state:
     st.session_state.processor = None
 if 'chapters' not in st.session_state:
@@ -575,36 +373,75 @@ uploaded_file = st.file_uploader("PDFファイルをここにドラッグ＆ド
 if uploaded_file is not None:
     if st.session_state.processor is None or getattr(st.session_state, 'last_filename', '') != uploaded_file.name:
         with st.spinner("PDFを読み込んでいます..."):
+            # 前のファイルのOCR・書き出しは取り消す
+            discard_job(st.session_state.pop("ocr_job", None))
+            discard_job(st.session_state.pop("export_job", None))
+            if st.session_state.processor is not None:
+                st.session_state.processor.close()
             st.session_state.processor = PDFProcessor(uploaded_file, uploaded_file.name)
+            st.session_state.processor.analysis_workers = int(analysis_workers)
             st.session_state.last_filename = uploaded_file.name
             st.session_state.chapters = []
             st.session_state.ocr_done = False
-            st.session_state.chapters = st.session_state.processor.get_existing_toc()
-            if not st.session_state.chapters:
-                st.session_state.chapters = st.session_state.processor.detect_chapters_from_toc_pages()
-            if not st.session_state.chapters:
-                header_scale = st.session_state.get("header_scale", 1.3)
-                min_page_gap = st.session_state.get("min_page_gap", 2)
-                st.session_state.chapters = st.session_state.processor.detect_chapters_by_style(
-                    header_scale, min_page_gap
-                )
-            if not st.session_state.chapters:
-                min_page_gap = st.session_state.get("min_page_gap", 2)
-                st.session_state.chapters = st.session_state.processor.detect_chapters_by_pattern(
-                    min_page_gap, top_ratio=0.45, min_size_ratio=0.85
+            # 開いたことのある本（内容ハッシュで判定）は、解析インデックスに保存した章構成をそのまま使う
+            index = get_analysis_index()
+            book_hash = st.session_state.processor.doc_hash
+            auto_key = detector_key(st.session_state.get("header_scale", 1.3), st.session_state.get("min_page_gap", 2))
+            chapters = index.load_chapters(book_hash, EDITED_TABLE)
+            st.session_state.index_loaded = "edited" if chapters is not None else None
+            if chapters is None:
+                chapters = index.load_chapters(book_hash, auto_key)
+                st.session_state.index_loaded = "auto" if chapters is not None else None
+            if chapters is None:
+                chapters = st.session_state.processor.detect_chapters(
+                    st.session_state.get("header_scale", 1.3), st.session_state.get("min_page_gap", 2)
                 )
+                record_analysis(index, book_hash, st.session_state.processor, auto_key, chapters)
+            st.session_state.book_hash = book_hash
+            st.session_state.chapters = chapters
+            st.session_state.saved_chapter_table = chapters
             # まだユーザーが明示的に変更していない場合は、検出された見出しから
             # 章タイトル判定ルールのおすすめセットを自動で推定する
             if not st.session_state.get("chapter_pattern_manual", False):
                 st.session_state.chapter_pattern_selected = suggest_chapter_pattern_ids(
-                    st.session_state.chapters
+                    st.session_state.chapters, st.session_state.processor.layout
                 )
 
     processor = st.session_state.processor
+    processor.analysis_workers = int(analysis_workers)
 
-    if ocr_btn and not st.session_state.ocr_done:
-        with st.spinner("OCR処理中... ページ数によっては数分かかります☕"):
-            if processor.run_ocr():
+    export_job = st.session_state.get("export_job")
+    export_running = export_job is not None and not export_job.finished
+    if ocr_btn and not st.session_state.ocr_done and "ocr_job" not in st.session_state:
+        if export_running:
+            st.warning("書き出し中はOCRを実行できません。書き出しの完了後にもう一度お試しください。")
+        else:
+            # ocrmypdf は各プロセスで1ページずつラスタライズする
+            ticket = get_admission().request(
+                st.session_state.session_id,
+                "OCR",
+                estimate_render_bytes(len(processor.doc), OCR_RASTER_DPI / 72, resident_pages=int(ocr_jobs)),
+            )
+            st.session_state.ocr_job = get_job_runner().submit(
+                "OCR", functools.partial(run_ocr_job, processor, ocr_mode, int(ocr_jobs), get_ocr_cache()), ticket
+            )
+
+    ocr_job = st.session_state.get("ocr_job")
+    if ocr_job is not None:
+        if not ocr_job.finished:
+            # OCR はドキュメントを差し替えるため、終わるまで章の編集や書き出しはできない
+            st.info("OCR処理中です。ページ数によっては数分かかります☕ 完了すると見出しを検出し直します。")
+            show_job_progress("ocr_job")
+            st.stop()
+        del st.session_state.ocr_job
+        if ocr_job.status == JOB_CANCELLED:
+            st.info("OCRを取り消しました。")
+        elif ocr_job.status == JOB_ERROR:
+            st.error(f"OCR処理エラー: {ocr_job.error}")
+        else:
+            if processor.last_ocr_error:
+                st.error(f"OCR処理エラー: {processor.last_ocr_error}")
+            if ocr_job.result:
                 st.session_state.ocr_done = True
                 header_scale = st.session_state.get("header_scale", 1.3)
                 min_page_gap = st.session_state.get("min_page_gap", 2)
@@ -618,9 +455,15 @@ if uploaded_file is not None:
                     )
                 if not st.session_state.get("chapter_pattern_manual", False):
                     st.session_state.chapter_pattern_selected = suggest_chapter_pattern_ids(
-                        st.session_state.chapters
+                        st.session_state.chapters, processor.layout
                     )
+                record_analysis(get_analysis_index(), st.session_state.book_hash, processor)
                 st.session_state.ocr_complete_toast = True
+                st.session_state.ocr_cache_hit = processor.last_ocr_cache_hit
+                if processor.page_kinds:
+                    st.session_state.ocr_page_summary = {
+                        kind: processor.page_kinds.count(kind) for kind in ("image", "mixed", "text", "empty")
+                    }
                 notify_ocr_complete()
                 st.success("OCR完了！テキスト情報を取得しました。")
                 st.rerun()
@@ -629,25 +472,25 @@ if uploaded_file is not None:
         st.error("章の区切りが見つかりませんでした。OCRを実行するか、ファイルを確認してください。")
         col_toc, col_pat = st.columns(2)
         with col_toc:
-            if st.button("📑 目次ページから検出"):
+            if st.button("📑 目次ページから検出", disabled=export_running):
                 st.session_state.chapters = processor.detect_chapters_from_toc_pages()
                 if st.session_state.chapters:
                     st.session_state.chapter_pattern_selected = suggest_chapter_pattern_ids(
-                        st.session_state.chapters
+                        st.session_state.chapters, processor.layout
                     )
                     st.success(f"{len(st.session_state.chapters)}件の章を検出しました。")
                     st.rerun()
                 else:
                     st.warning("目次ページが見つからないか、解析できませんでした。")
         with col_pat:
-            if st.button("🔎 パターン検出を試す（ページ上部のみ）"):
+            if st.button("🔎 パターン検出を試す（ページ上部のみ）", disabled=export_running):
                 min_page_gap = st.session_state.get("min_page_gap", 2)
                 st.session_state.chapters = processor.detect_chapters_by_pattern(
                     min_page_gap, top_ratio=0.45, min_size_ratio=0.85
                 )
                 if st.session_state.chapters:
                     st.session_state.chapter_pattern_selected = suggest_chapter_pattern_ids(
-                        st.session_state.chapters
+                        st.session_state.chapters, processor.layout
                     )
                     st.success(f"{len(st.session_state.chapters)}件の章を検出しました。")
                     st.rerun()
@@ -655,12 +498,27 @@ if uploaded_file is not None:
                     st.warning("パターンに一致する見出しも見つかりませんでした。")
     else:
         if st.session_state.pop("ocr_complete_toast", False):
-            st.toast("OCRが完了しました", icon="✅")
+            if st.session_state.pop("ocr_cache_hit", None):
+                st.toast("OCR済みの結果をキャッシュから読み込みました", icon="⚡")
+            else:
+                st.toast("OCRが完了しました", icon="✅")
+        ocr_summary = st.session_state.pop("ocr_page_summary", None)
+        if ocr_summary:
+            st.caption(
+                "OCR対象の判定: 画像のみ {image} / 混在 {mixed} / テキストあり {text} / 空白 {empty} ページ".format(
+                    **ocr_summary
+                )
+            )
+        index_loaded = st.session_state.pop("index_loaded", None)
+        if index_loaded == "edited":
+            st.toast("前回編集した章構成を読み込みました", icon="📚")
+        elif index_loaded == "auto":
+            st.toast("解析済みの本です。前回の検出結果を表示しています", icon="📚")
         st.subheader("🛠 フォルダ構成の編集")
         st.caption("『階層(Lv)』を調整すると、フォルダの入れ子構造を作成できます (Lv1=親フォルダ, Lv2=サブフォルダ...)。")
         col1, col2 = st.columns(2)
         with col1:
-            if st.button("🔁 見出し自動検出をやり直す"):
+            if st.button("🔁 見出し自動検出をやり直す", disabled=export_running):
                 header_scale = st.session_state.get("header_scale", 1.3)
                 min_page_gap = st.session_state.get("min_page_gap", 2)
                 st.session_state.chapters = processor.detect_chapters_by_style(header_scale, min_page_gap)
@@ -672,8 +530,9 @@ if uploaded_file is not None:
                     )
                 if not st.session_state.get("chapter_pattern_manual", False):
                     st.session_state.chapter_pattern_selected = suggest_chapter_pattern_ids(
-                        st.session_state.chapters
+                        st.session_state.chapters, processor.layout
                     )
+                record_analysis(get_analysis_index(), st.session_state.book_hash, processor)
                 st.success("見出しを再検出しました。" if st.session_state.chapters else "見出しが見つかりませんでした。")
                 st.rerun()
         with col2:
@@ -691,16 +550,26 @@ if uploaded_file is not None:
                     st.session_state.chapters = filtered
                     st.success(f"{len(filtered)}件の章レベル見出しに絞り込みました。")
                     st.rerun()
-        df_data = [
-            {"Selected": c.selected, "Level": c.level, "Page": c.page_num, "Title": c.title, "Source": c.source}
-            for c in st.session_state.chapters
-        ]
+        show_thumbnails = st.toggle(
+            "🖼 開始ページのサムネイルを表示",
+            value=False,
+            help="各章の開始ページを小さく画像化して表に並べます（一度作ったものは再利用されます）。書き出し中は使えません。",
+            disabled=export_running,
+        )
+        df_data = []
+        for c in st.session_state.chapters:
+            row = {"Selected": c.selected, "Level": c.level, "Page": c.page_num}
+            if show_thumbnails and not export_running:
+                row["Preview"] = get_page_thumbnail(processor.doc_hash, c.page_num, processor)
+            row.update(Title=c.title, Source=c.source)
+            df_data.append(row)
         edited_df = st.data_editor(
             df_data,
             column_config={
                 "Selected": st.column_config.CheckboxColumn("出力", width="small"),
                 "Level": st.column_config.NumberColumn("階層 Lv", min_value=1, max_value=5, width="small"),
                 "Page": st.column_config.NumberColumn("開始P", width="small"),
+                "Preview": st.column_config.ImageColumn("開始ページ", width="small"),
                 "Title": st.column_config.TextColumn("フォルダ/ファイル名", width="large"),
                 "Source": st.column_config.TextColumn("検出元", disabled=True, width="small"),
             },
@@ -709,31 +578,93 @@ if uploaded_file is not None:
             height=400,
         )
 
+        # 表を編集したら（再検出・絞り込みも含む）、この本の章構成としてインデックスに保存する
+        chapter_table = chapters_from_rows(edited_df)
+        if chapter_table != st.session_state.get("saved_chapter_table"):
+            get_analysis_index().save_chapters(st.session_state.book_hash, EDITED_TABLE, chapter_table)
+            st.session_state.saved_chapter_table = chapter_table
+
         export_label = "画像に変換して保存" if export_mode_radio == "画像(JPEG)フォルダ化" else "分割PDFを保存"
-        if st.button(f"🚀 {export_label}", type="primary"):
-            final_chapters = []
-            for row in edited_df:
-                if row["Selected"]:
-                    final_chapters.append(ChapterInfo(
-                        title=str(row["Title"]),
-                        page_num=int(row["Page"]),
-                        level=int(row["Level"]),
-                        source="User"
-                    ))
+        if st.button(f"🚀 {export_label}", type="primary", disabled=export_running):
+            final_chapters = [c for c in chapter_table if c.selected]
             if not final_chapters:
                 st.warning("出力対象が選択されていません。")
             else:
                 mode_str = "image" if export_mode_radio == "画像(JPEG)フォルダ化" else "pdf"
-                with st.spinner("処理中... フォルダを作成し書き出しています..."):
-                    try:
-                        zip_bytes = processor.process_export(final_chapters, mode_str, img_zoom)
-                        dl_name = f"{processor.book_title}_{mode_str}.zip"
-                        st.balloons()
-                        st.download_button(
-                            label=f"📦 ZIPファイルをダウンロード ({dl_name})",
-                            data=zip_bytes,
-                            file_name=dl_name,
-                            mime="application/zip",
-                        )
-                    except Exception as e:
-                        st.error(f"書き出しエラー: {e}")
+                discard_job(st.session_state.pop("export_job", None))
+                options = dict(
+                    img_zoom=img_zoom,
+                    workers=int(export_workers),
+                    split_options=split_options,
+                    render_cache=get_render_cache(),
+                    color_mode=color_mode,
+                    page_filter=page_filter,
+                )
+                if mode_str == "image":
+                    # ページは1枚ずつ流して書き出すので、同時にメモリにあるのはワーカー数程度のページ
+                    export_pages = sum(s.end_page - s.start_page for s in processor.plan_export(final_chapters))
+                    cost = estimate_render_bytes(export_pages, img_zoom, resident_pages=int(export_workers))
+                else:
+                    # 章の保存は各ワーカーがPDF全体を開く
+                    cost = os.path.getsize(processor.path) * int(export_workers)
+                ticket = get_admission().request(st.session_state.session_id, export_label, cost)
+                st.session_state.export_job = export_job = get_job_runner().submit(
+                    export_label, functools.partial(run_export_job, processor, final_chapters, mode_str, options), ticket
+                )
+                export_running = True
+
+        # 書き出しはバックグラウンドで進み、その間も章の編集を続けられる
+        if export_job is not None:
+            if not export_job.finished:
+                show_job_progress("export_job")
+            elif export_job.status == JOB_CANCELLED:
+                st.info("書き出しを取り消しました。")
+                st.session_state.pop("export_job", None)
+            elif export_job.status == JOB_ERROR:
+                st.error(f"書き出しエラー: {export_job.error}")
+                st.session_state.pop("export_job", None)
+            else:
+                outcome = export_job.result
+                view = outcome.view
+                if not outcome.announced:
+                    outcome.announced = True
+                    st.balloons()
+                dl_name = f"{view.book_title}_{outcome.mode}.zip"
+                st.caption(f"書き出し完了（{format_seconds(export_job.elapsed)}）")
+                col_dl, col_close = st.columns([3, 1])
+                with col_dl:
+                    # ZIP はクリックされたときに読み込む（再実行のたびに全体をメモリに読み込まない）
+                    st.download_button(
+                        label=f"📦 ZIPファイルをダウンロード ({dl_name})",
+                        data=Path(outcome.zip_path).read_bytes,
+                        file_name=dl_name,
+                        mime="application/zip",
+                    )
+                with col_close:
+                    if st.button("🗑 結果を閉じる"):
+                        discard_job(st.session_state.pop("export_job", None))
+                        st.rerun()
+                if outcome.mode == "image" and view.last_render_cache_hits:
+                    st.caption(
+                        f"ページ画像キャッシュから {view.last_render_cache_hits} / {view.last_export_pages} ページを再利用しました。"
+                    )
+                filter_report = view.last_page_filter_report
+                if outcome.mode == "image" and filter_report is not None:
+                    st.caption(
+                        f"空白ページ {filter_report.blank_pages} / 重複ページ {filter_report.duplicate_pages} を検出し、"
+                        f"{filter_report.skipped_renders} ページの画像化を省略しました"
+                        f"（出力サイズ 約 {filter_report.bytes_saved / 1024 / 1024:.1f} MB 削減）。"
+                    )
+                if outcome.mode == "pdf" and view.last_split_report:
+                    st.dataframe(
+                        [
+                            {
+                                "ファイル": r.path,
+                                "ページ数": r.pages,
+                                "サイズ(KB)": round(r.size_bytes / 1024, 1),
+                                "時間(秒)": round(r.seconds, 2),
+                            }
+                            for r in view.last_split_report
+                        ],
+                        width="stretch",
+                    )
@@ -0,0 +1,961 @@
+"""
+PDF Structure Master のコア処理（Streamlit に依存しない）
+- 章の検出（埋め込み目次・目次ページ・フォントサイズ・章タイトルパターン）
+- OCR（ocrmypdf）
+- 分割PDF / 連番JPEG の書き出し（ZIP またはフォルダ）
+GUI（pdf_master.py）とコマンドライン一括処理（batch_split.py）の両方から使う。
+"""
+import fitz  # PyMuPDF
+import numpy as np
+import copy
+import zipfile
+import tempfile
+import os
+import shutil
+import re
+import subprocess
+import weakref
+from dataclasses import dataclass
+from typing import Callable, List
+
+from background_jobs import JobCancelled
+from disk_cache import DiskLRUCache, file_content_hash, make_key
+from chapter_patterns import (
+    CHAPTER_MATCHER,
+    CHAPTER_PATTERN_GROUPS,
+    TOC_ENTRY_MATCHER,
+    get_chapter_matcher,
+)
+from export_workers import (
+    COLOR_MODE_COLOR,
+    JPEG_ENCODER_SIGNATURE,
+    PAGE_FILTER_DEDUPE,
+    PAGE_FILTER_KEEP,
+    PAGE_FILTER_SKIP,
+    PLACEHOLDER_ZOOM,
+    ChapterSplitResult,
+    PageFilterReport,
+    SplitOptions,
+    blank_jpeg_size,
+    probe_pages_parallel,
+    render_page_jpeg,
+    render_pages_parallel,
+    split_chapters_parallel,
+    write_chapter_pdf,
+)
+from page_layout import PageLayoutIndex, SpanColumns
+from page_probe import classify_redundant_pages, page_content_digest, probe_page
+
+try:
+    import ocrmypdf
+    from ocr_progress import report_to as report_ocr_progress_to
+    OCR_AVAILABLE = shutil.which("tesseract") is not None
+except (ImportError, AttributeError):
+    OCR_AVAILABLE = False
+
+
+# --- データ構造 ---
+@dataclass
+class ChapterInfo:
+    title: str
+    page_num: int
+    level: int
+    source: str
+    selected: bool = True
+
+
+@dataclass
+class PageFontStats:
+    """1ページ分のフォント統計（解析インデックスに保存する）。"""
+    page_index: int
+    body_size: float | None
+    max_size: float | None
+    char_count: int
+
+
+def suggest_chapter_pattern_ids(chapters: List[ChapterInfo], layout=None) -> List[str]:
+    """
+    OCR などで検出した見出しタイトルから、
+    どの章タイトルパターンが実際に使われていそうかを推定する。
+    layout（PageLayoutIndex）を渡すと、見出しから判定できない場合に
+    抽出済みページのスパンも手掛かりにする（追加の抽出は行わない）。
+    """
+    used_ids = set()
+    for ch in chapters:
+        title = (ch.title or "").strip()
+        if title:
+            used_ids |= CHAPTER_MATCHER.matched_ids(title)
+    if not used_ids and layout is not None:
+        for page_layout in layout.extracted_pages():
+            for _, spans in page_layout.lines:
+                for text, _, _ in spans:
+                    text = text.strip()
+                    if text and len(text) <= 80:
+                        used_ids |= CHAPTER_MATCHER.matched_ids(text)
+    if not used_ids:
+        return [g["id"] for g in CHAPTER_PATTERN_GROUPS]
+    return sorted(used_ids)
+
+
+# --- OCR ---
+OCR_MODE_TEXT_LAYER = "text_layer"
+OCR_MODE_REWRITE = "rewrite"
+OCR_MODE_FORCE_ALL = "force_all"
+OCR_MODE_LABELS = {
+    OCR_MODE_TEXT_LAYER: "必要なページだけ・テキスト層のみ追加（最速）",
+    OCR_MODE_REWRITE: "必要なページだけ・PDFを作り直す（傾き補正あり）",
+    OCR_MODE_FORCE_ALL: "全ページを強制OCR（従来）",
+}
+# ocrmypdf が OCR のためにページをラスタライズする解像度の目安（メモリの見積もり用）
+OCR_RASTER_DPI = 300
+# OCR 結果キャッシュの容量上限（環境変数 PDF_MASTER_OCR_CACHE_MB で変更可能）
+OCR_CACHE_MAX_BYTES = int(os.environ.get("PDF_MASTER_OCR_CACHE_MB", "2048")) * 1024 * 1024
+# この文字数以上のテキスト層があれば「テキストあり」とみなす
+OCR_TEXT_MIN_CHARS = 20
+# テキストがあっても、画像がページ面積のこの割合以上を占めれば「混在」とみなす
+OCR_IMAGE_COVERAGE = 0.5
+
+
+def ocr_engine_signature() -> str:
+    """OCR キャッシュのキーに含める ocrmypdf と Tesseract のバージョン。"""
+    try:
+        out = subprocess.run(["tesseract", "--version"], capture_output=True, text=True, timeout=10)
+        tesseract = ((out.stdout or out.stderr).splitlines() or ["unknown"])[0]
+    except Exception:
+        tesseract = "unknown"
+    return f"ocrmypdf {getattr(ocrmypdf, '__version__', '?')} / {tesseract}"
+
+
+def _format_page_ranges(page_indices: List[int]) -> str:
+    """0始まりのページ番号を ocrmypdf の pages 指定（1始まり、例: "1-3,7"）にする。"""
+    parts = []
+    run_start = prev = None
+    for pi in sorted(page_indices):
+        if run_start is not None and pi == prev + 1:
+            prev = pi
+            continue
+        if run_start is not None:
+            parts.append(f"{run_start + 1}" if run_start == prev else f"{run_start + 1}-{prev + 1}")
+        run_start = prev = pi
+    if run_start is not None:
+        parts.append(f"{run_start + 1}" if run_start == prev else f"{run_start + 1}-{prev + 1}")
+    return ",".join(parts)
+
+
+# --- 書き出し ---
+@dataclass
+class ExportSection:
+    """書き出し単位となる1章分: フォルダ階層（先頭は本タイトル）とページ範囲 [start_page, end_page)。"""
+    folder_parts: List[str]
+    start_page: int
+    end_page: int
+
+    @property
+    def folder(self) -> str:
+        return "/".join(self.folder_parts)
+
+    @property
+    def pdf_path(self) -> str:
+        """分割PDFモードでの出力先（章名.pdf を親フォルダに置く）。"""
+        return f"{'/'.join(self.folder_parts[:-1])}/{self.folder_parts[-1]}.pdf"
+
+    def image_path(self, page_index: int, ext: str = "jpg") -> str:
+        """画像モードでの出力先（章フォルダ内の3桁連番）。"""
+        return f"{self.folder}/{page_index - self.start_page + 1:03d}.{ext}"
+
+
+class ZipExportSink:
+    """
+    ディスク上の ZIP へ1エントリずつ書き込む。compress=False のエントリは無圧縮（ZIP_STORED）で格納。
+    ファイルとして作るエントリ（分割PDF）は一時フォルダに置かせ、commit_file で ZIP に移す。
+    """
+
+    def __init__(self, zip_path: str):
+        self.zip_path = zip_path
+        self.zf = zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED)
+        self.staging_dir = tempfile.mkdtemp(prefix="pdf_master_export_")
+        self._staged = 0
+
+    def write(self, arcname: str, data: bytes, compress: bool = True) -> None:
+        self.zf.writestr(arcname, data, compress_type=self._compress_type(compress))
+
+    def read(self, arcname: str) -> bytes:
+        """書き込み済みのエントリを読み直す。"""
+        return self.zf.read(arcname)
+
+    def staging_path(self, arcname: str) -> str:
+        self._staged += 1
+        return os.path.join(self.staging_dir, f"{self._staged:05d}{os.path.splitext(arcname)[1]}")
+
+    def commit_file(self, arcname: str, path: str, compress: bool = True) -> None:
+        self.zf.write(path, arcname, compress_type=self._compress_type(compress))
+        os.unlink(path)
+
+    @staticmethod
+    def _compress_type(compress: bool) -> int:
+        return zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+
+    def close(self) -> str:
+        self.zf.close()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        return self.zip_path
+
+    def abort(self) -> None:
+        self.zf.close()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        if os.path.exists(self.zip_path):
+            os.unlink(self.zip_path)
+
+
+class DirectoryExportSink:
+    """ZIP を作らず、アーカイブ内パスと同じフォルダ構成でディレクトリへ直接書き出す。"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def write(self, arcname: str, data: bytes, compress: bool = True) -> None:
+        with open(self.staging_path(arcname), "wb") as f:
+            f.write(data)
+
+    def read(self, arcname: str) -> bytes:
+        """書き込み済みのファイルを読み直す。"""
+        with open(os.path.join(self.root, *arcname.split("/")), "rb") as f:
+            return f.read()
+
+    def staging_path(self, arcname: str) -> str:
+        """最終的な出力先に直接書かせる。"""
+        path = os.path.join(self.root, *arcname.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def commit_file(self, arcname: str, path: str, compress: bool = True) -> None:
+        pass
+
+    def close(self) -> str:
+        return self.root
+
+    def abort(self) -> None:
+        pass
+
+
+# --- コアロジック ---
+# アップロードを作業フォルダへ書き出すときのコピー単位
+UPLOAD_COPY_CHUNK_BYTES = 1024 * 1024
+# 章の開始ページのサムネイルの幅（ピクセル）
+THUMBNAIL_WIDTH = 120
+# ページ画像キャッシュの容量上限（環境変数 PDF_MASTER_RENDER_CACHE_MB で変更可能）
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("PDF_MASTER_RENDER_CACHE_MB", "4096")) * 1024 * 1024
+
+class PDFProcessor:
+    """
+    アップロードされたPDFを作業用の一時フォルダへ1回だけ書き出し、以降はそのパスから開く。
+    OCR・書き出しのワーカーにもパスを渡すため、PDF本体のバイト列をメモリに複製して持たない。
+    作業フォルダは close() またはこのオブジェクトの破棄時に削除される。
+    """
+
+    def __init__(self, file_stream, filename):
+        self.filename = filename
+        self.book_title = os.path.splitext(filename)[0]
+        self.work_dir = tempfile.mkdtemp(prefix="pdf_master_")
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.work_dir, True)
+        self.path = os.path.join(self.work_dir, "source.pdf")
+        with open(self.path, "wb") as f:
+            shutil.copyfileobj(file_stream, f, UPLOAD_COPY_CHUNK_BYTES)
+        self.doc = fitz.open(self.path)
+        self.layout = PageLayoutIndex(self.doc)
+        self._span_columns = None
+        # 2以上で並列解析モード（ページ範囲をプロセスプールに分配してレイアウトを抽出）
+        self.analysis_workers = 1
+        # 直近の分割PDF書き出しの章ごとのサイズ・所要時間
+        self.last_split_report: List[ChapterSplitResult] = []
+        # 直近の OCR 前に classify_pages で求めたページ分類
+        self.page_kinds: List[str] = []
+        # 直近の run_ocr が OCR キャッシュから結果を得たか（キャッシュ未使用なら None）
+        self.last_ocr_cache_hit: bool | None = None
+        # 直近の run_ocr が失敗したときのエラーメッセージ
+        self.last_ocr_error: str | None = None
+        # 直近の画像書き出しでページ画像キャッシュから再利用したページ数（キャッシュ未使用なら None）
+        self.last_render_cache_hits: int | None = None
+        # 直近の書き出しの対象ページ数
+        self.last_export_pages = 0
+        # 直近の画像書き出しでの空白・重複ページの検出結果（検出しなかったなら None）
+        self.last_page_filter_report: PageFilterReport | None = None
+        self._doc_hash = None
+
+    @property
+    def doc_hash(self) -> str:
+        """現在のドキュメント内容の SHA-256（OCR で差し替わると変わる）。"""
+        if self._doc_hash is None:
+            self._doc_hash = file_content_hash(self.path)
+        return self._doc_hash
+
+    def _replace_document(self, new_path: str) -> None:
+        """作業フォルダ内の new_path（OCR 結果など）でドキュメントを差し替え、解析結果を捨てる。"""
+        self.doc.close()
+        old_path = self.path
+        self.path = new_path
+        self._doc_hash = None
+        self.doc = fitz.open(self.path)
+        self.layout = PageLayoutIndex(self.doc)
+        self._span_columns = None
+        if old_path != new_path and os.path.exists(old_path):
+            os.unlink(old_path)
+
+    def _work_path(self, name: str) -> str:
+        """作業フォルダ内で未使用のファイルパス。"""
+        fd, path = tempfile.mkstemp(prefix=name, suffix=".pdf", dir=self.work_dir)
+        os.close(fd)
+        return path
+
+    def close(self) -> None:
+        """ドキュメントを閉じ、作業フォルダ（アップロードの一時コピー・OCR結果）を削除する。"""
+        if not self.doc.is_closed:
+            self.doc.close()
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def open_view(self) -> "PDFProcessor":
+        """
+        同じ作業ファイルを別の fitz.Document で開いたコピーを返す（バックグラウンドでの書き出し用）。
+        fitz.Document は複数のスレッドから同時に使えないため、画面側の操作と書き出しで分ける。
+        作業フォルダは元のオブジェクトが管理し、コピーの close() ではドキュメントを閉じるだけ。
+        """
+        view = copy.copy(self)
+        view.doc = fitz.open(self.path)
+        view.layout = PageLayoutIndex(view.doc)
+        view._span_columns = None
+        view._finalizer = None
+        return view
+
+    def classify_pages(self) -> List[str]:
+        """
+        OCR の要否を判断するため、各ページを分類する。
+        - "text": テキスト層があり、画像は少ない（OCR不要）
+        - "image": テキスト層がなく、画像がある（スキャンページ）
+        - "mixed": テキスト層があるが、ページの大部分を画像が占める
+        - "empty": テキストも画像もない
+        """
+        kinds = []
+        for pi in range(len(self.doc)):
+            page = self.doc[pi]
+            has_text = len(self.layout.page(pi).text.strip()) >= OCR_TEXT_MIN_CHARS
+            page_area = abs(page.rect) or 1
+            image_area = 0.0
+            for info in page.get_image_info():
+                image_area += abs(fitz.Rect(info["bbox"]) & page.rect)
+            has_image = image_area > 0
+            if has_text:
+                kinds.append("mixed" if image_area / page_area >= OCR_IMAGE_COVERAGE else "text")
+            else:
+                kinds.append("image" if has_image else "empty")
+        return kinds
+
+    def run_ocr(
+        self,
+        language='jpn+eng',
+        mode: str = OCR_MODE_FORCE_ALL,
+        jobs: int | None = None,
+        cache: DiskLRUCache | None = None,
+        progress: Callable | None = None,
+    ) -> bool:
+        """
+        ocrmypdf で OCR を実行し、結果のPDFで差し替える。
+        - mode=OCR_MODE_FORCE_ALL: 全ページをラスタライズして再OCR（従来どおり）
+        - mode=OCR_MODE_REWRITE: 画像のみ・混在ページだけを再OCRしてPDFを作り直す（傾き補正・最適化あり）
+        - mode=OCR_MODE_TEXT_LAYER: 画像のみのページにテキスト層だけを追加する（元のページ内容はそのまま・最速）
+        - jobs: ocrmypdf のワーカープロセス数（None なら ocrmypdf の既定＝CPU数）
+        - cache: 内容ハッシュ＋言語・方式・エンジンのバージョンをキーに、OCR済みPDFを再利用する
+        - progress: progress(完了数, 総数, 段階名) で ocrmypdf の進捗を受け取る。
+          JobCancelled を送出すると OCR を中断し、そのまま呼び出し元へ送出する
+        失敗したときは False を返し、理由を last_ocr_error に残す。
+        """
+        if not OCR_AVAILABLE:
+            return False
+        self.last_ocr_cache_hit = None
+        self.last_ocr_error = None
+        cache_key = None
+        if cache is not None:
+            deskew = mode != OCR_MODE_TEXT_LAYER
+            cache_key = make_key(self.doc_hash, language, mode, f"deskew={deskew}", ocr_engine_signature())
+            cached_path = cache.get_path(cache_key)
+            self.last_ocr_cache_hit = cached_path is not None
+            if cached_path is not None:
+                # キャッシュ側の削除（LRU）に影響されないよう、作業フォルダへコピーしてから開く
+                local_path = self._work_path("ocr_")
+                shutil.copyfile(cached_path, local_path)
+                self._replace_document(local_path)
+                return True
+        ocr_kwargs = {"language": language, "progress_bar": progress is not None}
+        if progress is not None:
+            # 進捗バーの代わりに progress へ伝えるプラグイン（ocr_progress.py）
+            ocr_kwargs["plugins"] = ["ocr_progress"]
+        if jobs:
+            ocr_kwargs["jobs"] = jobs
+        if mode == OCR_MODE_FORCE_ALL:
+            ocr_kwargs.update(force_ocr=True, deskew=True)
+        else:
+            self.page_kinds = self.classify_pages()
+            needed = {"image"} if mode == OCR_MODE_TEXT_LAYER else {"image", "mixed"}
+            targets = [pi for pi, kind in enumerate(self.page_kinds) if kind in needed]
+            if not targets:
+                return True
+            ocr_kwargs["pages"] = _format_page_ranges(targets)
+            if mode == OCR_MODE_TEXT_LAYER:
+                ocr_kwargs.update(skip_text=True, output_type="pdf", optimize=0)
+            else:
+                ocr_kwargs.update(force_ocr=True, deskew=True, optimize=1)
+        output_path = self._work_path("ocr_")
+        try:
+            with report_ocr_progress_to(progress):
+                ocrmypdf.ocr(self.path, output_path, **ocr_kwargs)
+            if cache is not None:
+                cache.put_file(cache_key, output_path)
+            self._replace_document(output_path)
+            return True
+        except Exception as e:
+            if os.path.exists(output_path):
+                os.unlink(output_path)
+            if isinstance(e, JobCancelled):
+                raise
+            self.last_ocr_error = str(e)
+            return False
+
+    def get_existing_toc(self) -> List[ChapterInfo]:
+        toc = self.doc.get_toc()
+        chapters = []
+        if toc:
+            for item in toc:
+                lvl, title, page = item
+                if page > 0:
+                    chapters.append(ChapterInfo(title=title, page_num=page, level=lvl, source="既存目次"))
+        return chapters
+
+    def detect_chapters(self, header_scale: float = 1.3, min_page_gap: int = 2) -> List[ChapterInfo]:
+        """
+        読み込み直後の章検出。見つかるまで次の順に試す:
+        埋め込み目次 → 目次ページ → フォントサイズ解析 → 章タイトルパターン（ページ上部のみ）
+        """
+        chapters = self.get_existing_toc()
+        if not chapters:
+            chapters = self.detect_chapters_from_toc_pages()
+        if not chapters:
+            chapters = self.detect_chapters_by_style(header_scale, min_page_gap)
+        if not chapters:
+            chapters = self.detect_chapters_by_pattern(min_page_gap, top_ratio=0.45, min_size_ratio=0.85)
+        return chapters
+
+    def _get_span_columns(self) -> SpanColumns:
+        """全スパンの列指向配列（初回だけ全ページを抽出して作成し、以降は使い回す）。"""
+        if self._span_columns is None:
+            if self.analysis_workers > 1:
+                # 並列解析モード: 全ページのレイアウトをプロセスプールで先に抽出する
+                self.layout.prefetch(self.path, workers=self.analysis_workers)
+            self._span_columns = SpanColumns(self.layout, CHAPTER_MATCHER)
+        return self._span_columns
+
+    def _get_page_body_size(self, page_index: int) -> float | None:
+        """ページ内の本文フォントサイズ（最頻出）を返す。"""
+        body = self._get_span_columns().page_body[page_index]
+        return None if np.isnan(body) else float(body)
+
+    def _get_doc_body_size(self, max_pages: int = 20) -> float | None:
+        """ドキュメント全体の本文フォントサイズ（最頻出）を返す。"""
+        font_counts = {}
+        for pi in range(min(max_pages, len(self.doc))):
+            bs = self._get_page_body_size(pi)
+            if bs is not None:
+                font_counts[bs] = font_counts.get(bs, 0) + 1
+        return max(font_counts, key=font_counts.get) if font_counts else None
+
+    def detect_chapters_by_style(
+        self,
+        header_scale: float = 1.3,
+        min_page_gap: int = 2,
+        top_ratio: float = 0.5,
+        per_page_font: bool = True,
+    ) -> List[ChapterInfo]:
+        """
+        フォントサイズ解析で見出しを検出。
+        per_page_font=True のとき、各ページごとに本文サイズを推定し、
+        そのページ内で「本文より大きい」テキストだけを見出し候補にする（ロバスト性向上）。
+        抽出済みの列配列に対するフィルタだけで判定するため、閾値を変えた再検出は即座に終わる。
+        """
+        cols = self._get_span_columns()
+        fallback_body = self._get_doc_body_size()
+        if not per_page_font and fallback_body is None:
+            return []
+
+        fallback = np.nan if fallback_body is None else fallback_body
+        body = cols.page_body if per_page_font else np.full(cols.n_pages, fallback)
+        body = np.where(np.isnan(body), fallback, body)
+        span_body = body[cols.page]
+        mask = (
+            ~np.isnan(span_body)
+            & (cols.line_top <= cols.page_height[cols.page] * top_ratio)
+            & (cols.text_len > 1)
+            & (cols.text_len < 60)
+            & (cols.size >= span_body * header_scale)
+        )
+        return [
+            ChapterInfo(title=cols.texts[row], page_num=int(cols.page[row]) + 1, level=1, source="自動検出")
+            for row in cols.first_rows_per_page(mask, min_page_gap)
+        ]
+
+    def detect_chapters_by_pattern(
+        self,
+        min_page_gap: int = 2,
+        top_ratio: float = 0.45,
+        margin_ratio: float = 0.12,
+        min_size_ratio: float = 0.0,
+        clip_header: bool | None = None,
+    ) -> List[ChapterInfo]:
+        """
+        OCR後のPDF向け: パターンにマッチする行を章として検出。
+        - top_ratio: ページ上部（高さの top_ratio 以内）のテキストのみ対象（フッター除外）
+        - margin_ratio: 左右マージン（幅の margin_ratio ずつ）を除外。サイドバー「第○章」の誤検出を防ぐ。
+        - min_size_ratio: 本文フォントに対する最小倍率（0=無効）。0.85以上でフッターの小文字を除外可能。
+        - clip_header: True でページ上部の帯だけをクリップ抽出する（本文の多いOCRページ向け）。
+          None のときは、全ページの抽出がまだなら自動でクリップ抽出を使う。
+        """
+        if clip_header is None:
+            clip_header = self._span_columns is None
+        if clip_header:
+            return self._detect_chapters_by_pattern_clipped(min_page_gap, top_ratio, margin_ratio, min_size_ratio)
+
+        cols = self._get_span_columns()
+        body_size = cols.doc_body_size(max_pages=20) if min_size_ratio > 0 else None
+
+        page_width = cols.page_width[cols.page]
+        mask = (
+            # ページ上部のみ対象（フッターの「第○章」を除外）
+            (cols.line_top <= cols.page_height[cols.page] * top_ratio)
+            # 左右マージン（サイドバー「第○章」など）を除外
+            & (cols.line_cx >= page_width * margin_ratio)
+            & (cols.line_cx <= page_width * (1 - margin_ratio))
+            & (cols.text_len > 0)
+            & (cols.text_len <= 80)
+            & (cols.group_mask != 0)
+        )
+        # フォントサイズでフィルタ（本文より小さい=フッターの可能性）
+        if body_size and min_size_ratio > 0:
+            mask &= cols.size >= body_size * min_size_ratio
+        return [
+            ChapterInfo(
+                title=cols.texts[row][:60],
+                page_num=int(cols.page[row]) + 1,
+                level=1,
+                source="パターン検出(OCR)",
+            )
+            for row in cols.first_rows_per_page(mask, min_page_gap)
+        ]
+
+    def _detect_chapters_by_pattern_clipped(
+        self,
+        min_page_gap: int,
+        top_ratio: float,
+        margin_ratio: float,
+        min_size_ratio: float,
+    ) -> List[ChapterInfo]:
+        """
+        detect_chapters_by_pattern のクリップ抽出版。
+        各ページでヘッダー帯だけを抽出し、最初にマッチしたスパンで次のページへ進む。
+        min_page_gap で飛ばすページは抽出そのものを行わない。
+        """
+        body_size = self.layout.body_size(max_pages=20) if min_size_ratio > 0 else None
+
+        candidates = []
+        for page_index in range(len(self.doc)):
+            page_no = page_index + 1
+
+            if candidates and (page_no - candidates[-1].page_num) < min_page_gap:
+                continue
+
+            layout = self.layout.header_band(page_index, top_ratio)
+            title = self._first_pattern_span(layout, top_ratio, margin_ratio, body_size, min_size_ratio)
+            if title is not None:
+                candidates.append(
+                    ChapterInfo(title=title[:60], page_num=page_no, level=1, source="パターン検出(OCR)")
+                )
+        return candidates
+
+    @staticmethod
+    def _first_pattern_span(layout, top_ratio, margin_ratio, body_size, min_size_ratio) -> str | None:
+        """ページ内で最初に章タイトルパターンにマッチしたスパンのテキスト（なければ None）。"""
+        for line_bbox, spans in layout.lines:
+            # ページ上部のみ対象（フッターの「第○章」を除外）
+            if line_bbox[1] > layout.height * top_ratio:
+                continue
+            # 左右マージン（サイドバー「第○章」など）を除外
+            center_x = (line_bbox[0] + line_bbox[2]) / 2
+            if center_x < layout.width * margin_ratio or center_x > layout.width * (1 - margin_ratio):
+                continue
+            for text, size, _ in spans:
+                text = text.strip()
+                if not text or len(text) > 80:
+                    continue
+                # フォントサイズでフィルタ（本文より小さい=フッターの可能性）
+                if body_size and min_size_ratio > 0 and size < body_size * min_size_ratio:
+                    continue
+                if CHAPTER_MATCHER.search(text) is not None:
+                    return text
+        return None
+
+    def find_toc_pages(self, toc_max_pages: int = 25) -> List[int]:
+        """先頭 toc_max_pages ページのうち、目次ページらしいページの番号（0始まり）。"""
+        toc_page_indices = []
+        for pi in range(min(toc_max_pages, len(self.doc))):
+            text = self.layout.page(pi).text
+            if not text:
+                continue
+            # 「目次」「Contents」などが含まれるページを候補に
+            if any(kw in text for kw in ("目次", "Contents", "CONTENTS", "Table of Contents")):
+                toc_page_indices.append(pi)
+        return toc_page_indices
+
+    def page_font_stats(self) -> List[PageFontStats]:
+        """
+        ページごとの本文サイズ・最大サイズ・文字数。
+        フォントサイズ解析などで全ページを抽出済みのときだけ返す（未抽出なら空リスト、新たな抽出はしない）。
+        """
+        cols = self._span_columns
+        if cols is None:
+            return []
+        max_size = np.zeros(cols.n_pages)
+        np.maximum.at(max_size, cols.page, cols.size)
+        chars = np.bincount(cols.page, weights=cols.text_len, minlength=cols.n_pages)
+        return [
+            PageFontStats(
+                page_index=pi,
+                body_size=None if np.isnan(cols.page_body[pi]) else float(cols.page_body[pi]),
+                max_size=float(max_size[pi]) if max_size[pi] > 0 else None,
+                char_count=int(chars[pi]),
+            )
+            for pi in range(cols.n_pages)
+        ]
+
+    def detect_chapters_from_toc_pages(
+        self,
+        toc_max_pages: int = 25,
+    ) -> List[ChapterInfo]:
+        """
+        目次ページを特定し、章タイトルと開始ページを抽出する。
+        目次フォーマットは書籍により異なるが、「第1章 ... 15」のように
+        行末にページ番号がある形式を想定する。
+        """
+        toc_page_indices = self.find_toc_pages(toc_max_pages)
+        if not toc_page_indices:
+            return []
+
+        chapters = []
+        seen_pages = set()
+        for pi in toc_page_indices:
+            for _, spans in self.layout.page(pi).lines:
+                line_text = " ".join(s[0] for s in spans)
+                line_text = line_text.strip()
+                if not line_text or len(line_text) > 120:
+                    continue
+                # 目次行として有効か（章パターン or 「1. はじめに」形式）
+                if TOC_ENTRY_MATCHER.search(line_text) is None:
+                    continue
+                # 行末のページ番号を抽出（.... 15, ……… 15, 15 など複数フォーマット）
+                page_match = re.search(r"[\s.\・…－\-ー]*(\d{1,4})\s*$", line_text)
+                if not page_match:
+                    continue
+                page_num = int(page_match.group(1))
+                if page_num < 1 or page_num > len(self.doc):
+                    continue
+                if page_num in seen_pages:
+                    continue
+                seen_pages.add(page_num)
+                title = re.sub(r"[\s.\・…－\-ー]*\d{1,4}\s*$", "", line_text).strip()
+                if not title:
+                    title = line_text[:50]
+                chapters.append(
+                    ChapterInfo(
+                        title=title[:60],
+                        page_num=page_num,
+                        level=1,
+                        source="目次",
+                    )
+                )
+        return sorted(chapters, key=lambda c: c.page_num)
+
+    def filter_major_chapters(
+        self,
+        chapters: List[ChapterInfo],
+        selected_pattern_ids: List[str] | None = None,
+        keyword: str | None = None,
+        min_distance: int = 5,
+    ) -> List[ChapterInfo]:
+        """
+        章だけを残すためのフィルタ:
+        - タイトルが章タイトルらしいものだけを残す
+          （キーワード、または選択された章タイトルパターンにマッチ）
+        - 同じタイトルが近いページに繰り返し出る場合は、最初の1つだけ残す
+        """
+        if not chapters:
+            return []
+
+        filtered: List[ChapterInfo] = []
+        seen_pages_by_title = {}
+
+        # どのパターンを使うか決定（チェックボックスで未選択なら全パターン）
+        matcher = get_chapter_matcher(selected_pattern_ids)
+
+        for ch in sorted(chapters, key=lambda c: c.page_num):
+            title = (ch.title or "").strip()
+            if not title:
+                continue
+
+            looks_like_chapter = bool(keyword and keyword in title) or matcher.search(title) is not None
+            if not looks_like_chapter:
+                continue
+
+            norm_title = re.sub(r"\s+", "", title)
+            last_page = seen_pages_by_title.get(norm_title)
+            if last_page is not None and (ch.page_num - last_page) < min_distance:
+                continue
+
+            seen_pages_by_title[norm_title] = ch.page_num
+            filtered.append(ch)
+
+        return filtered
+
+    def render_thumbnail(self, page_index: int, width: int = THUMBNAIL_WIDTH) -> bytes:
+        """page_index のページを幅 width ピクセルの小さな JPEG にする（章の境界確認用）。"""
+        page = self.doc[page_index]
+        return render_page_jpeg(page, width / (page.rect.width or width))
+
+    def plan_export(self, chapters: List[ChapterInfo]) -> List[ExportSection]:
+        """章リストから、出力する各章のフォルダ階層とページ範囲を決める。"""
+        sorted_chapters = sorted(chapters, key=lambda x: x.page_num)
+        path_stack = []
+        sections = []
+        for i, chapter in enumerate(sorted_chapters):
+            start_page = chapter.page_num - 1
+            if i == len(sorted_chapters) - 1:
+                end_page = len(self.doc)
+            else:
+                end_page = sorted_chapters[i + 1].page_num - 1
+            if start_page >= end_page:
+                continue
+
+            while path_stack and path_stack[-1][0] >= chapter.level:
+                path_stack.pop()
+            safe_title = "".join(c for c in chapter.title if c.isalnum() or c in (' ', '-', '_', '.', '(', ')')).strip()
+            if not safe_title:
+                safe_title = f"Chapter_{i+1}"
+            path_stack.append((chapter.level, safe_title))
+            folder_parts = [self.book_title] + [p[1] for p in path_stack]
+            sections.append(ExportSection(folder_parts=folder_parts, start_page=start_page, end_page=end_page))
+        return sections
+
+    def _render_cache_key(self, page_index: int, img_zoom: float, color_mode: str) -> str:
+        return make_key(self.doc_hash, page_index, img_zoom, color_mode, JPEG_ENCODER_SIGNATURE)
+
+    def find_redundant_pages(self, page_indices: List[int], workers: int = 1, keep_first_blank: bool = False) -> dict:
+        """
+        空白ページと、それより前のページと画素が完全に一致する重複ページを探す。
+        低解像度の画素が一致しても、本来の解像度では小さな文字・ノンブルだけが違うことがあるので、
+        ページの内容（page_content_digest）も一致するときだけ重複とする。
+        返り値は {ページ番号: (種類, 代表ページ)}。種類は "blank" か "duplicate"、
+        代表ページは重複元（空白ページは keep_first_blank のとき最初の空白ページ、それ以外は None）。
+        """
+        if workers > 1 and len(page_indices) > 1:
+            probes = probe_pages_parallel(self.path, page_indices, workers=workers)
+        else:
+            probes = [probe_page(self.doc[pi]) for pi in page_indices]
+        return classify_redundant_pages(
+            page_indices, probes, lambda pi: page_content_digest(self.doc[pi]), keep_first_blank
+        )
+
+    def _iter_rendered_pages(
+        self,
+        sections: List[ExportSection],
+        img_zoom: float,
+        workers: int,
+        cache: DiskLRUCache | None = None,
+        color_mode: str = COLOR_MODE_COLOR,
+        page_filter: str = PAGE_FILTER_KEEP,
+        sink=None,
+    ):
+        """
+        各章のページを章・ページ順にレンダリングし、(章, ページ番号, JPEGバイト列) を返す。
+        cache があれば、キャッシュ済みのページはそこから読み、残りのページだけをレンダリングして登録する。
+        page_filter が PAGE_FILTER_KEEP 以外なら、空白・重複ページは本来の解像度ではレンダリングせず、
+        出力しない（SKIP、JPEGバイト列は None）・低解像度の代替画像にする（PLACEHOLDER）・
+        代表ページの画像を使い回す（DEDUPE）。
+        DEDUPE では代表ページの画像をメモリに残さず、呼び出し側が書き込んだ sink から読み直す
+        （返したページは次のページを求める前に sink に書き込まれていること。sink がなければレンダリングし直す）。
+        """
+        owners = [(section, p_idx) for section in sections for p_idx in range(section.start_page, section.end_page)]
+        roles = {}
+        report = None
+        if page_filter != PAGE_FILTER_KEEP:
+            roles = self.find_redundant_pages(
+                [p_idx for _, p_idx in owners], workers, keep_first_blank=page_filter == PAGE_FILTER_DEDUPE
+            )
+            report = PageFilterReport()
+        self.last_page_filter_report = report
+        # 使い回しのために画像を残しておく代表ページ
+        reused = {rep for _, rep in roles.values() if rep is not None} if page_filter == PAGE_FILTER_DEDUPE else set()
+
+        cached = {}
+        self.last_render_cache_hits = None
+        if cache is not None:
+            for _, p_idx in owners:
+                if p_idx in roles:
+                    continue
+                path = cache.get_path(self._render_cache_key(p_idx, img_zoom, color_mode))
+                if path is not None:
+                    cached[p_idx] = path
+            self.last_render_cache_hits = len(cached)
+        missing = [p_idx for _, p_idx in owners if p_idx not in cached and p_idx not in roles]
+        if workers > 1 and len(missing) > 1:
+            rendered = render_pages_parallel(self.path, missing, img_zoom, workers=workers, color_mode=color_mode)
+        else:
+            rendered = ((p_idx, render_page_jpeg(self.doc[p_idx], img_zoom, color_mode)) for p_idx in missing)
+        sizes = {}
+        # 使い回す代表ページ → その画像の sink 内のパス
+        kept = {}
+
+        def representative_image(rep: int) -> bytes:
+            if sink is not None:
+                return sink.read(kept[rep])
+            return render_page_jpeg(self.doc[rep], img_zoom, color_mode)
+        for section, p_idx in owners:
+            role = roles.get(p_idx)
+            if role is not None:
+                kind, rep = role
+                report.skipped_renders += 1
+                if kind == "blank":
+                    report.blank_pages += 1
+                else:
+                    report.duplicate_pages += 1
+                if page_filter == PAGE_FILTER_DEDUPE:
+                    yield section, p_idx, representative_image(rep)
+                    continue
+                full_size = sizes[rep] if rep is not None else blank_jpeg_size(self.doc[p_idx], img_zoom, color_mode)
+                if page_filter == PAGE_FILTER_SKIP:
+                    report.bytes_saved += full_size
+                    yield section, p_idx, None
+                    continue
+                img_data = render_page_jpeg(self.doc[p_idx], PLACEHOLDER_ZOOM, color_mode)
+                report.bytes_saved += max(0, full_size - len(img_data))
+                yield section, p_idx, img_data
+                continue
+
+            if p_idx in cached:
+                try:
+                    img_data = cached[p_idx].read_bytes()
+                except FileNotFoundError:
+                    # 確認後に他のセッションの書き込みで追い出された
+                    img_data = render_page_jpeg(self.doc[p_idx], img_zoom, color_mode)
+            else:
+                _, img_data = next(rendered)
+                if cache is not None:
+                    cache.put(self._render_cache_key(p_idx, img_zoom, color_mode), img_data)
+            sizes[p_idx] = len(img_data)
+            if p_idx in reused:
+                kept[p_idx] = section.image_path(p_idx)
+            yield section, p_idx, img_data
+
+    def split_chapters(
+        self,
+        sections: List[ExportSection],
+        sink,
+        options: SplitOptions,
+        workers: int = 1,
+        progress: Callable | None = None,
+    ) -> List[ChapterSplitResult]:
+        """
+        分割PDFエンジン: 各章を options で保存し、章・ページ順に sink へ格納する。
+        workers が2以上なら章ごとの保存を複数プロセスで並列に行う。
+        progress があれば、1章格納するごとに progress(格納済みページ数, 総ページ数) を呼ぶ。
+        """
+        jobs = [(s.start_page, s.end_page, sink.staging_path(s.pdf_path)) for s in sections]
+        if workers > 1 and len(jobs) > 1:
+            written = split_chapters_parallel(self.path, jobs, options, workers=workers)
+        else:
+            written = (
+                (job, *write_chapter_pdf(self.doc, job[0], job[1], job[2], options)) for job in jobs
+            )
+        report = []
+        total_pages = sum(s.end_page - s.start_page for s in sections)
+        done_pages = 0
+        for section, (job, size, seconds) in zip(sections, written):
+            sink.commit_file(section.pdf_path, job[2])
+            done_pages += section.end_page - section.start_page
+            if progress is not None:
+                progress(done_pages, total_pages)
+            report.append(
+                ChapterSplitResult(
+                    path=section.pdf_path,
+                    pages=section.end_page - section.start_page,
+                    size_bytes=size,
+                    seconds=seconds,
+                )
+            )
+        return report
+
+    def process_export(
+        self,
+        chapters: List[ChapterInfo],
+        export_mode: str,
+        img_zoom: float = 2.0,
+        zip_path: str | None = None,
+        output_dir: str | None = None,
+        workers: int = 1,
+        split_options: SplitOptions | None = None,
+        render_cache: DiskLRUCache | None = None,
+        color_mode: str = COLOR_MODE_COLOR,
+        page_filter: str = PAGE_FILTER_KEEP,
+        progress: Callable | None = None,
+    ) -> str:
+        """
+        章ごとに分割PDFまたは連番JPEGを書き出し、出力先のパスを返す。
+        - output_dir あり: ZIPを作らず、フォルダ構成のままディレクトリへ直接書き出す
+        - それ以外: zip_path（省略時は一時ファイル。削除は呼び出し側）のZIPへ1エントリずつ書き込む
+        どちらもメモリに載るのは書き出し中の1エントリ分だけ。
+        - workers: 2以上で章の保存（PDFモード）やレンダリング・エンコード（画像モード）を
+          複数プロセスで並列実行する（書き込みはこのプロセスが章・ページ順に行う）
+        - split_options: 分割PDFの保存オプション（garbage/deflate/clean）。結果は last_split_report に残る
+        - render_cache: 画像モードで、内容ハッシュ・ページ・倍率・エンコーダ設定をキーにページ画像を再利用する
+          （章の境界や名前だけを変えた再書き出しは、ZIPへの詰め直しだけで済む）
+        - color_mode: 画像モードで、白黒ページをグレースケール（COLOR_MODE_GRAY）または2値（COLOR_MODE_BILEVEL）で保存する
+        - page_filter: 画像モードでの空白・重複ページの扱い。結果は last_page_filter_report に残る
+        - progress: 書き出しが進むたびに progress(処理済みページ数, 総ページ数) を呼ぶ。
+          JobCancelled などを送出すると書き出しを中断し、途中まで書いた ZIP を削除する
+        """
+        if output_dir is not None:
+            sink = DirectoryExportSink(output_dir)
+        else:
+            if zip_path is None:
+                fd, zip_path = tempfile.mkstemp(suffix=".zip")
+                os.close(fd)
+            sink = ZipExportSink(zip_path)
+        try:
+            sections = self.plan_export(chapters)
+            self.last_export_pages = sum(s.end_page - s.start_page for s in sections)
+            if export_mode == "pdf":
+                self.last_split_report = self.split_chapters(
+                    sections, sink, split_options or SplitOptions(), workers=workers, progress=progress
+                )
+
+            elif export_mode == "image":
+                for done, (section, p_idx, img_data) in enumerate(
+                    self._iter_rendered_pages(
+                        sections, img_zoom, workers, cache=render_cache, color_mode=color_mode,
+                        page_filter=page_filter, sink=sink,
+                    ),
+                    1,
+                ):
+                    if img_data is not None:
+                        # JPEG は圧縮済みなので deflate せずに格納する
+                        sink.write(section.image_path(p_idx), img_data, compress=False)
+                    if progress is not None:
+                        progress(done, self.last_export_pages)
+        except BaseException:
+            sink.abort()
+            raise
+        return sink.close()
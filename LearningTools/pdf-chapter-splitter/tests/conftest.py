@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+
+import fitz  # PyMuPDF
+import pytest
+
+_APP_DIR = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(_APP_DIR), str(_APP_DIR.parent / "pdf-common")]
+
+# サンプルPDFのページ数（page_layout.PARALLEL_MIN_PAGES 以上にして並列解析の経路も通す）
+SAMPLE_PAGES = 70
+# 白紙のページと、直前のページとまったく同じ内容のページ（0 始まり）
+SAMPLE_BLANK_PAGES = (9, 10, 41)
+SAMPLE_DUPLICATE_PAGES = (21, 33)
+
+
+@pytest.fixture(scope="session")
+def sample_pdf(tmp_path_factory) -> str:
+    """章見出し・本文・白紙・重複ページを含むサンプルPDFのパス。"""
+    path = tmp_path_factory.mktemp("pdf") / "sample.pdf"
+    doc = fitz.open()
+    chapter = 0
+    for page_index in range(SAMPLE_PAGES):
+        page = doc.new_page(width=595, height=842)
+        if page_index in SAMPLE_BLANK_PAGES:
+            continue
+        source = page_index - 1 if page_index in SAMPLE_DUPLICATE_PAGES else page_index
+        if source % 12 == 0:
+            chapter = source // 12 + 1
+            page.insert_text((72, 100), f"Chapter {chapter}", fontsize=28)
+        for line in range(20):
+            page.insert_text((72, 160 + line * 28), f"Chapter {chapter} body text {source}-{line}", fontsize=11)
+        page.draw_rect(fitz.Rect(72, 740, 72 + 6 * (source % 40), 760), color=(0.8, 0.1, 0.1), fill=(0.9, 0.4, 0.2))
+    doc.save(path)
+    doc.close()
+    return str(path)
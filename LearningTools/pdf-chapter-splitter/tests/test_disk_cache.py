@@ -0,0 +1,30 @@
+import os
+
+from disk_cache import DiskLRUCache
+
+
+def test_overwrite_does_not_inflate_size_accounting(tmp_path):
+    cache = DiskLRUCache(tmp_path, max_bytes=1000)
+    cache.put("aa01", b"a" * 300)
+    cache.put("bb01", b"b" * 300)
+    for n in range(10):
+        cache.put("aa01", bytes([n]) * 300)
+        # 見積もりがずれると、上限に達していなくても登録のたびに全ファイルを数え直す
+        assert cache._approx_bytes == cache.total_bytes() == 600
+    assert cache.get("bb01") == b"b" * 300
+    assert cache.get("aa01") == bytes([9]) * 300
+
+
+def test_overwrite_with_different_size_then_evict_least_recently_used(tmp_path):
+    cache = DiskLRUCache(tmp_path, max_bytes=1000)
+    for n, key in enumerate(["aa01", "bb01", "cc01"]):
+        cache.put(key, b"x" * 300)
+        os.utime(cache._path(key), (n + 1, n + 1))
+    cache.put("cc01", b"y" * 100)  # 上書きで小さくなる（合計 700）
+    assert cache.total_bytes() == 700
+    os.utime(cache._path("cc01"), (3, 3))
+    assert cache.get_path("aa01") is not None  # aa01 を最近使ったことにする
+    cache.put("dd01", b"z" * 400)  # 合計 1100 → 最終利用が最も古い bb01 だけを削除
+    assert cache.get_path("bb01") is None
+    assert all(cache.get_path(key) is not None for key in ["aa01", "cc01", "dd01"])
+    assert cache._approx_bytes == cache.total_bytes() == 800
@@ -0,0 +1,67 @@
+import threading
+from pathlib import Path
+
+import fitz  # PyMuPDF
+import pytest
+
+from conftest import SAMPLE_BLANK_PAGES, SAMPLE_DUPLICATE_PAGES
+from export_workers import (
+    COLOR_MODE_BILEVEL,
+    COLOR_MODE_COLOR,
+    SplitOptions,
+    probe_pages_parallel,
+    render_page_jpeg,
+    render_pages_parallel,
+    split_chapters_parallel,
+    write_chapter_pdf,
+)
+from page_probe import probe_page
+
+
+@pytest.mark.parametrize("color_mode", [COLOR_MODE_COLOR, COLOR_MODE_BILEVEL])
+def test_render_pages_parallel_matches_sequential(sample_pdf, color_mode):
+    pages = list(range(0, 30, 3))
+    with fitz.open(sample_pdf) as doc:
+        sequential = [(pi, render_page_jpeg(doc[pi], 0.5, color_mode)) for pi in pages]
+    parallel = list(render_pages_parallel(sample_pdf, pages, 0.5, workers=2, color_mode=color_mode))
+    assert parallel == sequential
+
+
+def test_render_pages_parallel_from_background_thread(sample_pdf):
+    # 書き出しジョブ（background_jobs.JobRunner）と同じく、メインスレッド以外からワーカーを起動する
+    pages = [0, 1, 2, 3, 4]
+    with fitz.open(sample_pdf) as doc:
+        sequential = [(pi, render_page_jpeg(doc[pi], 0.5)) for pi in pages]
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(render_pages_parallel(sample_pdf, pages, 0.5, workers=2)))
+    thread.start()
+    thread.join(timeout=120)
+    assert results == sequential
+
+
+def test_probe_pages_parallel_matches_sequential(sample_pdf):
+    source = Path(sample_pdf).read_bytes()
+    pages = list(range(0, 45))
+    with fitz.open(sample_pdf) as doc:
+        sequential = [probe_page(doc[pi]) for pi in pages]
+    parallel = probe_pages_parallel(source, pages, workers=2)
+    assert parallel == sequential
+    assert [pi for pi, (blank, _) in zip(pages, parallel) if blank] == [pi for pi in SAMPLE_BLANK_PAGES if pi < 45]
+    for pi in SAMPLE_DUPLICATE_PAGES:
+        assert parallel[pi][1] == parallel[pi - 1][1]
+
+
+def test_split_chapters_parallel_matches_sequential(sample_pdf, tmp_path):
+    options = SplitOptions()
+    chapters = [(0, 12), (12, 24), (24, 70)]
+    with fitz.open(sample_pdf) as doc:
+        for start, end in chapters:
+            write_chapter_pdf(doc, start, end, str(tmp_path / f"seq_{start}.pdf"), options)
+    jobs = [(start, end, str(tmp_path / f"par_{start}.pdf")) for start, end in chapters]
+    results = list(split_chapters_parallel(sample_pdf, jobs, options, workers=2))
+    assert [job for job, _, _ in results] == jobs
+    for (start, end, out_path), size, _ in results:
+        assert size == Path(out_path).stat().st_size
+        with fitz.open(out_path) as part, fitz.open(str(tmp_path / f"seq_{start}.pdf")) as expected:
+            assert len(part) == end - start
+            assert [page.get_text() for page in part] == [page.get_text() for page in expected]
@@ -0,0 +1,13 @@
+import fitz  # PyMuPDF
+
+from page_layout import PageLayoutIndex
+
+
+def test_prefetch_in_worker_processes_matches_sequential(sample_pdf):
+    with fitz.open(sample_pdf) as doc:
+        sequential = PageLayoutIndex(doc)
+        sequential.prefetch(sample_pdf, workers=1)
+        parallel = PageLayoutIndex(doc)
+        parallel.prefetch(sample_pdf, workers=2)
+        assert parallel.extracted_pages() == sequential.extracted_pages()
+        assert len(parallel.extracted_pages()) == len(doc)
@@ -0,0 +1,64 @@
+import zipfile
+
+import fitz  # PyMuPDF
+import pytest
+
+from export_workers import PAGE_FILTER_DEDUPE, render_page_jpeg
+from page_probe import probe_page
+from pdf_processor import ChapterInfo, PDFProcessor
+
+
+@pytest.fixture
+def near_duplicate_pdf(tmp_path) -> str:
+    """
+    0・1・3 ページは同じ内容、2 ページは低解像度の判定用レンダリングでは区別できない
+    小さなノンブルだけが違うページ。
+    """
+    path = tmp_path / "near_duplicate.pdf"
+    doc = fitz.open()
+    for page_number in (None, None, "p. 12", None):
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((72, 100), "Same body text", fontsize=14)
+        if page_number:
+            page.insert_text((500, 820), page_number, fontsize=0.3)
+    doc.save(path)
+    doc.close()
+    return str(path)
+
+
+def open_processor(path: str) -> PDFProcessor:
+    with open(path, "rb") as f:
+        return PDFProcessor(f, "book.pdf")
+
+
+def test_low_resolution_match_with_different_content_is_not_a_duplicate(near_duplicate_pdf):
+    processor = open_processor(near_duplicate_pdf)
+    try:
+        assert probe_page(processor.doc[2]) == probe_page(processor.doc[0])
+        assert processor.find_redundant_pages([0, 1, 2, 3]) == {1: ("duplicate", 0), 3: ("duplicate", 0)}
+    finally:
+        processor.close()
+
+
+@pytest.mark.parametrize("to_directory", [False, True])
+def test_dedupe_export_reuses_representative_written_to_sink(near_duplicate_pdf, tmp_path, to_directory):
+    processor = open_processor(near_duplicate_pdf)
+    try:
+        chapters = [ChapterInfo("One", 1, 1, "test")]
+        if to_directory:
+            out = processor.process_export(
+                chapters, "image", img_zoom=1.0, output_dir=str(tmp_path / "out"), page_filter=PAGE_FILTER_DEDUPE
+            )
+            images = [(tmp_path / "out" / "book" / "One" / f"{n:03d}.jpg").read_bytes() for n in range(1, 5)]
+        else:
+            out = processor.process_export(
+                chapters, "image", img_zoom=1.0, zip_path=str(tmp_path / "out.zip"), page_filter=PAGE_FILTER_DEDUPE
+            )
+            with zipfile.ZipFile(out) as zf:
+                images = [zf.read(f"book/One/{n:03d}.jpg") for n in range(1, 5)]
+        expected = [render_page_jpeg(processor.doc[pi], 1.0) for pi in range(4)]
+        assert images == [expected[0], expected[0], expected[2], expected[0]]
+        assert expected[2] != expected[0]
+        assert processor.last_page_filter_report.duplicate_pages == 2
+    finally:
+        processor.close()
@@ -0,0 +1,331 @@
+"""
+PDF ツール共通 - 重い処理の受付制御（同じマシンで動く全アプリ・全セッションで共有）
+- 同時に実行する重いジョブ（OCR・書き出し・画像変換）の数と、見積もりメモリの合計に上限を設ける
+- 実行中のジョブは台帳ファイル（HostLedger）に記録し、pdf-chapter-splitter と pdf-to-image が同じ上限を分け合う
+- 上限を超えた分は待ち行列に入り、実行中のジョブが少ないセッションから順に実行する
+  1つのセッションがジョブを大量に投入しても、他のセッションのジョブが後回しにならない
+  （待ち行列と順番はアプリのプロセスごと。アプリ間では、枠が空いたときに先に確認したほうが実行する）
+Streamlit に依存しないため、UI 以外からも使える。
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List
+
+try:
+    import fcntl
+
+    _HAS_FCNTL = True
+except ImportError:  # Windows
+    import msvcrt
+
+    _HAS_FCNTL = False
+
+
+def _env_int(names: tuple, default: int) -> int:
+    """names の環境変数のうち最初に設定されているものの値（どれもなければ default）。"""
+    for name in names:
+        value = os.environ.get(name)
+        if value:
+            return int(value)
+    return default
+
+
+# 同時に実行する重いジョブの数（環境変数 PDF_TOOLS_MAX_JOBS で変更可能。旧名 PDF_MASTER_MAX_JOBS・PDF_TO_IMAGE_MAX_JOBS も読む）
+MAX_HEAVY_JOBS = max(1, _env_int(("PDF_TOOLS_MAX_JOBS", "PDF_MASTER_MAX_JOBS", "PDF_TO_IMAGE_MAX_JOBS"), 2))
+# 実行中のジョブの見積もりメモリの合計上限（環境変数 PDF_TOOLS_MEMORY_BUDGET_MB で変更可能。旧名も読む）
+MEMORY_BUDGET_BYTES = (
+    _env_int(("PDF_TOOLS_MEMORY_BUDGET_MB", "PDF_MASTER_MEMORY_BUDGET_MB", "PDF_TO_IMAGE_MEMORY_BUDGET_MB"), 4096)
+    * 1024
+    * 1024
+)
+# 実行中のジョブの台帳を置くフォルダ（環境変数 PDF_TOOLS_ADMISSION_DIR で変更可能。同じフォルダを使うアプリどうしで上限を分け合う）
+ADMISSION_DIR = Path(os.environ.get("PDF_TOOLS_ADMISSION_DIR") or Path(tempfile.gettempdir()) / "pdf-tools-admission")
+# 順番待ちの間に、他のアプリのジョブが終わって枠が空いたかを台帳で確認する間隔（秒）
+LEDGER_POLL_SECONDS = 0.5
+# 見積もりの基準: A4 1ページを倍率1（72 DPI）で RGB レンダリングしたときのバイト数
+PAGE_BYTES_AT_ZOOM_1 = 595 * 842 * 3
+
+
+def _pid_alive(pid: int) -> bool:
+    """pid のプロセスが動いているか（異常終了したアプリの記録を台帳から除くため）。"""
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        import ctypes
+
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            # 権限がなくて開けないプロセスは動いている
+            return ctypes.get_last_error() == 5  # ERROR_ACCESS_DENIED
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class HostLedger:
+    """
+    同じマシンの全プロセスで共有する、実行中のジョブの台帳（directory/running.json）。
+    読み書きは directory/running.lock のファイルロックの中で行い、終了したプロセスの記録は読むときに除く。
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._path = self.directory / "running.json"
+        self._lock_path = self.directory / "running.lock"
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a+b") as f:
+            if _HAS_FCNTL:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.01)
+            try:
+                yield
+            finally:
+                if _HAS_FCNTL:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _read(self) -> dict:
+        """ロックを持った状態で、動いているプロセスの記録（受付票ID → {pid, cost}）を読む。"""
+        try:
+            entries = json.loads(self._path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return {tid: e for tid, e in entries.items() if _pid_alive(e["pid"])}
+
+    def _write(self, entries: dict) -> None:
+        # 書きかけの台帳を他のプロセスが読まないように、一時ファイルに書いてから置き換える
+        tmp_path = self._path.with_name(f"{self._path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(entries), encoding="utf-8")
+        os.replace(tmp_path, self._path)
+
+    def try_acquire(self, ticket_id: str, cost_bytes: int, max_jobs: int, memory_budget: int) -> bool:
+        """
+        マシン全体で実行中のジョブが max_jobs 未満で、見積もりメモリの合計が memory_budget に収まるなら
+        ticket_id を記録して True を返す。単独で memory_budget を超えるジョブは、他に何も実行していないときだけ記録する。
+        """
+        with self._locked():
+            entries = self._read()
+            used = sum(e["cost"] for e in entries.values())
+            if len(entries) >= max_jobs or (entries and used + cost_bytes > memory_budget):
+                return False
+            entries[ticket_id] = {"pid": os.getpid(), "cost": cost_bytes}
+            self._write(entries)
+            return True
+
+    def release(self, ticket_id: str) -> None:
+        with self._locked():
+            entries = self._read()
+            entries.pop(ticket_id, None)
+            self._write(entries)
+
+    def usage(self) -> tuple:
+        """(マシン全体で実行中のジョブ数, その見積もりメモリの合計)。"""
+        with self._locked():
+            entries = self._read()
+        return len(entries), sum(e["cost"] for e in entries.values())
+
+
+def estimate_render_bytes(pages: int, zoom: float, resident_pages: int | None = None) -> int:
+    """
+    pages ページを倍率 zoom でレンダリングするジョブの見積もりメモリ。
+    resident_pages: 同時にメモリ上に置くページ数の上限（逐次・並列で流す処理はワーカー数程度。None なら全ページ）
+    """
+    held = pages if resident_pages is None else min(pages, resident_pages)
+    return int(PAGE_BYTES_AT_ZOOM_1 * zoom * zoom * max(1, held))
+
+
+class AdmissionTicket:
+    """1つのジョブの受付票。admitted になったら実行してよく、終わったら release() する。"""
+
+    def __init__(self, controller: "AdmissionController", session_id: str, label: str, cost_bytes: int):
+        self.controller = controller
+        self.session_id = session_id
+        self.label = label
+        self.cost_bytes = cost_bytes
+        # 台帳に記録するID（アプリ・プロセスをまたいで一意）
+        self.ticket_id = uuid.uuid4().hex
+        self.admitted = False
+        self.released = False
+
+    @property
+    def position(self) -> int:
+        """待ち行列での順番（1 = 次に実行。実行中・終了済みなら 0）。"""
+        return self.controller.position(self)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """実行を許可されるまで最大 timeout 秒待ち、許可されたかを返す。"""
+        return self.controller.wait(self, timeout)
+
+    def release(self) -> None:
+        """実行枠を返す（待ち行列にいれば取り下げる）。何度呼んでもよい。"""
+        self.controller.release(self)
+
+
+class AdmissionController:
+    """
+    マシン全体の重いジョブの受付。
+    - 実行中のジョブ数が max_jobs 未満で、見積もりメモリの合計が memory_budget に収まるときだけ次を実行する
+      （ledger_dir の台帳を共有する他のプロセスのジョブも数える。None ならこのプロセスの中だけで数える）
+    - 待ちのジョブはセッションごとの列に並び、実行中のジョブが最も少ないセッションから順に実行する
+      （同数なら、直前に実行を許可したセッションを最後に回す）
+    - 先頭のジョブが収まらないときは後ろのジョブも追い越さない（大きなジョブがいつまでも待たされないように）。
+      単独でも memory_budget を超えるジョブは、他に何も実行していないときに1つだけ実行する
+    """
+
+    def __init__(
+        self,
+        max_jobs: int = MAX_HEAVY_JOBS,
+        memory_budget: int = MEMORY_BUDGET_BYTES,
+        ledger_dir=ADMISSION_DIR,
+    ):
+        self.max_jobs = max_jobs
+        self.memory_budget = memory_budget
+        self._ledger = HostLedger(ledger_dir) if ledger_dir is not None else None
+        self._cond = threading.Condition()
+        # セッションID → 待ちの受付票（並び順がセッション間の順番）
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._running: List[AdmissionTicket] = []
+        self._used_bytes = 0
+
+    def request(self, session_id: str, label: str, cost_bytes: int) -> AdmissionTicket:
+        """受付票を発行して待ち行列に並べる（空きがあればすぐに admitted になる）。"""
+        ticket = AdmissionTicket(self, session_id, label, cost_bytes)
+        with self._cond:
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._admit()
+        return ticket
+
+    @staticmethod
+    def _pop_next(queues: "OrderedDict[str, deque]", running_counts: Counter) -> AdmissionTicket:
+        """
+        次に実行するジョブを queues から取り出す。実行中のジョブが最も少ないセッションを選び、
+        同数なら並び順（直前に取り出したセッションは最後に回す）で決める。
+        """
+        session_id = min(queues, key=lambda sid: running_counts[sid])
+        queue = queues[session_id]
+        ticket = queue.popleft()
+        if queue:
+            queues.move_to_end(session_id)
+        else:
+            del queues[session_id]
+        running_counts[session_id] += 1
+        return ticket
+
+    def _running_counts(self) -> Counter:
+        return Counter(t.session_id for t in self._running)
+
+    def _waiting_order(self) -> List[AdmissionTicket]:
+        """待ちの受付票を、実行を許可する順に並べる（実行中のジョブが終わる順は考えない）。"""
+        queues = OrderedDict((sid, deque(q)) for sid, q in self._queues.items())
+        running_counts = self._running_counts()
+        return [self._pop_next(queues, running_counts) for _ in range(sum(len(q) for q in queues.values()))]
+
+    def _fits(self, ticket: AdmissionTicket) -> bool:
+        """ticket を今すぐ実行できるか（台帳があれば、実行できるときはそのまま台帳に記録する）。"""
+        if self._ledger is not None:
+            return self._ledger.try_acquire(ticket.ticket_id, ticket.cost_bytes, self.max_jobs, self.memory_budget)
+        return not self._running or self._used_bytes + ticket.cost_bytes <= self.memory_budget
+
+    def _admit(self) -> None:
+        """ロックを持った状態で、上限の範囲で待ちのジョブに実行を許可する。"""
+        admitted = False
+        running_counts = self._running_counts()
+        while self._queues and len(self._running) < self.max_jobs:
+            session_id = min(self._queues, key=lambda sid: running_counts[sid])
+            ticket = self._queues[session_id][0]
+            if not self._fits(ticket):
+                break
+            self._pop_next(self._queues, running_counts)
+            ticket.admitted = True
+            self._running.append(ticket)
+            self._used_bytes += ticket.cost_bytes
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+
+    def release(self, ticket: AdmissionTicket) -> None:
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket in self._running:
+                self._running.remove(ticket)
+                self._used_bytes -= ticket.cost_bytes
+                if self._ledger is not None:
+                    self._ledger.release(ticket.ticket_id)
+            else:
+                queue = self._queues.get(ticket.session_id)
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+                    if not queue:
+                        del self._queues[ticket.session_id]
+            self._admit()
+
+    def wait(self, ticket: AdmissionTicket, timeout: float | None = None) -> bool:
+        """
+        ticket が実行を許可されるまで最大 timeout 秒待つ。他のプロセスのジョブの終了は通知されないので、
+        台帳があれば LEDGER_POLL_SECONDS ごとに空きを確かめる。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not ticket.admitted:
+                if ticket.released:
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                if self._ledger is not None:
+                    remaining = LEDGER_POLL_SECONDS if remaining is None else min(remaining, LEDGER_POLL_SECONDS)
+                self._cond.wait(remaining)
+                if self._ledger is not None:
+                    self._admit()
+            return True
+
+    def position(self, ticket: AdmissionTicket) -> int:
+        with self._cond:
+            if ticket.admitted or ticket.released:
+                return 0
+            return self._waiting_order().index(ticket) + 1
+
+    def snapshot(self) -> dict:
+        """
+        表示用の現在の状況（実行中の数・待ちの数・使用中の見積もりメモリ）。
+        台帳があれば、実行中の数と見積もりメモリは他のプロセスの分も含めたマシン全体の値。
+        """
+        with self._cond:
+            waiting = sum(len(q) for q in self._queues.values())
+            if self._ledger is None:
+                return {"running": len(self._running), "waiting": waiting, "used_bytes": self._used_bytes}
+        running, used_bytes = self._ledger.usage()
+        return {"running": running, "waiting": waiting, "used_bytes": used_bytes}
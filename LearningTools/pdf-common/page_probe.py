@@ -0,0 +1,116 @@
+"""
+PDF ツール共通 - ページの下見（白黒ページの判定・2値化・空白/重複ページの判定）
+- 低解像度でレンダリングして、有彩色の画素がほとんどないページを白黒ページと判定する
+- グレースケールの画素をしきい値で白黒の2値にする
+- 低解像度のグレースケールで、白紙のページと画素が完全に一致するページを見つける
+  （画素が一致したページは、ページの内容のダイジェストも一致するときだけ重複とする）
+Streamlit に依存しないため、UI 以外からも使える。
+"""
+import hashlib
+
+import fitz  # PyMuPDF
+import numpy as np
+
+# 白黒判定用の低解像度レンダリングの倍率
+MONO_PROBE_ZOOM = 0.2
+# RGB の最大値と最小値の差がこれ以下の画素は無彩色とみなす（スキャンの色ノイズを許容）
+MONO_CHROMA_TOLERANCE = 24
+# 有彩色の画素がこの割合以下なら白黒ページとみなす
+MONO_COLOR_PIXEL_RATIO = 0.002
+# 2値化のしきい値（これ未満を黒にする）
+BILEVEL_THRESHOLD = 160
+_BILEVEL_TABLE = bytes(0 if v < BILEVEL_THRESHOLD else 255 for v in range(256))
+
+# 空白・重複判定用のグレースケールレンダリングの倍率（36 DPI）
+PROBE_ZOOM = 0.5
+# この値より暗い画素を「インク」とみなす
+BLANK_INK_LEVEL = 200
+# インクの画素がこの割合以下なら空白ページとみなす（ノンブルだけのページも含む）
+BLANK_INK_RATIO = 0.0005
+_INK_TABLE = bytes(1 if v < BLANK_INK_LEVEL else 0 for v in range(256))
+
+
+def is_monochrome_page(page) -> bool:
+    """低解像度でレンダリングし、有彩色の画素がほとんどなければ白黒ページと判定する。"""
+    pix = page.get_pixmap(matrix=fitz.Matrix(MONO_PROBE_ZOOM, MONO_PROBE_ZOOM), colorspace=fitz.csRGB, alpha=False)
+    rows = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    rgb = rows[:, : pix.width * 3].reshape(-1, 3)
+    spread = rgb.max(axis=1) - rgb.min(axis=1)
+    return np.count_nonzero(spread > MONO_CHROMA_TOLERANCE) <= len(rgb) * MONO_COLOR_PIXEL_RATIO
+
+
+def to_bilevel(pix):
+    """グレースケールの Pixmap をしきい値で白(255)と黒(0)の2値にする（位置はそのまま）。"""
+    bilevel = fitz.Pixmap(fitz.csGRAY, pix.width, pix.height, pix.samples.translate(_BILEVEL_TABLE), False)
+    bilevel.set_origin(pix.x, pix.y)
+    return bilevel
+
+
+def probe_page(page) -> tuple:
+    """
+    低解像度のグレースケールで1ページをレンダリングし、(空白ページか, 重複判定用のダイジェスト) を返す。
+    ダイジェストは画素の完全一致で比べる（スキャン同士の「ほぼ同じ」ページは重複とみなさない）。
+    """
+    pix = page.get_pixmap(matrix=fitz.Matrix(PROBE_ZOOM, PROBE_ZOOM), colorspace=fitz.csGRAY, alpha=False)
+    samples = pix.samples
+    blank = samples.translate(_INK_TABLE).count(1) <= len(samples) * BLANK_INK_RATIO
+    digest = hashlib.sha1(f"{pix.width}x{pix.height}:".encode("ascii") + samples).hexdigest()
+    return blank, digest
+
+
+def page_content_digest(page) -> str:
+    """
+    ページの内容のダイジェスト（大きさ・回転、コンテンツストリーム、参照する画像・フォーム・フォント、注釈）。
+    低解像度の画素が一致したページが、本来の解像度でも同じページかを確かめるのに使う。
+    """
+    doc = page.parent
+    h = hashlib.sha1(f"{tuple(page.rect)}:{page.rotation}:".encode("ascii"))
+    h.update(page.read_contents())
+    for xref, smask, *_, name, _, _ in page.get_images(full=True):
+        h.update(f"image {name}:".encode("utf-8"))
+        h.update(doc.xref_stream_raw(xref) or b"")
+        if smask:
+            h.update(doc.xref_stream_raw(smask) or b"")
+    for xref, name, _, _ in page.get_xobjects():
+        h.update(f"form {name}:".encode("utf-8"))
+        h.update(doc.xref_stream_raw(xref) or b"")
+    for _, _, _, basefont, name, encoding, *_ in page.get_fonts(full=True):
+        h.update(f"font {name}:{basefont}:{encoding}".encode("utf-8"))
+    for annot in page.annots():
+        h.update(doc.xref_object(annot.xref, compressed=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def classify_redundant_pages(page_indices, probes, content_digest, keep_first_blank: bool = False) -> dict:
+    """
+    page_indices の各ページの probe_page の結果 probes から、空白ページと、それより前のページと同じ重複ページを探す。
+    低解像度の画素が一致しても、本来の解像度では小さな文字・ノンブルだけが違うことがあるので、
+    content_digest(ページ番号)（page_content_digest）も一致するときだけ重複とする（画素が一致したページだけ求める）。
+    返り値は {ページ番号: (種類, 代表ページ)}。種類は "blank" か "duplicate"、
+    代表ページは重複元（空白ページは keep_first_blank のとき最初の空白ページ、それ以外は None）。
+    """
+    roles = {}
+    # 低解像度のダイジェスト → 内容の違う代表ページ（画素が一致するページのうち、内容ごとに最初のページ）
+    firsts_by_digest = {}
+    content_digests = {}
+
+    def cached_content_digest(pi: int) -> str:
+        if pi not in content_digests:
+            content_digests[pi] = content_digest(pi)
+        return content_digests[pi]
+
+    first_blank = None
+    for pi, (blank, digest) in zip(page_indices, probes):
+        if blank:
+            if keep_first_blank and first_blank is None:
+                first_blank = pi
+            else:
+                roles[pi] = ("blank", first_blank)
+            continue
+        firsts = firsts_by_digest.setdefault(digest, [])
+        rep = next((first for first in firsts if cached_content_digest(first) == cached_content_digest(pi)), None)
+        if rep is not None:
+            roles[pi] = ("duplicate", rep)
+        else:
+            firsts.append(pi)
+    return roles
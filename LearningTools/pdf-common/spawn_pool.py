@@ -0,0 +1,49 @@
+"""
+PDF ツール共通 - spawn で起動するプロセスプール
+- Streamlit のサーバーはスレッドを使っているため、fork ではなく spawn でワーカーを起動する
+  （fork はスレッドの状態を引き継がず、MuPDF や Streamlit のスレッドが持つロックのまま子プロセスが始まる）
+- spawn の子プロセスは __main__ を読み込み直すが、Streamlit では __main__ がアプリのスクリプトなので、
+  ワーカーの起動中だけ __main__ をこのモジュールに差し替え、子プロセスでアプリ全体が再実行されないようにする
+Streamlit に依存しないため、UI 以外からも使える。
+"""
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# ワーカーの起動中に __main__ を差し替えるときの排他
+_spawn_lock = threading.Lock()
+
+
+def _start_workers(executor: ProcessPoolExecutor, workers: int) -> None:
+    """ワーカーをすべて起動しておく（起動後は __main__ を読み込み直さない）。"""
+    with _spawn_lock:
+        main_module = sys.modules["__main__"]
+        sys.modules["__main__"] = sys.modules[__name__]
+        try:
+            # 空きワーカーがない間は submit のたびに1つずつ起動される
+            for _ in range(workers):
+                executor.submit(os.getpid)
+        finally:
+            if sys.modules["__main__"] is sys.modules[__name__]:
+                sys.modules["__main__"] = main_module
+
+
+def spawn_process_pool(workers: int, initializer=None, initargs: tuple = ()) -> ProcessPoolExecutor:
+    """
+    workers 個のワーカーを spawn で起動したプロセスプール。with で使い、抜けるとワーカーを終了する。
+    ワーカーの関数・引数は pickle できること（ワーカーは sys.path を引き継ぎ、モジュールを import し直す）。
+    """
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+        initargs=initargs,
+    )
+    try:
+        _start_workers(executor, workers)
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    return executor
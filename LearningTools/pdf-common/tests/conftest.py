@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+_COMMON_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(_COMMON_DIR))
@@ -0,0 +1,88 @@
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from admission import AdmissionController, HostLedger
+
+_COMMON_DIR = str(Path(__file__).resolve().parents[1])
+
+
+def test_sessions_with_fewer_running_jobs_go_first():
+    admission = AdmissionController(max_jobs=2, memory_budget=100, ledger_dir=None)
+    a1, a2, a3 = (admission.request("a", f"a{n}", 10) for n in range(3))
+    b1, b2 = (admission.request("b", f"b{n}", 10) for n in range(2))
+    assert a1.admitted and a2.admitted
+    # a は2件実行中なので、後から並んだ b が先に始まる
+    assert [t.position for t in (a3, b1, b2)] == [3, 1, 2]
+    a1.release()
+    assert b1.admitted and not a3.admitted
+    # a と b は1件ずつ実行中。同数なら直前に許可した b を後に回す
+    a2.release()
+    assert a3.admitted and not b2.admitted
+    assert admission.snapshot() == {"running": 2, "waiting": 1, "used_bytes": 20}
+
+
+def test_head_of_queue_is_not_overtaken_when_it_does_not_fit():
+    admission = AdmissionController(max_jobs=3, memory_budget=100, ledger_dir=None)
+    running = admission.request("a", "a", 60)
+    big = admission.request("b", "b", 50)
+    small = admission.request("c", "c", 10)
+    assert running.admitted
+    # small なら収まるが、先に並んだ big を追い越さない
+    assert not big.admitted and not small.admitted
+    running.release()
+    assert big.admitted and small.admitted
+
+
+def test_job_over_budget_runs_alone():
+    admission = AdmissionController(max_jobs=2, memory_budget=100, ledger_dir=None)
+    huge = admission.request("a", "huge", 500)
+    other = admission.request("b", "other", 10)
+    assert huge.admitted and not other.admitted
+    huge.release()
+    assert other.admitted
+
+
+def test_releasing_a_waiting_ticket_withdraws_it():
+    admission = AdmissionController(max_jobs=1, memory_budget=100, ledger_dir=None)
+    first = admission.request("a", "first", 10)
+    withdrawn = admission.request("b", "withdrawn", 10)
+    last = admission.request("c", "last", 10)
+    withdrawn.release()
+    assert last.position == 1
+    first.release()
+    assert last.admitted and not withdrawn.admitted
+    assert not withdrawn.wait(0)
+
+
+def test_controllers_sharing_a_ledger_share_the_limits(tmp_path):
+    # 2つのアプリ（プロセス）の受付が、同じ台帳で1つの上限を分け合う
+    splitter = AdmissionController(max_jobs=2, memory_budget=100, ledger_dir=tmp_path)
+    converter = AdmissionController(max_jobs=2, memory_budget=100, ledger_dir=tmp_path)
+    ocr = splitter.request("a", "OCR", 60)
+    conversion = converter.request("b", "画像変換", 30)
+    export = splitter.request("a", "書き出し", 30)
+    assert ocr.admitted and conversion.admitted
+    assert not export.admitted
+    assert splitter.snapshot() == {"running": 2, "waiting": 1, "used_bytes": 90}
+    # 他の受付で枠が空いたことは、待っている側が台帳を見て気づく
+    waiter = threading.Thread(target=export.wait, args=(10,))
+    waiter.start()
+    conversion.release()
+    waiter.join()
+    assert export.admitted
+    assert converter.snapshot()["used_bytes"] == 90
+
+
+def test_jobs_of_exited_processes_are_dropped_from_the_ledger(tmp_path):
+    # 枠を返さずに終了したプロセスの記録は、上限に数えない
+    script = (
+        f"import sys; sys.path.insert(0, {_COMMON_DIR!r})\n"
+        "from admission import HostLedger\n"
+        f"assert HostLedger({str(tmp_path)!r}).try_acquire('crashed', 100, 1, 100)\n"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True)
+    assert HostLedger(tmp_path).usage() == (0, 0)
+    admission = AdmissionController(max_jobs=1, memory_budget=100, ledger_dir=tmp_path)
+    assert admission.request("a", "a", 100).admitted
@@ -0,0 +1,39 @@
+import fitz  # PyMuPDF
+
+from page_probe import is_monochrome_page, probe_page, to_bilevel
+
+
+def _page(doc, color=(0, 0, 0), text="Body text"):
+    page = doc.new_page(width=300, height=400)
+    if text:
+        page.insert_text((30, 60), text, fontsize=14, color=color)
+        page.draw_rect(fitz.Rect(30, 100, 270, 300), color=None, fill=color)
+    return page
+
+
+def test_monochrome_detection():
+    doc = fitz.open()
+    _page(doc, color=(0.3, 0.3, 0.3))
+    _page(doc, color=(0.9, 0.2, 0.1))
+    assert is_monochrome_page(doc[0])
+    assert not is_monochrome_page(doc[1])
+
+
+def test_bilevel_keeps_size_and_origin():
+    doc = fitz.open()
+    page = _page(doc, color=(0.5, 0.5, 0.5))
+    clip = fitz.Rect(0, 50, 300, 150)
+    pix = page.get_pixmap(colorspace=fitz.csGRAY, clip=clip)
+    bilevel = to_bilevel(pix)
+    assert (bilevel.width, bilevel.height, bilevel.x, bilevel.y) == (pix.width, pix.height, pix.x, pix.y)
+    assert set(bilevel.samples) == {0, 255}
+
+
+def test_probe_finds_blank_and_identical_pages():
+    doc = fitz.open()
+    for text in ["Body text", "Body text", "Other text", None]:
+        _page(doc, text=text)
+    first, same, other, blank = doc
+    assert probe_page(blank)[0]
+    assert not probe_page(first)[0]
+    assert probe_page(first)[1] == probe_page(same)[1] != probe_page(other)[1]
@@ -0,0 +1,211 @@
+"""
+PDF→画像 - ページ画像のエンコーダー
+- PyMuPDF の Pixmap を一時ファイルを使わずにメモリ上でエンコードする（PNG・JPEG・WebP・可逆 WebP）
+- PNG の圧縮レベル指定と WebP は Pillow（pip install pillow）があるときだけ使える
+- エンコードにかかった時間と出力サイズを集計し、形式ごとのサイズと速度を比べられる
+- PNG は帯ごとにレンダリングしたページ（page_renderer.PageBands）を1ページ分の画素を持たずにエンコードできる
+Streamlit に依存しないため、UI 以外からも使える。
+"""
+import io
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from typing import List
+
+# オプション: Pillow があれば PNG の圧縮レベル指定と WebP 出力に利用
+try:
+    from PIL import Image
+    _HAS_PIL = True
+except ImportError:
+    _HAS_PIL = False
+
+# (チャンネル数, アルファの有無) → (Pillow の画像モード, 画素の並び)。
+# MuPDF のアルファありの画素は色にアルファを掛けた値なので、読み込むときに戻す
+_PIL_MODES = {
+    (1, 0): ("L", "L"),
+    (2, 1): ("LA", "La"),
+    (3, 0): ("RGB", "RGB"),
+    (4, 1): ("RGBA", "RGBa"),
+    (4, 0): ("CMYK", "CMYK"),
+}
+# encode_bands で一度に圧縮する画素のバイト数の目安
+_PNG_CHUNK_BYTES = 1024 * 1024
+# PyMuPDF の Pixmap の解像度の既定
+_DEFAULT_DPI = 96
+# (チャンネル数, アルファの有無) → PNG のカラータイプ
+_PNG_COLOR_TYPES = {(1, 0): 0, (2, 1): 4, (3, 0): 2, (4, 1): 6}
+
+
+def pixmap_to_pil(pix):
+    """
+    Pixmap の画素を参照する Pillow 画像を作る（pix より長く使わないこと）。
+    アルファなしならコピーしない。アルファありは色の値を戻すためにコピーする。
+    """
+    mode, raw_mode = _PIL_MODES[(pix.n, int(pix.alpha))]
+    return Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", raw_mode, pix.stride, 1)
+
+
+def _save_with_pil(pix, fmt: str, **params) -> bytes:
+    buf = io.BytesIO()
+    pixmap_to_pil(pix).save(buf, fmt, **params)
+    return buf.getvalue()
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+
+@dataclass(frozen=True)
+class PngEncoder:
+    """
+    PNG（可逆）。compress_level（0〜9）か optimize を指定すると Pillow で圧縮する。
+    どちらも指定しなければ PyMuPDF の既定の圧縮（速い）。
+    encode_bands は帯に分けたページを帯ごとに圧縮する（行のフィルタはなし。PyMuPDF の PNG と同じ）。
+    """
+    compress_level: int | None = None
+    optimize: bool = False
+
+    ext = "png"
+    # 透明部分を残す（従来どおり）
+    alpha = True
+
+    @property
+    def label(self) -> str:
+        if self.optimize:
+            return "PNG（最適化）"
+        if self.compress_level is not None:
+            return f"PNG（圧縮レベル {self.compress_level}）"
+        return "PNG"
+
+    def encode(self, pix) -> bytes:
+        if self.compress_level is None and not self.optimize:
+            return pix.tobytes("png")
+        return _save_with_pil(
+            pix, "PNG", compress_level=self._zlib_level, optimize=self.optimize, dpi=(pix.xres, pix.yres)
+        )
+
+    @property
+    def _zlib_level(self) -> int:
+        if self.compress_level is not None:
+            return self.compress_level
+        return 9 if self.optimize else 6
+
+    def encode_bands(self, bands, dpi: int | None = None) -> bytes:
+        """
+        bands（page_renderer.PageBands）を上の帯から順に圧縮し、メモリには1つの帯の画素しか持たない。
+        アルファありの帯は色の値を戻す必要があるので、Pillow がなければ1ページ分に組み立ててエンコードする。
+        """
+        if bands.alpha and not _HAS_PIL:
+            pix = bands.assemble()
+            if dpi:
+                pix.set_dpi(dpi, dpi)
+            return self.encode(pix)
+        out = io.BytesIO()
+        out.write(b"\x89PNG\r\n\x1a\n")
+        color_type = _PNG_COLOR_TYPES[(bands.n, int(bands.alpha))]
+        out.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", bands.width, bands.height, 8, color_type, 0, 0, 0)))
+        # 解像度（PyMuPDF と同じく、指定がなければ 96 DPI）
+        pixels_per_meter = round((dpi or _DEFAULT_DPI) / 0.0254)
+        out.write(_png_chunk(b"pHYs", struct.pack(">IIB", pixels_per_meter, pixels_per_meter, 1)))
+        compressor = zlib.compressobj(self._zlib_level)
+        row_bytes = bands.width * bands.n
+        # 帯をさらに数行ずつに分けて処理し、圧縮前の作業用のコピーも小さく保つ
+        step = max(1, _PNG_CHUNK_BYTES // row_bytes) * row_bytes
+        for band in bands.iter_rows():
+            for start in range(0, len(band), step):
+                data = band[start:start + step]
+                if bands.alpha:
+                    mode, raw_mode = _PIL_MODES[(bands.n, 1)]
+                    size = (bands.width, len(data) // row_bytes)
+                    data = Image.frombuffer(mode, size, data, "raw", raw_mode, 0, 1).tobytes()
+                # 各行の先頭にフィルタの種類（0 = なし）を付ける
+                rows = b"".join(b"\x00" + data[i:i + row_bytes] for i in range(0, len(data), row_bytes))
+                compressed = compressor.compress(rows)
+                if compressed:
+                    out.write(_png_chunk(b"IDAT", compressed))
+        out.write(_png_chunk(b"IDAT", compressor.flush()))
+        out.write(_png_chunk(b"IEND", b""))
+        return out.getvalue()
+
+
+@dataclass(frozen=True)
+class JpegEncoder:
+    """JPEG（非可逆）。PyMuPDF がメモリ上で直接エンコードする。"""
+    quality: int = 95
+
+    ext = "jpg"
+    alpha = False
+
+    @property
+    def label(self) -> str:
+        return f"JPEG（品質 {self.quality}）"
+
+    def encode(self, pix) -> bytes:
+        return pix.tobytes("jpg", jpg_quality=self.quality)
+
+
+@dataclass(frozen=True)
+class WebpEncoder:
+    """
+    WebP（Pillow が必要）。lossless なら可逆で、quality は圧縮の手間（大きいほど小さく・遅い）になる。
+    method は 0（速い）〜6（小さい）。
+    """
+    quality: int = 90
+    lossless: bool = False
+    method: int = 4
+
+    ext = "webp"
+    alpha = False
+
+    @property
+    def label(self) -> str:
+        if self.lossless:
+            return "WebP（可逆）"
+        return f"WebP（品質 {self.quality}）"
+
+    def encode(self, pix) -> bytes:
+        return _save_with_pil(pix, "WEBP", quality=self.quality, lossless=self.lossless, method=self.method)
+
+
+@dataclass
+class EncodeStats:
+    """エンコードしたページ数・合計時間・合計バイト数。"""
+    pages: int = 0
+    seconds: float = 0.0
+    total_bytes: int = 0
+
+    def add(self, seconds: float, size: int) -> None:
+        """1ページ分（別のプロセスでエンコードしたものを含む）を集計に加える。"""
+        self.pages += 1
+        self.seconds += seconds
+        self.total_bytes += size
+
+    def measure(self, encoder, pix) -> bytes:
+        """pix を encoder でエンコードし、時間とサイズを集計してから結果を返す。"""
+        started = time.perf_counter()
+        data = encoder.encode(pix)
+        self.add(time.perf_counter() - started, len(data))
+        return data
+
+    @property
+    def ms_per_page(self) -> float:
+        return self.seconds * 1000 / self.pages if self.pages else 0.0
+
+    @property
+    def bytes_per_page(self) -> float:
+        return self.total_bytes / self.pages if self.pages else 0.0
+
+
+def compare_encoders(pix, encoders) -> List[dict]:
+    """同じ Pixmap を各エンコーダーでエンコードし、形式ごとの時間とサイズを返す（表示用）。"""
+    rows = []
+    for encoder in encoders:
+        stats = EncodeStats()
+        stats.measure(encoder, pix)
+        rows.append({
+            "形式": encoder.label,
+            "時間 (ms)": round(stats.ms_per_page, 1),
+            "サイズ (KB)": round(stats.bytes_per_page / 1024, 1),
+        })
+    return rows
@@ -0,0 +1,114 @@
+"""
+PDF→画像 - 出力フォルダのマニフェスト（途中から再開できる変換）
+- 出力フォルダの manifest.jsonl に、元PDFのハッシュと変換設定（解像度・形式・品質・色）、
+  書き出したページごとのファイル名・チェックサムを記録する
+- 同じPDF・同じ設定で変換し直すときは、ファイルが残っていてチェックサムが一致するページを再レンダリングしない
+  （中断した変換の続き、ページ範囲を広げたときの追加分だけを変換する）
+- ページは1行ずつ追記するので、変換が途中で止まっても書き出し済みのページは記録に残る
+Streamlit に依存しないため、UI 以外からも使える。
+"""
+import dataclasses
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+
+MANIFEST_NAME = "manifest.jsonl"
+# 記録の形式を変えたら上げる（古いマニフェストは使わずに作り直す）
+MANIFEST_VERSION = 1
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+# ページの書き出し方（同じページでも書き出し方が違えば再利用しない）
+PAGE_FULL = "full"
+PAGE_PLACEHOLDER = "placeholder"
+PAGE_COPY = "copy"
+
+
+def file_sha256(path) -> str:
+    """ファイル全体を少しずつ読んで SHA-256 を求める。"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encoder_settings(encoder) -> dict:
+    """エンコーダー（image_encoders のデータクラス）の種類と設定。"""
+    return {"type": type(encoder).__name__, **dataclasses.asdict(encoder)}
+
+
+@dataclass
+class ManifestEntry:
+    """書き出した1ページ分の記録。file は出力フォルダからの相対名。"""
+    page_index: int
+    file: str
+    kind: str
+    sha256: str
+    size: int
+
+
+class OutputManifest:
+    """
+    出力フォルダの manifest.jsonl。1行目に元PDFのハッシュと変換設定、2行目以降に書き出したページを追記する。
+    既存のマニフェストの元PDF・設定が違えば、記録を捨てて作り直す。
+    """
+
+    def __init__(self, folder, source_sha256: str, settings: dict):
+        self.folder = Path(folder)
+        self.path = self.folder / MANIFEST_NAME
+        self.header = {"version": MANIFEST_VERSION, "source_sha256": source_sha256, "settings": settings}
+        self.entries: Dict[int, ManifestEntry] = {}
+        if not self._load():
+            self.entries = {}
+            self.path.write_text(json.dumps(self.header, ensure_ascii=False) + "\n", encoding="utf-8")
+
+    def _load(self) -> bool:
+        """同じ元PDF・設定のマニフェストがあれば、その記録を読み込んで True を返す。"""
+        try:
+            text = self.path.read_text(encoding="utf-8")
+            lines = text.splitlines()
+            if not lines or json.loads(lines[0]) != self.header:
+                return False
+        except (OSError, ValueError):
+            return False
+        valid = 1
+        for line in lines[1:]:
+            try:
+                entry = ManifestEntry(**json.loads(line))
+            except (TypeError, ValueError):
+                break  # 追記の途中で止まった最後の行
+            self.entries[entry.page_index] = entry
+            valid += 1
+        if valid < len(lines) or not text.endswith("\n"):
+            # 途中で止まった行の後ろに追記すると、次に読むときにその記録も失われるので、先に切り詰める
+            self.path.write_text("".join(line + "\n" for line in lines[:valid]), encoding="utf-8")
+        return True
+
+    def reusable(self, page_index: int, file_name: str, kind: str) -> Path | None:
+        """前回同じ書き出し方で書き出したファイルが残っていて、中身も記録と一致すればそのパス。"""
+        entry = self.entries.get(page_index)
+        if entry is None or entry.file != file_name or entry.kind != kind:
+            return None
+        path = self.folder / file_name
+        try:
+            if path.stat().st_size != entry.size:
+                return None
+            if file_sha256(path) != entry.sha256:
+                return None
+        except OSError:
+            return None
+        return path
+
+    def record(self, page_index: int, path, kind: str, data: bytes | None = None) -> None:
+        """ページを書き出したことを追記する（data を渡さなければファイルを読んでチェックサムを求める）。"""
+        path = Path(path)
+        if data is not None:
+            sha256, size = hashlib.sha256(data).hexdigest(), len(data)
+        else:
+            sha256, size = file_sha256(path), path.stat().st_size
+        entry = ManifestEntry(page_index=page_index, file=path.name, kind=kind, sha256=sha256, size=size)
+        self.entries[page_index] = entry
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(dataclasses.asdict(entry), ensure_ascii=False) + "\n")
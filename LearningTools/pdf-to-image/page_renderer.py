@@ -0,0 +1,243 @@
+"""
+PDF→画像 - ページのレンダリング（複数プロセスでの並列処理）
+- 白黒ページのグレースケール/2値化レンダリング、空白・重複ページの判定（判定自体は pdf-common/page_probe.py）
+- 変換するページをワーカープロセスに分け、各プロセスが自分で開いた fitz 文書でレンダリング・エンコードする
+  （PyMuPDF は1つの文書を複数スレッドから使えず、レンダリングは CPU 処理なので、スレッドではなくプロセスで並列化する）
+- 結果はタスクを渡した順（ページ順）に返すので、呼び出し側はそのまま順にファイルへ書き出せる
+- 大判のページや高い DPI では、ページを横長の帯に分けてレンダリングし、1ページの画素のメモリを上限内に収める
+Streamlit に依存しないため、UI 以外からも使える。
+"""
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+import fitz  # PyMuPDF
+
+from page_probe import is_monochrome_page, probe_page, to_bilevel
+from spawn_pool import spawn_process_pool
+
+
+def _default_workers() -> int:
+    configured = os.environ.get("PDF_TO_IMAGE_WORKERS")
+    if configured:
+        return max(1, int(configured))
+    # 画面（Streamlit）の処理用に1コア残す。8 を超えるとディスク書き込みが先に詰まる
+    return max(1, min(8, (os.cpu_count() or 1) - 1))
+
+
+# 並列ワーカー数の既定（環境変数 PDF_TO_IMAGE_WORKERS で変更可能）
+DEFAULT_RENDER_WORKERS = _default_workers()
+# 1ページのレンダリングに使う画素メモリの上限の既定（環境変数 PDF_TO_IMAGE_PAGE_BUDGET_MB で変更可能）。
+# これを超えるページは帯に分けてレンダリングする（A3 を 400 DPI・透明部分ありでレンダリングすると約 120MB）
+DEFAULT_PAGE_BUDGET_BYTES = int(os.environ.get("PDF_TO_IMAGE_PAGE_BUDGET_MB", "128")) * 1024 * 1024
+# 帯の上下に余分にレンダリングする行数（帯の境目の行のアンチエイリアスが途切れて、継ぎ目が見えないようにする）
+_BAND_OVERLAP_ROWS = 2
+# 結果を待たずに先に投入しておくタスク数（ワーカー数の倍数。エンコード済みの画像がメモリに溜まりすぎないように）
+_PREFETCH_PER_WORKER = 2
+
+
+def render_page_pixmap(page, mat, color_mode: str, alpha: bool):
+    """
+    color_mode が "color" 以外なら、白黒ページだけを csGRAY（画素あたり1バイト）でレンダリングし、
+    "bilevel" ではさらにしきい値で白黒の2値にする。カラーページは従来どおり RGB。
+    """
+    if color_mode == "color" or not is_monochrome_page(page):
+        return page.get_pixmap(matrix=mat, alpha=alpha)
+    pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False)
+    if color_mode == "bilevel":
+        pix = to_bilevel(pix)
+    return pix
+
+
+def page_pixel_bytes(page, mat, alpha: bool) -> int:
+    """ページを mat で RGB（alpha なら RGBA）レンダリングしたときの画素のバイト数。"""
+    irect = (page.rect * mat).irect
+    return irect.width * irect.height * (3 + int(alpha))
+
+
+class PageBands:
+    """
+    1ページを上から rows 行ずつの横長の帯に分けてレンダリングする。帯ごとに clip でレンダリングするので、
+    MuPDF の作業用のバッファも帯の大きさで済む。色の扱いは render_page_pixmap と同じ。
+    ページの内容は最初に DisplayList にしておき、帯ごとに PDF を解釈し直さない。
+    画素はページ全体でレンダリングしたときと一致しない。clip があると MuPDF のアンチエイリアスの計算が変わり、
+    斜めの線・細い線・文字の縁の画素がわずかに変わる（帯の継ぎ目は上下に _BAND_OVERLAP_ROWS 行ずつ
+    余分にレンダリングして目立たないようにする）。
+    """
+
+    def __init__(self, page, mat, color_mode: str, alpha: bool, budget_bytes: int):
+        gray = color_mode != "color" and is_monochrome_page(page)
+        self._bilevel = gray and color_mode == "bilevel"
+        self.colorspace = fitz.csGRAY if gray else fitz.csRGB
+        self.alpha = alpha and not gray
+        # 画素あたりのバイト数（アルファを含む）
+        self.n = self.colorspace.n + int(self.alpha)
+        self.irect = (page.rect * mat).irect
+        self.width, self.height = self.irect.width, self.irect.height
+        self.rows = max(1, budget_bytes // max(1, self.width * self.n) - 2 * _BAND_OVERLAP_ROWS)
+        self._mat = mat
+        self._display_list = page.get_displaylist()
+
+    def _bands(self) -> Iterator[tuple]:
+        """(帯の Pixmap, 帯の先頭の行, 帯の終わりの行) を上から順に返す。"""
+        inverse = ~self._mat
+        for y0 in range(self.irect.y0, self.irect.y1, self.rows):
+            y1 = min(y0 + self.rows, self.irect.y1)
+            top = max(self.irect.y0, y0 - _BAND_OVERLAP_ROWS)
+            bottom = min(self.irect.y1, y1 + _BAND_OVERLAP_ROWS)
+            clip = fitz.Rect(self.irect.x0, top, self.irect.x1, bottom) * inverse
+            pix = self._display_list.get_pixmap(
+                matrix=self._mat, colorspace=self.colorspace, alpha=self.alpha, clip=clip
+            )
+            if self._bilevel:
+                pix = to_bilevel(pix)
+            yield pix, y0, y1
+
+    def iter_rows(self) -> Iterator[memoryview]:
+        """
+        帯ごとに、その帯の行の画素を行の区切りなしでつなげて返す（アルファありは MuPDF と同じ乗算済み）。
+        帯の Pixmap の上下に余分にレンダリングした行は除く。返した画素は次の帯に進むまでしか使えない。
+        """
+        for pix, y0, y1 in self._bands():
+            yield pix.samples_mv[(y0 - pix.y) * pix.stride:(y1 - pix.y) * pix.stride]
+
+    def assemble(self):
+        """帯を1ページ分の Pixmap に組み立てる（帯のままではエンコードできないとき用。メモリは減らない）。"""
+        page_pix = fitz.Pixmap(self.colorspace, self.irect, self.alpha)
+        for pix, y0, y1 in self._bands():
+            page_pix.copy(pix, fitz.IRect(self.irect.x0, y0, self.irect.x1, y1))
+        return page_pix
+
+
+@dataclass(frozen=True)
+class ProbeTask:
+    """1ページの空白・重複判定（probe_page の結果を返す）。"""
+    pdf_path: str
+    page_index: int
+
+    def run(self, doc) -> tuple:
+        return probe_page(doc[self.page_index])
+
+
+@dataclass
+class RenderedPage:
+    """RenderTask の結果（エンコード済みの画像と、エンコードにかかった秒数）。"""
+    page_index: int
+    data: bytes
+    encode_seconds: float
+
+
+@dataclass(frozen=True)
+class RenderTask:
+    """
+    1ページを倍率 zoom でレンダリングし、encoder（image_encoders のエンコーダー）でエンコードする。
+    dpi を指定すると画像に解像度情報を書き込む。
+    page_budget を指定すると、画素がそれを超えるページは PageBands で帯に分けてレンダリングし、
+    帯のままエンコードする（encode_bands を持つエンコーダー＝PNG だけ。ほかの形式は1ページ分をまとめてエンコードする）。
+    """
+    pdf_path: str
+    page_index: int
+    zoom: float
+    encoder: object
+    color_mode: str = "color"
+    alpha: bool = False
+    dpi: int | None = None
+    page_budget: int | None = None
+
+    def run(self, doc) -> RenderedPage:
+        page = doc[self.page_index]
+        mat = fitz.Matrix(self.zoom, self.zoom)
+        if (
+            self.page_budget
+            and hasattr(self.encoder, "encode_bands")
+            and page_pixel_bytes(page, mat, self.alpha) > self.page_budget
+        ):
+            return self._run_banded(page, mat)
+        pix = render_page_pixmap(page, mat, self.color_mode, self.alpha)
+        if self.dpi:
+            try:
+                pix.set_dpi(self.dpi, self.dpi)
+            except AttributeError:
+                pass  # 一部バージョンでは未対応
+        started = time.perf_counter()
+        data = self.encoder.encode(pix)
+        return RenderedPage(self.page_index, data, time.perf_counter() - started)
+
+    def _run_banded(self, page, mat) -> RenderedPage:
+        bands = PageBands(page, mat, self.color_mode, self.alpha, self.page_budget)
+        # 帯のレンダリングとエンコードが交互に進むので、エンコード時間にはレンダリングも含まれる
+        started = time.perf_counter()
+        data = self.encoder.encode_bands(bands, self.dpi)
+        return RenderedPage(self.page_index, data, time.perf_counter() - started)
+
+
+# ワーカープロセスで開いている文書（同じ PDF のタスクが続く間は開いたままにする）
+_worker_doc = None
+_worker_doc_path = None
+
+
+def _run_in_worker(task):
+    global _worker_doc, _worker_doc_path
+    if _worker_doc_path != task.pdf_path:
+        if _worker_doc is not None:
+            _worker_doc.close()
+        _worker_doc = fitz.open(task.pdf_path)
+        _worker_doc_path = task.pdf_path
+    return task.run(_worker_doc)
+
+
+def _run_locally(tasks: Iterable) -> Iterator:
+    """ワーカーを使わずに、呼び出し元のスレッドで順に処理する（文書は処理の間だけ開く）。"""
+    doc = path = None
+    try:
+        for task in tasks:
+            if task.pdf_path != path:
+                if doc is not None:
+                    doc.close()
+                doc, path = fitz.open(task.pdf_path), task.pdf_path
+            yield task.run(doc)
+    finally:
+        if doc is not None:
+            doc.close()
+
+
+class RenderPool:
+    """
+    ProbeTask・RenderTask を workers 個のプロセスで処理する。with で使い、抜けるとプロセスを終了する。
+    workers が 1 以下なら、プロセスを起動せずに呼び出し元で順に処理する。
+    プロセスは spawn_pool.spawn_process_pool で spawn 起動する（Streamlit のスクリプトを子プロセスで再実行しない）。
+    """
+
+    def __init__(self, workers: int = DEFAULT_RENDER_WORKERS):
+        self.workers = max(1, workers)
+        self._executor = None
+
+    def __enter__(self) -> "RenderPool":
+        if self.workers > 1:
+            self._executor = spawn_process_pool(self.workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        return False
+
+    def map(self, tasks: Iterable) -> Iterator:
+        """tasks を処理し、結果を tasks の順に返す（先に終わったページも、前のページが終わるまで待たせる）。"""
+        if self._executor is None:
+            yield from _run_locally(tasks)
+            return
+        pending = deque()
+        try:
+            for task in tasks:
+                pending.append(self._executor.submit(_run_in_worker, task))
+                if len(pending) >= self.workers * _PREFETCH_PER_WORKER:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
@@ -4,23 +4,58 @@ PDFを画質を落とさずに画像化するアプリ
 調査結果（RESEARCH.md）に基づく実装:
 - PyMuPDF使用（追加のシステム依存なし）
 - デフォルト 300 DPI（印刷・OCR品質）
-- デフォルト PNG（可逆・劣化ゼロ）
+- 複数のCPUコアでページを並列にレンダリング（page_renderer.py）
+- 大判・高DPIのページは横長の帯に分けてレンダリングし、PNG を帯ごとに圧縮（1ページのメモリに上限）
+- 出力フォルダのマニフェストで、中断した変換や追加したページ範囲の分だけを変換（output_manifest.py）
+- フォルダ内のPDFの一括変換（変換済みのPDFはスキップ）
+- デフォルト PNG（可逆・劣化ゼロ）。Pillow があれば WebP・可逆 WebP・PNG の圧縮レベルも選べる（image_encoders.py）
 - DPI・形式・ページ範囲をGUIで選択可能
 - 日本語フォルダ名・ファイル名: NFKC正規化＋用語マップ＋オプションで python-slugify により安全な英数字名に変換（RESEARCH.md 7章）
 
 起動: streamlit run pdf_to_image.py
 """
-import io
+import functools
 import os
 import re
+import shutil
 import tempfile
+import time
 import unicodedata
+import sys
+import uuid
 import zipfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
 
 import fitz  # PyMuPDF
 import streamlit as st
 
+# pdf-chapter-splitter と pdf-to-image で共有するモジュール（LearningTools/pdf-common）
+_COMMON_DIR = str(Path(__file__).resolve().parent.parent / "pdf-common")
+if _COMMON_DIR not in sys.path:
+    sys.path.append(_COMMON_DIR)
+
+from admission import PAGE_BYTES_AT_ZOOM_1, AdmissionController
+from image_encoders import _HAS_PIL, EncodeStats, JpegEncoder, PngEncoder, WebpEncoder, compare_encoders
+from output_manifest import (
+    PAGE_COPY,
+    PAGE_FULL,
+    PAGE_PLACEHOLDER,
+    OutputManifest,
+    encoder_settings,
+    file_sha256,
+)
+from page_probe import classify_redundant_pages, page_content_digest
+from page_renderer import (
+    DEFAULT_PAGE_BUDGET_BYTES,
+    DEFAULT_RENDER_WORKERS,
+    ProbeTask,
+    RenderPool,
+    RenderTask,
+    render_page_pixmap,
+)
+
 # オプション: python-slugify があれば Unicode→読みやすいASCII（日本語はローマ字近似）に利用
 try:
     from slugify import slugify as _slugify
@@ -117,6 +152,288 @@ def to_book_folder_name(short_name: str) -> str:
     return s if s else "pdf"
 
 
+# 空白・重複ページの代替画像の解像度
+_PLACEHOLDER_DPI = 18
+
+
+@functools.lru_cache(maxsize=16)
+def blank_image_size(width: int, height: int, encoder) -> int:
+    """同じ大きさの白紙画像をエンコードしたときのバイト数（空白ページを省いた分の見積もり用）。"""
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), encoder.alpha)
+    pix.clear_with(255)
+    return len(encoder.encode(pix))
+
+
+def build_zip_from_files(paths, root) -> str:
+    """
+    画像ファイルを1つずつディスクから読んで一時ファイルの ZIP にまとめ、そのパスを返す（全体をメモリに載せない）。
+    ZIP 内のパスは root からの相対パス。画像は圧縮済みなので、deflate せずに格納する。
+    """
+    fd, zip_path = tempfile.mkstemp(suffix=".zip")
+    os.close(fd)
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as zf:
+        for path in paths:
+            if os.path.exists(path):
+                zf.write(path, arcname=os.path.relpath(path, root))
+    return zip_path
+
+
+def discard_conversion(conversion) -> None:
+    """前回の変換結果の ZIP と、保存先を指定しなかったときの一時フォルダを削除する。"""
+    if not conversion:
+        return
+    if conversion["zip_path"] and os.path.exists(conversion["zip_path"]):
+        os.unlink(conversion["zip_path"])
+    if conversion["temporary"]:
+        shutil.rmtree(conversion["folder"], ignore_errors=True)
+
+
+# --- マシン全体の変換の受付（pdf-chapter-splitter と上限を共有。pdf-common/admission.py） ---
+def estimate_conversion_bytes(dpi: int, workers: int = 1, page_budget: int | None = None) -> int:
+    """
+    変換の見積もりメモリ。各ページはエンコードしたらすぐにディスクへ書き出すため、
+    ワーカーごとに1ページ分のレンダリング結果（帯に分けてレンダリングするときは page_budget まで）。
+    """
+    page_bytes = PAGE_BYTES_AT_ZOOM_1 * (dpi / 72.0) ** 2
+    if page_budget:
+        page_bytes = min(page_bytes, page_budget)
+    return int(page_bytes * max(1, workers))
+
+
+@st.cache_resource
+def get_admission() -> AdmissionController:
+    """サーバー内の全セッションで共有する変換の受付（同じマシンの PDF Structure Master とも上限を分け合う）。"""
+    return AdmissionController()
+
+
+@contextmanager
+def conversion_slot(cost_bytes: int):
+    """
+    変換の実行枠を取ってから中の処理を実行する。空くまでは順番待ちの表示を出して待つ。
+    待っている間に画面を操作・離脱すると Streamlit が処理を止めるので、そのときも枠（待ち行列の場所）を返す。
+    """
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    ticket = get_admission().request(st.session_state.session_id, "画像変換", cost_bytes)
+    try:
+        if not ticket.admitted:
+            notice = st.empty()
+            while not ticket.wait(1.0):
+                notice.info(f"⏳ 順番待ち: {ticket.position} 番目（他の変換・書き出しが終わると自動で始まります）")
+            notice.empty()
+        yield
+    finally:
+        ticket.release()
+
+
+# --- 1冊分の変換 ---
+def output_names(pdf_path: str, original_name: str | None = None) -> tuple:
+    """
+    (画像ファイル名に使う短い英数字の名前, 本フォルダ用の短い英数字の名前) を返す（文字化け・長さ対策）。
+    original_name: アップロード時の元のファイル名。パス指定時は親フォルダ名も考慮する。
+    """
+    if original_name:
+        base_name = Path(original_name).stem
+        book_title = base_name
+    else:
+        p = Path(pdf_path)
+        stem = p.stem
+        parent_name = p.parent.name
+        # 親フォルダ名に意味がある場合（日本語や章など）は含めて変換の材料にする
+        if parent_name and parent_name not in (".", "local_data", "pdf_output", ""):
+            base_name = f"{parent_name}_{stem}"
+        else:
+            base_name = stem
+        # 本タイトル（親フォルダ名またはPDF名から）
+        if parent_name and parent_name not in (".", "local_data", "pdf_output", "PDF_PICTURE", ""):
+            book_title = parent_name
+        else:
+            book_title = stem
+    return to_short_alnum_name(base_name), to_short_alnum_name(book_title)
+
+
+def book_output_folder(save_root: Path, short_base: str, short_book: str) -> Path:
+    """
+    保存先: [PDF_PICTURE]/[本フォルダ]/[分割PDFの画像フォルダ]。
+    本フォルダ名は ch1/ch3 などを除いた共通名にし、同じ本は同じフォルダにまとめる。
+    """
+    return save_root / to_book_folder_name(short_book) / f"{short_base}_images"
+
+
+@dataclass(frozen=True)
+class ConversionSettings:
+    """
+    サイドバーで選んだ変換の設定。page_budget は1ページのレンダリングに使う画素メモリの上限
+    （超えるページは帯に分けてレンダリングする。None なら分けない）。
+    """
+    dpi: int
+    encoder: object
+    color_mode: str
+    page_filter: str
+    page_budget: int | None = None
+
+    def manifest_settings(self) -> dict:
+        """
+        マニフェストに記録する設定（変わったら書き出し済みのページを使わない）。
+        帯に分けるかどうかで画素がわずかに変わるので、page_budget も含める。
+        """
+        return {
+            "dpi": self.dpi,
+            "color_mode": self.color_mode,
+            "encoder": encoder_settings(self.encoder),
+            "page_budget": self.page_budget,
+        }
+
+
+@dataclass
+class ConversionReport:
+    """1冊分の変換の結果。written は再利用したものを含め、今回の変換結果として残った画像ファイル。"""
+    pages: int = 0
+    written: list = field(default_factory=list)
+    reused: int = 0
+    rendered: int = 0
+    copied: int = 0
+    blank_pages: int = 0
+    duplicate_pages: int = 0
+    bytes_saved: int = 0
+    seconds: float = 0.0
+    encode_stats: EncodeStats = field(default_factory=EncodeStats)
+
+    @property
+    def up_to_date(self) -> bool:
+        """前回の変換結果がすべて使えて、何も書き出さなかった（変換済み）。"""
+        return self.rendered == 0 and self.copied == 0
+
+
+def convert_pdf(pool, pdf_path: str, doc, pages, output_folder: Path, short_base: str, settings) -> ConversionReport:
+    """
+    pages のページを pool のワーカーでレンダリング・エンコードし、ページ順にすぐ output_folder へ書き出す
+    （メモリにはワーカーごとに1ページ分と、書き出し待ちの数ページ分しか持たない）。
+    同じPDF・同じ設定で書き出し済みのページは、ファイルが記録どおりに残っていれば変換し直さない。
+    doc は重複ページの内容の確認と、空白ページを省いた分のサイズの見積もりに使う。
+    """
+    encoder, page_filter = settings.encoder, settings.page_filter
+    zoom = settings.dpi / 72.0
+    mat = fitz.Matrix(zoom, zoom)
+    pages = list(pages)
+    report = ConversionReport(pages=len(pages))
+    started = time.perf_counter()
+
+    def page_path(page_idx: int) -> Path:
+        return output_folder / f"{short_base}_page_{page_idx + 1:04d}.{encoder.ext}"
+
+    manifest = OutputManifest(output_folder, file_sha256(pdf_path), settings.manifest_settings())
+
+    # 空白・重複ページの判定（低解像度なので、先に全ページ分を済ませてから扱いを決める）
+    # plan: ページ → (種類, 画像を使い回す最初のページ)。plan にないページは通常どおり変換する
+    # 画素が一致したページは、小さな文字・ノンブルだけが違うことがあるので、ページの内容も比べる
+    plan = {}
+    if page_filter != "keep":
+        plan = classify_redundant_pages(
+            pages,
+            pool.map(ProbeTask(pdf_path, i) for i in pages),
+            lambda page_idx: page_content_digest(doc[page_idx]),
+            # 使い回すときは最初の空白ページだけ通常どおり画像化する
+            keep_first_blank=page_filter == "dedupe",
+        )
+
+    # 前回の結果をそのまま使えるページ（出力しないページ以外を、書き出し方ごとに確かめる）
+    reused = {}
+    for page_idx in pages:
+        if page_idx not in plan:
+            kind = PAGE_FULL
+        else:
+            kind = {"placeholder": PAGE_PLACEHOLDER, "dedupe": PAGE_COPY}.get(page_filter)
+        if kind is not None:
+            path = manifest.reusable(page_idx, page_path(page_idx).name, kind)
+            if path is not None:
+                reused[page_idx] = path
+    report.reused = len(reused)
+
+    def render_tasks():
+        for page_idx in pages:
+            if page_idx in reused:
+                continue
+            if page_idx not in plan:
+                yield RenderTask(
+                    pdf_path, page_idx, zoom, encoder, settings.color_mode, encoder.alpha, settings.dpi,
+                    settings.page_budget,
+                )
+            elif page_filter == "placeholder":
+                yield RenderTask(pdf_path, page_idx, _PLACEHOLDER_DPI / 72.0, encoder)
+
+    rendered = pool.map(render_tasks())
+    for page_idx in pages:
+        out_path = page_path(page_idx)
+        if page_idx not in plan:
+            if page_idx not in reused:
+                result = next(rendered)
+                out_path.write_bytes(result.data)
+                manifest.record(page_idx, out_path, PAGE_FULL, result.data)
+                report.encode_stats.add(result.encode_seconds, len(result.data))
+                report.rendered += 1
+            report.written.append(out_path)
+            continue
+        kind, reference = plan[page_idx]
+        if kind == "blank":
+            report.blank_pages += 1
+        else:
+            report.duplicate_pages += 1
+        if page_filter == "dedupe":
+            if page_idx not in reused:
+                shutil.copyfile(page_path(reference), out_path)
+                manifest.record(page_idx, out_path, PAGE_COPY)
+                report.copied += 1
+            report.written.append(out_path)
+            continue
+        if reference is not None:
+            full_size = page_path(reference).stat().st_size
+        else:
+            irect = (doc[page_idx].rect * mat).irect
+            full_size = blank_image_size(irect.width, irect.height, encoder)
+        if page_filter == "skip":
+            report.bytes_saved += full_size
+            continue
+        if page_idx in reused:
+            placeholder_size = out_path.stat().st_size
+        else:
+            placeholder = next(rendered).data
+            out_path.write_bytes(placeholder)
+            manifest.record(page_idx, out_path, PAGE_PLACEHOLDER, placeholder)
+            report.rendered += 1
+            placeholder_size = len(placeholder)
+        report.bytes_saved += max(0, full_size - placeholder_size)
+        report.written.append(out_path)
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def show_conversion_report(report: ConversionReport, settings: ConversionSettings, workers: int) -> None:
+    """1冊分の変換の所要時間・再利用・エンコード・空白/重複ページの集計を表示する。"""
+    st.caption(
+        f"変換: {report.pages} ページ / {report.seconds:.1f} 秒"
+        f"（{report.pages / max(report.seconds, 1e-9):.1f} ページ/秒、ワーカー {workers}）"
+    )
+    if report.reused:
+        st.caption(
+            f"前回の変換結果が残っていた {report.reused} ページは変換し直さずに再利用しました"
+            "（出力フォルダの manifest.jsonl で管理）。"
+        )
+    stats = report.encode_stats
+    if stats.pages:
+        st.caption(
+            f"エンコード（{settings.encoder.label}）: 1ページあたり平均 {stats.ms_per_page:.0f} ms・"
+            f"{stats.bytes_per_page / 1024:.0f} KB"
+            f"（{stats.pages} ページ、合計 {stats.total_bytes / 1024 / 1024:.1f} MB・{stats.seconds:.1f} 秒）"
+        )
+    if settings.page_filter != "keep":
+        st.caption(
+            f"空白ページ {report.blank_pages} / 重複ページ {report.duplicate_pages} を検出し、"
+            f"{report.blank_pages + report.duplicate_pages} ページの高解像度変換を省略しました"
+            f"（出力サイズ 約 {report.bytes_saved / 1024 / 1024:.1f} MB 削減）。"
+        )
+
+
 # ページ設定
 st.set_page_config(
     page_title="PDF→画像 高画質変換",
@@ -145,16 +462,73 @@ dpi_label = st.sidebar.selectbox(
 )
 dpi = dpi_options[dpi_label]
 
-# 画像形式
+# 画像形式（WebP と PNG の圧縮レベル指定は Pillow があるときだけ）
+format_options = {
+    "PNG（可逆・推奨）": "png",
+    "JPEG（軽量）": "jpeg",
+}
+if _HAS_PIL:
+    format_options["WebP（軽量）"] = "webp"
+    format_options["WebP 可逆（PNGより小さい）"] = "webp_lossless"
 fmt = st.sidebar.radio(
     "出力形式",
-    ["PNG（可逆・推奨）", "JPEG（軽量）"],
+    options=list(format_options.keys()),
     index=0,
 )
-use_png = fmt.startswith("PNG")
+output_format = format_options[fmt]
+
+if output_format == "png":
+    encoder = PngEncoder()
+    if _HAS_PIL:
+        png_level_options = {
+            "標準（速い）": PngEncoder(),
+            "1（速い・大きい）": PngEncoder(compress_level=1),
+            "6（バランス）": PngEncoder(compress_level=6),
+            "9（小さい・遅い）": PngEncoder(compress_level=9),
+            "9＋最適化（最小・最も遅い）": PngEncoder(optimize=True),
+        }
+        png_level_label = st.sidebar.selectbox(
+            "PNG圧縮レベル",
+            options=list(png_level_options.keys()),
+            index=0,
+            help="可逆なので画質は同じです。レベルを上げるとファイルは小さくなりますが、変換に時間がかかります。",
+        )
+        encoder = png_level_options[png_level_label]
+elif output_format == "jpeg":
+    encoder = JpegEncoder(quality=st.sidebar.slider("JPEG品質", 70, 100, 95))
+elif output_format == "webp":
+    encoder = WebpEncoder(quality=st.sidebar.slider("WebP品質", 50, 100, 90))
+else:
+    encoder = WebpEncoder(lossless=True)
 
-if not use_png:
-    jpg_quality = st.sidebar.slider("JPEG品質", 70, 100, 95)
+# 色の扱い（白黒ページの自動判定）
+color_options = {
+    "カラー（従来）": "color",
+    "白黒ページはグレースケール（自動判定）": "gray",
+    "白黒ページは2値化（自動判定・PNG向き）": "bilevel",
+}
+color_label = st.sidebar.radio(
+    "色の扱い",
+    options=list(color_options.keys()),
+    index=0,
+    help="文字だけのページを自動で判定し、グレースケール（RGBの1/3のメモリ）や白黒2値で保存します。カラーのページはそのままです。",
+)
+color_mode = color_options[color_label]
+
+# 空白・重複ページの扱い
+page_filter_options = {
+    "すべて画像化（従来）": "keep",
+    "空白・重複ページを出力しない": "skip",
+    "空白・重複ページは低解像度の代替画像にする": "placeholder",
+    "重複ページは最初のページの画像を使い回す": "dedupe",
+}
+page_filter_label = st.sidebar.selectbox(
+    "空白・重複ページ",
+    options=list(page_filter_options.keys()),
+    index=0,
+    help="低解像度で各ページを先に確認し、白紙のページや、前のページとまったく同じページは高解像度の変換を省きます。",
+)
+page_filter = page_filter_options[page_filter_label]
 
 # ページ範囲
 page_range_mode = st.sidebar.radio(
@@ -171,6 +545,42 @@ if page_range_mode == "指定範囲":
     with col2:
         page_end = st.number_input("終了ページ", min_value=1, value=10)
 
+
+def selected_pages(total_pages: int) -> range:
+    """サイドバーのページ範囲を total_pages ページの PDF に当てはめた、変換するページ（0 始まり）。"""
+    page_end_val = min(page_end, total_pages) if page_range_mode == "指定範囲" else total_pages
+    page_start_val = max(1, page_start) if page_range_mode == "指定範囲" else 1
+    page_start_val = min(page_start_val, total_pages)
+    return range(page_start_val - 1, page_end_val)
+
+
+# 並列ワーカー数
+render_workers = st.sidebar.number_input(
+    "並列ワーカー数",
+    min_value=1,
+    max_value=max(DEFAULT_RENDER_WORKERS, os.cpu_count() or 1),
+    value=DEFAULT_RENDER_WORKERS,
+    help="ページを複数のCPUコアで同時にレンダリングします。1 にすると従来どおり1コアで順に変換します。",
+)
+
+# 1ページのメモリ上限（帯に分けて圧縮できる PNG だけ）
+page_budget = None
+if output_format == "png":
+    default_page_budget_mb = DEFAULT_PAGE_BUDGET_BYTES // (1024 * 1024)
+    page_budget_mb = st.sidebar.number_input(
+        "1ページのメモリ上限（MB）",
+        min_value=1,
+        max_value=max(4096, default_page_budget_mb),
+        value=default_page_budget_mb,
+        step=16,
+        help="レンダリングした画素がこれを超える大きなページ（A3・ポスター・高DPI）は、横長の帯に分けて少しずつレンダリング・圧縮します。帯に分けたページは、線や文字の縁のアンチエイリアスがまとめてレンダリングしたときとわずかに変わることがあります。上限を変えると、変換済みのページも変換し直します。",
+    )
+    page_budget = int(page_budget_mb) * 1024 * 1024
+
+settings = ConversionSettings(
+    dpi=dpi, encoder=encoder, color_mode=color_mode, page_filter=page_filter, page_budget=page_budget
+)
+
 # 保存先フォルダ（デフォルト: C:\Users\20171\Learning\PDF_PICTURE）
 st.sidebar.divider()
 st.sidebar.subheader("保存先")
@@ -191,13 +601,14 @@ input_mode = st.radio(
 
 pdf_path = None
 uploaded_file = None
+batch_files = []
 
 if input_mode == "ファイルをアップロード":
     uploaded_file = st.file_uploader("PDFファイル", type=["pdf"])
     if uploaded_file:
-        # 一時ファイルに保存
+        # 一時ファイルに保存（全体を一度にメモリへ読み込まずにコピーする）
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(uploaded_file.read())
+            shutil.copyfileobj(uploaded_file, tmp)
             pdf_path = tmp.name
 
 else:
@@ -207,15 +618,25 @@ else:
         value=default_path,
     )
     if pdf_dir and Path(pdf_dir).exists():
-        pdf_files = list(Path(pdf_dir).rglob("*.pdf"))
+        pdf_files = sorted(Path(pdf_dir).rglob("*.pdf"))
         if pdf_files:
-            selected = st.selectbox(
-                "PDFファイルを選択",
-                [str(f) for f in pdf_files],
-                format_func=lambda x: Path(x).name,
+            convert_all = st.checkbox(
+                "フォルダ内のPDFをまとめて変換（一括変換）",
+                help="見つかったPDFをすべて（または絞り込んだものだけ）順に変換します。変換済みのPDFはスキップします。",
             )
-            if selected:
-                pdf_path = str(selected)  # 文字列に明示的に変換
+            if convert_all:
+                name_filter = st.text_input("ファイル名で絞り込み（部分一致・空欄ならすべて）").strip().lower()
+                batch_files = [f for f in pdf_files if name_filter in str(f.relative_to(pdf_dir)).lower()]
+                with st.expander(f"対象のPDF: {len(batch_files)} 件"):
+                    st.text("\n".join(str(f.relative_to(pdf_dir)) for f in batch_files) or "（該当なし）")
+            else:
+                selected = st.selectbox(
+                    "PDFファイルを選択",
+                    [str(f) for f in pdf_files],
+                    format_func=lambda x: Path(x).name,
+                )
+                if selected:
+                    pdf_path = str(selected)  # 文字列に明示的に変換
         else:
             st.warning(f"フォルダ内にPDFが見つかりません: {pdf_dir}")
 
@@ -228,55 +649,49 @@ if pdf_path:
 
         st.success(f"PDFを読み込みました: **{total_pages}** ページ")
 
-        page_end_val = min(page_end, total_pages) if page_range_mode == "指定範囲" else total_pages
-        page_start_val = max(1, page_start) if page_range_mode == "指定範囲" else 1
-        page_start_val = min(page_start_val, total_pages)
-
-        pages_to_convert = range(page_start_val - 1, page_end_val)  # 0-indexed
+        pages_to_convert = selected_pages(total_pages)  # 0-indexed
         num_pages = len(pages_to_convert)
 
-        st.info(f"変換対象: {num_pages} ページ（{page_start_val}〜{page_end_val}ページ目）")
-        st.caption(f"解像度: {dpi} DPI / 形式: {'PNG' if use_png else 'JPEG'}")
+        st.info(f"変換対象: {num_pages} ページ（{pages_to_convert.start + 1}〜{pages_to_convert.stop}ページ目）")
+        st.caption(f"解像度: {dpi} DPI / 形式: {encoder.label} / 色: {color_label}")
+
+        with st.expander("形式ごとのサイズと速度を比べる"):
+            st.caption("変換対象の先頭ページを現在の解像度・色の設定でレンダリングし、各形式でエンコードします。")
+            if st.button("先頭ページで比較"):
+                candidates = [PngEncoder(), JpegEncoder(quality=95), JpegEncoder(quality=85)]
+                if _HAS_PIL:
+                    candidates[1:1] = [PngEncoder(compress_level=9), PngEncoder(optimize=True)]
+                    candidates += [WebpEncoder(quality=90), WebpEncoder(quality=75), WebpEncoder(lossless=True)]
+                if encoder not in candidates:
+                    candidates.append(encoder)
+                zoom = dpi / 72.0
+                with conversion_slot(estimate_conversion_bytes(dpi)), st.spinner("比較中..."):
+                    pix = render_page_pixmap(doc[pages_to_convert[0]], fitz.Matrix(zoom, zoom), color_mode, alpha=False)
+                    st.dataframe(compare_encoders(pix, candidates), hide_index=True)
 
         if st.button("画像に変換", type="primary"):
-            zoom = dpi / 72.0
-            mat = fitz.Matrix(zoom, zoom)
-            ext = "png" if use_png else "jpg"
             # フォルダ名・ファイル名用: アップロード時は元のファイル名、パス指定時は親フォルダ名も考慮
-            if uploaded_file:
-                base_name = Path(uploaded_file.name).stem
+            short_base, short_book = output_names(pdf_path_str, uploaded_file.name if uploaded_file else None)
+
+            # 前回の変換結果（一時フォルダ・ZIP）を片付ける
+            discard_conversion(st.session_state.pop("conversion", None))
+
+            # 保存先が空欄のときは一時フォルダに書き出す（ZIPでのダウンロード用）
+            save_dir_path = Path(save_dir).resolve() if save_dir.strip() else None
+            if save_dir_path:
+                output_folder = book_output_folder(save_dir_path, short_base, short_book)
             else:
-                p = Path(pdf_path_str)
-                stem = p.stem
-                parent_name = p.parent.name
-                # 親フォルダ名に意味がある場合（日本語や章など）は含めて変換の材料にする
-                if parent_name and parent_name not in (".", "local_data", "pdf_output", ""):
-                    base_name = f"{parent_name}_{stem}"
-                else:
-                    base_name = stem
-
-            with st.spinner("変換中..."):
-                images_data = []
-                for i, page_idx in enumerate(pages_to_convert):
-                    page = doc[page_idx]
-                    pix = page.get_pixmap(matrix=mat, alpha=use_png)
-                    try:
-                        pix.set_dpi(dpi, dpi)
-                    except AttributeError:
-                        pass  # 一部バージョンでは未対応
-
-                    # pix.save() はファイルパスを期待するため、tobytes() を使用
-                    if use_png:
-                        img_bytes = pix.tobytes("png")
-                    else:
-                        # JPEG の場合は一時ファイル経由で品質指定
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-                            tmp_path = tmp.name
-                        pix.save(tmp_path, output="jpg", jpg_quality=jpg_quality)
-                        with open(tmp_path, "rb") as f:
-                            img_bytes = f.read()
-                        os.unlink(tmp_path)
-                    images_data.append((page_idx + 1, img_bytes))
+                output_folder = Path(tempfile.mkdtemp(prefix="pdf_to_image_"))
+            output_folder.mkdir(parents=True, exist_ok=True)
+
+            workers = min(int(render_workers), max(1, num_pages))
+            with (
+                conversion_slot(estimate_conversion_bytes(dpi, workers, page_budget)),
+                st.spinner("変換中..."),
+                RenderPool(workers) as pool,
+            ):
+                report = convert_pdf(pool, pdf_path_str, doc, pages_to_convert, output_folder, short_base, settings)
+            show_conversion_report(report, settings, workers)
 
             doc.close()
 
@@ -287,60 +702,107 @@ if pdf_path:
                 except Exception:
                     pass
 
-            # 保存用に短い英数字のベース名を生成（フォルダ名・ファイル名の文字化け・長さ対策）
-            short_base = to_short_alnum_name(base_name)
-
-            # 本タイトル（親フォルダ名またはPDF名から）を取得し、本フォルダを自動作成
-            if uploaded_file:
-                book_title = Path(uploaded_file.name).stem
-            else:
-                p = Path(pdf_path_str)
-                parent_name = p.parent.name
-                if parent_name and parent_name not in (".", "local_data", "pdf_output", "PDF_PICTURE", ""):
-                    book_title = parent_name
-                else:
-                    book_title = p.stem
-            short_book = to_short_alnum_name(book_title)
-
-            # 保存先: [PDF_PICTURE]/[本フォルダ]/[分割PDFの画像フォルダ]/画像ファイル
-            # 本フォルダ名は ch1/ch3 などを除いた共通名にし、同じ本は同じフォルダにまとめる
-            save_dir_path = Path(save_dir).resolve() if save_dir.strip() else None
-            if save_dir_path:
-                book_folder_name = to_book_folder_name(short_book)
-                book_folder = save_dir_path / book_folder_name
-                book_folder.mkdir(parents=True, exist_ok=True)
-                output_folder_name = f"{short_base}_images"
-                output_folder = book_folder / output_folder_name
-                output_folder.mkdir(parents=True, exist_ok=True)
-                for page_no, img_bytes in images_data:
-                    fname = f"{short_base}_page_{page_no:04d}.{ext}"
-                    out_path = output_folder / fname
-                    out_path.write_bytes(img_bytes)
-                st.success(f"保存しました: **{output_folder}**")
-
-            # ZIPでダウンロード（ZIP内のファイル名も短い英数字に統一）
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-                for page_no, img_bytes in images_data:
-                    name = f"{short_base}_page_{page_no:04d}.{ext}"
-                    zf.writestr(name, img_bytes)
-
-            zip_buffer.seek(0)
-            st.download_button(
-                label=f"📥 画像をZIPでダウンロード ({num_pages}枚)",
-                data=zip_buffer,
-                file_name=f"{short_base}_images_{dpi}dpi.{ext}.zip",
-                mime="application/zip",
-            )
+            # 結果は再実行をまたいで保持し、ZIP はボタンが押されたときだけ作る
+            st.session_state.conversion = {
+                "folder": str(output_folder),
+                "temporary": save_dir_path is None,
+                "files": [str(path) for path in report.written],
+                "zip_name": f"{short_base}_images_{dpi}dpi.{encoder.ext}.zip",
+                "zip_path": None,
+            }
 
     except Exception as e:
         st.error(f"エラー: {e}")
         import traceback
         st.code(traceback.format_exc())
+elif batch_files:
+    st.info(f"一括変換の対象: {len(batch_files)} 件のPDF（ページ範囲の指定は各PDFに当てはめます）")
+    st.caption(f"解像度: {dpi} DPI / 形式: {encoder.label} / 色: {color_label}")
+
+    if st.button(f"{len(batch_files)} 件をまとめて画像に変換", type="primary"):
+        discard_conversion(st.session_state.pop("conversion", None))
+
+        # 保存先は1冊ずつの変換と同じ構成。空欄のときは一時フォルダの下に同じ構成で書き出す
+        temporary = not save_dir.strip()
+        save_root = Path(tempfile.mkdtemp(prefix="pdf_to_image_")) if temporary else Path(save_dir).resolve()
+        workers = int(render_workers)
+        rows = []
+        written = []
+        rendered_pages = skipped_files = 0
+        progress = st.progress(0.0)
+        started = time.perf_counter()
+        # 全ファイルで同じワーカーを使う（プロセスの起動は最初の1回だけ）。実行枠はファイルごとに取り直し、
+        # 一括変換の間も他の人の変換が順番に入れるようにする
+        with RenderPool(workers) as pool:
+            for n, pdf_file in enumerate(batch_files):
+                progress.progress(n / len(batch_files), text=f"{n + 1}/{len(batch_files)}: {pdf_file.name}")
+                short_base, short_book = output_names(str(pdf_file))
+                output_folder = book_output_folder(save_root, short_base, short_book)
+                try:
+                    output_folder.mkdir(parents=True, exist_ok=True)
+                    with (
+                        fitz.open(str(pdf_file)) as book_doc,
+                        conversion_slot(estimate_conversion_bytes(dpi, workers, page_budget)),
+                    ):
+                        report = convert_pdf(
+                            pool, str(pdf_file), book_doc, selected_pages(len(book_doc)),
+                            output_folder, short_base, settings,
+                        )
+                except Exception as e:
+                    rows.append({"PDF": pdf_file.name, "ページ": 0, "変換": 0, "秒": 0.0, "結果": f"エラー: {e}"})
+                    continue
+                written += report.written
+                rendered_pages += report.rendered
+                skipped_files += report.up_to_date
+                rows.append({
+                    "PDF": pdf_file.name,
+                    "ページ": report.pages,
+                    "変換": report.rendered,
+                    "秒": round(report.seconds, 1),
+                    "結果": "変換済みのためスキップ" if report.up_to_date else str(output_folder),
+                })
+        elapsed = time.perf_counter() - started
+        progress.empty()
+
+        st.dataframe(rows, hide_index=True)
+        st.caption(
+            f"合計: {len(batch_files)} 件・{rendered_pages} ページを {elapsed:.1f} 秒で変換"
+            f"（{rendered_pages / max(elapsed, 1e-9):.1f} ページ/秒、ワーカー {workers}）。"
+            f"変換済みのためスキップ: {skipped_files} 件"
+        )
+        st.session_state.conversion = {
+            "folder": str(save_root),
+            "temporary": temporary,
+            "files": [str(path) for path in written],
+            "zip_name": f"pdf_images_{dpi}dpi.{encoder.ext}.zip",
+            "zip_path": None,
+        }
 else:
     st.info("PDFファイルを選択してください。")
 
+# 直前の変換結果（ZIP はボタンが押されたときだけ、保存したファイルから作る）
+conversion = st.session_state.get("conversion")
+if conversion:
+    num_files = len(conversion["files"])
+    if conversion["temporary"]:
+        st.success(f"{num_files} 枚の画像に変換しました。ZIPでダウンロードできます。")
+    else:
+        st.success(f"保存しました: **{conversion['folder']}**")
+    if conversion["zip_path"] is None and st.button(f"📦 ZIPを作成 ({num_files}枚)"):
+        with st.spinner("ZIPを作成中..."):
+            conversion["zip_path"] = build_zip_from_files(conversion["files"], conversion["folder"])
+    if conversion["zip_path"] is not None:
+        # ZIP はクリックされたときに読み込む（再実行のたびに全体をメモリに読み込まない）
+        st.download_button(
+            label=f"📥 画像をZIPでダウンロード ({num_files}枚)",
+            data=Path(conversion["zip_path"]).read_bytes,
+            file_name=conversion["zip_name"],
+            mime="application/zip",
+        )
+
 # フッター
 st.sidebar.divider()
 st.sidebar.caption("調査内容は RESEARCH.md を参照")
 st.sidebar.caption("日本語→安全なファイル名: NFKC＋用語マップ。より自然な変換は pip install python-slugify で有効化")
+if not _HAS_PIL:
+    st.sidebar.caption("WebP 出力と PNG の圧縮レベル指定は pip install pillow で有効化")
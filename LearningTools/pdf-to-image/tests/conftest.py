@@ -0,0 +1,32 @@
+import sys
+from pathlib import Path
+
+import fitz  # PyMuPDF
+import pytest
+
+_APP_DIR = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(_APP_DIR), str(_APP_DIR.parent / "pdf-common")]
+
+# サンプルPDFのページ（0 始まり）: 白黒の文字と塗りのページ、半透明の塗りを含むカラーのページ
+MONO_PAGE = 0
+COLOR_PAGE = 1
+
+
+@pytest.fixture(scope="session")
+def sample_pdf(tmp_path_factory) -> str:
+    """白黒のページとカラーのページからなるサンプルPDFのパス。"""
+    path = tmp_path_factory.mktemp("pdf") / "sample.pdf"
+    doc = fitz.open()
+    mono = doc.new_page(width=300, height=400)
+    for line in range(12):
+        mono.insert_text((30, 50 + line * 26), f"Monochrome body text {line}", fontsize=12)
+    mono.draw_rect(fitz.Rect(30, 360, 270, 380), color=(0, 0, 0), fill=(0.6, 0.6, 0.6))
+    color = doc.new_page(width=300, height=400)
+    color.insert_text((30, 50), "Colour page", fontsize=20, color=(0.1, 0.2, 0.8))
+    color.draw_rect(fitz.Rect(20, 80, 200, 300), color=None, fill=(0.9, 0.3, 0.1))
+    # 半透明の塗り（アルファありでレンダリングすると、色の値が乗算済みになる）
+    color.draw_circle(fitz.Point(190, 250), 90, color=None, fill=(0.1, 0.7, 0.3), fill_opacity=0.5)
+    color.draw_line(fitz.Point(10, 390), fitz.Point(290, 330), color=(0.3, 0.3, 0.3), width=0.7)
+    doc.save(path)
+    doc.close()
+    return str(path)
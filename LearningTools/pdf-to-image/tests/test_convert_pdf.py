@@ -0,0 +1,53 @@
+import fitz  # PyMuPDF
+import pytest
+
+from image_encoders import PngEncoder
+from page_probe import probe_page
+from page_renderer import RenderPool
+
+# 変換の本体は Streamlit のアプリと同じファイルにある
+pytest.importorskip("streamlit")
+from pdf_to_image import ConversionSettings, convert_pdf  # noqa: E402
+
+
+@pytest.fixture
+def near_duplicate_pdf(tmp_path) -> str:
+    """
+    0・1・3 ページは同じ内容、2 ページは低解像度の判定用レンダリングでは区別できない
+    小さなノンブルだけが違うページ。
+    """
+    path = tmp_path / "near_duplicate.pdf"
+    doc = fitz.open()
+    for page_number in (None, None, "p. 12", None):
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((72, 100), "Same body text", fontsize=14)
+        if page_number:
+            page.insert_text((500, 820), page_number, fontsize=0.3)
+    doc.save(path)
+    doc.close()
+    return str(path)
+
+
+def _convert(pdf_path: str, out_dir, page_filter: str):
+    settings = ConversionSettings(dpi=150, encoder=PngEncoder(), color_mode="color", page_filter=page_filter)
+    out_dir.mkdir()
+    with fitz.open(pdf_path) as doc, RenderPool(1) as pool:
+        return convert_pdf(pool, pdf_path, doc, range(4), out_dir, "book", settings)
+
+
+@pytest.mark.parametrize("page_filter", ["skip", "dedupe"])
+def test_low_resolution_match_with_different_content_is_not_a_duplicate(near_duplicate_pdf, tmp_path, page_filter):
+    with fitz.open(near_duplicate_pdf) as doc:
+        assert probe_page(doc[2]) == probe_page(doc[0])
+    report = _convert(near_duplicate_pdf, tmp_path / "out", page_filter)
+    full = _convert(near_duplicate_pdf, tmp_path / "full", "keep")
+    assert report.duplicate_pages == 2
+    images = {path.name: path.read_bytes() for path in report.written}
+    expected = [path.read_bytes() for path in full.written]
+    assert expected[2] != expected[0]
+    # 2 ページは本来の解像度で変換し、0 ページの画像で置き換えない
+    assert images["book_page_0003.png"] == expected[2]
+    if page_filter == "skip":
+        assert sorted(images) == ["book_page_0001.png", "book_page_0003.png"]
+    else:
+        assert [images[f"book_page_{n:04d}.png"] for n in range(1, 5)] == [expected[0]] * 2 + [expected[2], expected[0]]
@@ -0,0 +1,77 @@
+import io
+
+import fitz  # PyMuPDF
+import pytest
+
+import image_encoders
+from conftest import COLOR_PAGE, MONO_PAGE
+from image_encoders import PngEncoder
+from page_renderer import PageBands
+
+# 出力した PNG の画素は Pillow で読んで比べる
+Image = pytest.importorskip("PIL.Image")
+
+_DPI = 144
+# 帯を数本に分け、1本の帯もさらに数回に分けて圧縮する大きさ
+_BAND_BUDGET_BYTES = 200 * 1024
+_CHUNK_BYTES = 16 * 1024
+
+# (ページ, 色の扱い, アルファ, 出力の画像モード)
+_CASES = {
+    "gray": (MONO_PAGE, "gray", False, "L"),
+    "rgb": (COLOR_PAGE, "color", False, "RGB"),
+    "rgba": (COLOR_PAGE, "color", True, "RGBA"),
+}
+
+
+def _decode(data: bytes) -> Image.Image:
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def _max_difference(a: bytes, b: bytes) -> int:
+    assert len(a) == len(b)
+    return max((abs(x - y) for x, y in zip(a, b)), default=0)
+
+
+def _bands_and_reference(sample_pdf, case):
+    """(PageBands, 同じ帯を組み立てた Pixmap を PyMuPDF でエンコードした PNG)。"""
+    page_index, color_mode, alpha, _ = _CASES[case]
+    doc = fitz.open(sample_pdf)
+    zoom = _DPI / 72.0
+    bands = PageBands(doc[page_index], fitz.Matrix(zoom, zoom), color_mode, alpha, _BAND_BUDGET_BYTES)
+    assert bands.rows < bands.height  # 2本以上の帯に分かれる
+    reference = bands.assemble()
+    reference.set_dpi(_DPI, _DPI)
+    return bands, reference.tobytes("png")
+
+
+@pytest.mark.parametrize("encoder", [PngEncoder(), PngEncoder(compress_level=1)], ids=["default", "level1"])
+@pytest.mark.parametrize("case", list(_CASES))
+def test_encode_bands_round_trips_to_the_same_pixels(sample_pdf, monkeypatch, case, encoder):
+    monkeypatch.setattr(image_encoders, "_PNG_CHUNK_BYTES", _CHUNK_BYTES)
+    bands, reference = _bands_and_reference(sample_pdf, case)
+    decoded, expected = _decode(encoder.encode_bands(bands, _DPI)), _decode(reference)
+    assert decoded.mode == expected.mode == _CASES[case][3]
+    assert decoded.size == expected.size == (bands.width, bands.height)
+    assert decoded.info["dpi"] == pytest.approx((_DPI, _DPI), abs=0.1)
+    if bands.alpha:
+        # 乗算済みの色の値を戻すときの丸めが Pillow と MuPDF で1ずれることがある
+        assert decoded.getchannel("A").tobytes() == expected.getchannel("A").tobytes()
+        assert _max_difference(decoded.tobytes(), expected.tobytes()) <= 1
+    else:
+        assert decoded.tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize("case", list(_CASES))
+def test_encode_bands_without_pillow(sample_pdf, monkeypatch, case):
+    monkeypatch.setattr(image_encoders, "_HAS_PIL", False)
+    monkeypatch.setattr(image_encoders, "_PNG_CHUNK_BYTES", _CHUNK_BYTES)
+    bands, reference = _bands_and_reference(sample_pdf, case)
+    data = PngEncoder().encode_bands(bands, _DPI)
+    if bands.alpha:
+        # アルファありは1ページ分に組み立てて PyMuPDF でエンコードする
+        assert data == reference
+    else:
+        assert _decode(data).tobytes() == _decode(reference).tobytes()
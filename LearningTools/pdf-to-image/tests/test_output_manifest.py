@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from output_manifest import MANIFEST_NAME, PAGE_COPY, PAGE_FULL, PAGE_PLACEHOLDER, OutputManifest
+
+_SOURCE = "a" * 64
+_SETTINGS = {"dpi": 300, "color_mode": "color", "encoder": {"type": "PngEncoder"}}
+
+
+def _write_pages(folder, manifest, pages: dict) -> None:
+    """pages（ページ → (ファイル名, 書き出し方, 中身)）を書き出してマニフェストに記録する。"""
+    for page_index, (name, kind, data) in pages.items():
+        path = folder / name
+        path.write_bytes(data)
+        # 変換は書き出した画像をそのまま渡し、コピーしたページはファイルを読ませる
+        manifest.record(page_index, path, kind, data if kind != PAGE_COPY else None)
+
+
+@pytest.fixture
+def converted(tmp_path):
+    """3ページを書き出したあとの出力フォルダ。"""
+    pages = {
+        0: ("p_0001.png", PAGE_FULL, b"page one"),
+        1: ("p_0002.png", PAGE_PLACEHOLDER, b"placeholder"),
+        2: ("p_0003.png", PAGE_COPY, b"page one"),
+    }
+    _write_pages(tmp_path, OutputManifest(tmp_path, _SOURCE, _SETTINGS), pages)
+    return tmp_path, pages
+
+
+def test_resume_reuses_every_recorded_page(converted):
+    folder, pages = converted
+    manifest = OutputManifest(folder, _SOURCE, _SETTINGS)
+    for page_index, (name, kind, _) in pages.items():
+        assert manifest.reusable(page_index, name, kind) == folder / name
+    assert manifest.reusable(3, "p_0004.png", PAGE_FULL) is None
+
+
+def test_resume_keeps_pages_recorded_before_a_torn_line(converted):
+    folder, pages = converted
+    with open(folder / MANIFEST_NAME, "a", encoding="utf-8") as f:
+        f.write('{"page_index": 3, "fi')  # 追記の途中で止まった
+    manifest = OutputManifest(folder, _SOURCE, _SETTINGS)
+    assert sorted(manifest.entries) == [0, 1, 2]
+    assert manifest.reusable(0, "p_0001.png", PAGE_FULL) == folder / "p_0001.png"
+    # 再開後に書き出したページも、次に開いたときに残っている
+    _write_pages(folder, manifest, {3: ("p_0004.png", PAGE_FULL, b"page four")})
+    manifest = OutputManifest(folder, _SOURCE, _SETTINGS)
+    assert sorted(manifest.entries) == [0, 1, 2, 3]
+    assert manifest.reusable(3, "p_0004.png", PAGE_FULL) == folder / "p_0004.png"
+
+
+def test_resume_after_a_record_without_its_line_break(converted):
+    folder, _ = converted
+    path = folder / MANIFEST_NAME
+    path.write_text(path.read_text(encoding="utf-8").rstrip("\n"), encoding="utf-8")
+    manifest = OutputManifest(folder, _SOURCE, _SETTINGS)
+    _write_pages(folder, manifest, {3: ("p_0004.png", PAGE_FULL, b"page four")})
+    assert sorted(OutputManifest(folder, _SOURCE, _SETTINGS).entries) == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize(
+    "source, settings",
+    [("b" * 64, _SETTINGS), (_SOURCE, {**_SETTINGS, "dpi": 600}), (_SOURCE, {**_SETTINGS, "color_mode": "gray"})],
+    ids=["source", "dpi", "color_mode"],
+)
+def test_different_source_or_settings_start_a_new_manifest(converted, source, settings):
+    folder, pages = converted
+    manifest = OutputManifest(folder, source, settings)
+    assert manifest.entries == {}
+    assert all(manifest.reusable(pi, name, kind) is None for pi, (name, kind, _) in pages.items())
+    # 古い記録は捨てて、新しい設定のヘッダーだけにする
+    lines = (folder / MANIFEST_NAME).read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["settings"] for line in lines] == [settings]
+    # 元の設定に戻しても、書き直したあとのマニフェストからは再利用しない
+    assert OutputManifest(folder, _SOURCE, _SETTINGS).reusable(0, "p_0001.png", PAGE_FULL) is None
+
+
+def test_changed_or_missing_files_are_not_reused(converted):
+    folder, _ = converted
+    (folder / "p_0001.png").write_bytes(b"page ONE")  # 同じ大きさで中身が違う
+    (folder / "p_0002.png").write_bytes(b"longer placeholder")
+    (folder / "p_0003.png").unlink()
+    manifest = OutputManifest(folder, _SOURCE, _SETTINGS)
+    assert manifest.reusable(0, "p_0001.png", PAGE_FULL) is None
+    assert manifest.reusable(1, "p_0002.png", PAGE_PLACEHOLDER) is None
+    assert manifest.reusable(2, "p_0003.png", PAGE_COPY) is None
+
+
+def test_different_kind_or_file_name_is_not_reused(converted):
+    folder, _ = converted
+    manifest = OutputManifest(folder, _SOURCE, _SETTINGS)
+    # 前回は代替画像にしたページを、今回は通常どおり変換する
+    assert manifest.reusable(1, "p_0002.png", PAGE_FULL) is None
+    # 出力ファイル名の付け方が変わった
+    assert manifest.reusable(0, "book_0001.png", PAGE_FULL) is None
+
+
+def test_rewritten_page_replaces_the_earlier_record(converted):
+    folder, _ = converted
+    manifest = OutputManifest(folder, _SOURCE, _SETTINGS)
+    _write_pages(folder, manifest, {1: ("p_0002.png", PAGE_FULL, b"page two")})
+    manifest = OutputManifest(folder, _SOURCE, _SETTINGS)
+    assert manifest.reusable(1, "p_0002.png", PAGE_FULL) == folder / "p_0002.png"
+    assert manifest.reusable(1, "p_0002.png", PAGE_PLACEHOLDER) is None